@@ -1,162 +1,200 @@
+import argparse
 import asyncio
+from collections.abc import Callable
+from datetime import datetime, timedelta
+from pathlib import Path
+from zoneinfo import ZoneInfo
 
-import folium
 from dotenv import load_dotenv
-
-from apartment_scraper import pkg_path, willhaben
-from apartment_scraper.models import Model
+from loguru import logger
+
+from apartment_scraper import (
+    crawl,
+    districts,
+    duplicates,
+    export,
+    id_sets,
+    maps,
+    pkg_path,
+    scheduler,
+    scoring,
+    tracing,
+    willhaben,
+    work_queue,
+)
+from apartment_scraper.models import MapFilter, Model
 
 
 # Loads the environment variables from .env file
 load_dotenv()
 
-def main() -> None:
-    """Main function of the application."""
-    model = Model()
-    areas = [willhaben.AreaId.WIEN.ALL]
-
-    for area in areas:
-        wh = willhaben.Request(area_id=area)
-        apartments = asyncio.run(willhaben.get_data(url=wh.kauf_haus_url))
-        model.add_apartments(apartments)
-
-
-def get_color(price_per_area: int) -> str:
-    """Determines the color category based on the price per area.
+def setup_search(model: Model) -> int:
+    """Create the trigram index of the search once, and set the search text of apartments stored before it.
 
     Args:
-        price_per_area (int): The price per area of the apartment.
+        model (Model): The database model.
 
     Returns:
-        str: The color category of the apartment. Possible values are "green", "yellow", "orange", or "red".
-
-    Raises:
-        None
+        int: The number of apartments that got a search text.
     """
-    cheap = 2_000
-    average = 3_500
-    expensive = 5_000
-
-    if price_per_area < cheap:
-        return "green"
-    elif price_per_area < average:
-        return "yellow"
-    elif price_per_area < expensive:
-        return "orange"
-    else:
-        return "red"
+    model.create_search_index()
+    return model.fill_search_texts()
 
 
-def get_free_area(free_area: int) -> str:
-    """Get a color based on the free area (garden etc.) of the apartment.
-
-    Args:
-        free_area (int): An integer representing the size of the free area.
+# Commands that compute data derived from the stored apartments, without crawling: name -> (help, function).
+DERIVED_DATA_COMMANDS: dict[str, tuple[str, Callable[[Model], object]]] = {
+    "dedupe": ("Detect listings of the same apartment and store their clusters.", duplicates.assign_clusters),
+    "districts": ("Assign the apartments to the districts their coordinates are in.", districts.assign_districts),
+    "score": ("Compute the deal score of all apartments.", scoring.score_deals),
+    "search-index": ("Set up the trigram index of the search and fill in missing search texts.", setup_search),
+}
 
-    Returns:
-        str: Returns a string with the name of a color.
-    """
-    no_area = 0
-    small_area = 50
-    big_area = 200
-
-    if free_area == no_area:
-        return "red"
-    elif free_area < small_area:
-        return "orange"
-    elif free_area < big_area:
-        return "yellow"
-    else:
-        return "green"
+def main() -> None:
+    """Main function of the application."""
+    model = Model()
+    areas = [willhaben.AreaId.WIEN.ALL]
+    seen = id_sets.IdSet()  # listings found in one area are skipped in the following ones
 
+    for area in areas:
+        asyncio.run(crawl.crawl(model, area, "kauf_haus", seen=seen))
 
-def get_rooms_color(rooms: float) -> str:
-    """Determines the color category based on the number of rooms.
+    with tracing.span("refresh_market_stats"):
+        model.refresh_market_stats()
+    with tracing.span("assign_clusters"):
+        duplicates.assign_clusters(model)
+    with tracing.span("assign_districts"):
+        districts.assign_districts(model)
+    with tracing.span("score_deals"):
+        scoring.score_deals(model)
+    with tracing.span("build_map"):
+        maps.MapArtifacts(model).build()
 
-    Args:
-        rooms (int): The number of rooms in the apartment.
 
-    Returns:
-        str: The color category of the apartment. Possible values are "red", "orange", "yellow", or "green".
+def create_map(map_filter: MapFilter) -> None:
+    """Create a map with the apartments in the database and open it in the browser.
 
-    Raises:
-        None
+    Args:
+        map_filter (MapFilter): Criteria of the apartments to show.
     """
-    small_apartment = 3
-    average_apartment = 4
-    big_apartment = 5
-
-    if rooms < small_apartment:
-        return "red"
-    elif rooms < average_apartment:
-        return "orange"
-    elif rooms < big_apartment:
-        return "yellow"
-    else:
-        return "green"
+    maps.render_map(Model(), map_filter).show_in_browser()
 
 
-def get_price_color(price: float) -> str:
-    """Determines the color category based on the price of the apartment.
+def export_data(path: Path, file_format: str, partition_by: list[str], include_gone: bool) -> None:
+    """Export the apartments table to a columnar file for analytics.
 
     Args:
-        price (int): The price of the apartment.
-
-    Returns:
-        str: The color category of the apartment. Possible values are "green", "yellow", "orange", or "red".
-
-    Raises:
-        None
-
-    Examples:
-        ```python
-        color = get_price_color(300000)
-        print(color)  # Output: "yellow"
-        ```
+        path (Path): The output file, or the output directory when partitioning.
+        file_format (str): Either "parquet" or "arrow".
+        partition_by (list[str]): Columns to partition a Parquet export by.
+        include_gone (bool): Also export the apartments that are no longer listed.
     """
-    cheap_apartment = 250_000
-    average_apartment = 300_000
-    expensive_apartment = 350_000
-
-    if price < cheap_apartment:
-        return "green"
-    elif price < average_apartment:
-        return "yellow"
-    elif price < expensive_apartment:
-        return "orange"
+    model = Model()
+    if file_format == "arrow":
+        export.write_arrow(model, path, include_gone=include_gone)
     else:
-        return "red"
+        export.write_parquet(model, path, partition_by=partition_by, include_gone=include_gone)
 
 
-def create_map() -> None:
-    """Create a map with all apartments in the database."""
-    base_map = folium.Map(location=[48.20849, 16.37208], zoom_start=11)
+def purge_gone(retention: timedelta) -> None:
+    """Delete the apartments that are gone for longer than the retention.
 
-    folium.GeoJson("bezirke_95_geo.json").add_to(base_map)
-
-    model = Model()
-    apartments = model.get_map_data()
-
-    for apartment in apartments:
-        if not apartment.coordinates:
-            continue
-        folium.Circle(
-            location=apartment.coordinates.split(","),
-            tooltip=(
-                f"Price: {apartment.price}<br>Area: {apartment.area}<br>Rooms: {apartment.rooms}<br>"
-                "Price/m2: {apartment.price_per_area}<br>Free area: {apartment.free_area}"
-            ),
-            popup=f"<a href='{apartment.url}'>{apartment.apartment_id}</a>",
-            color=get_rooms_color(apartment.rooms),
-            radius=100,
-            fill=True,
-            fillOpacity=0.4,
-            fillColor=get_price_color(apartment.price),
-        ).add_to(base_map)
-
-    base_map.show_in_browser()
+    Args:
+        retention (timedelta): How long an apartment is kept after it is gone.
+    """
+    deleted = Model().delete_gone_apartments(before=datetime.now(tz=ZoneInfo("UTC")) - retention)
+    logger.info(f"Deleted {deleted} apartments gone for longer than {retention}")
+
+
+def cli() -> None:
+    """Command line interface of the application."""
+    parser = argparse.ArgumentParser(prog="apartment_scraper")
+    subparsers = parser.add_subparsers(dest="command")
+    crawl_parser = subparsers.add_parser("crawl", help="Crawl willhaben and store the apartments in the database.")
+    crawl_parser.add_argument("--trace", type=Path, help="Append OTLP/JSON spans of the crawl stages to this file.")
+    schedule_parser = subparsers.add_parser("schedule", help="Crawl periodically, as configured in a TOML file.")
+    schedule_parser.add_argument("config", type=Path, help="TOML file with a [[jobs]] table per crawl job.")
+    schedule_parser.add_argument(
+        "--max-concurrency", type=int, default=2, help="Max number of crawls running at the same time."
+    )
+    schedule_parser.add_argument("--trace", type=Path, help="Append OTLP/JSON spans of the crawl stages to this file.")
+    enqueue_parser = subparsers.add_parser("enqueue", help="Add the crawl of a category to the crawl work queue.")
+    enqueue_parser.add_argument("area", help="Name of the area in AreaId, e.g. WIEN.ALL.")
+    enqueue_parser.add_argument("category", choices=willhaben.CATEGORIES)
+    enqueue_parser.add_argument("--priority", type=int, default=0, help="Tasks with a lower priority run first.")
+    enqueue_parser.add_argument("--pages-per-task", type=int, default=work_queue.PAGES_PER_TASK)
+    worker_parser = subparsers.add_parser("worker", help="Crawl the tasks of the crawl work queue.")
+    worker_parser.add_argument("--concurrency", type=int, default=1, help="Number of tasks crawled at the same time.")
+    worker_parser.add_argument("--lease", type=float, default=120, help="Lease of a claimed task in seconds.")
+    for command, (help_text, _) in DERIVED_DATA_COMMANDS.items():
+        subparsers.add_parser(command, help=help_text)
+    subparsers.add_parser("purge-gone", help="Delete the apartments that are gone for a while.").add_argument(
+        "--days", type=float, default=90, help="Days an apartment is kept after it is gone."
+    )
+    map_parser = subparsers.add_parser("map", help="Create a map with the apartments in the database.")
+    map_parser.add_argument("--min-post-code", type=int, default=maps.DEFAULT_MAP_FILTER.min_post_code)
+    map_parser.add_argument("--max-post-code", type=int, default=maps.DEFAULT_MAP_FILTER.max_post_code)
+    map_parser.add_argument("--min-rooms", type=float, default=maps.DEFAULT_MAP_FILTER.min_rooms)
+    map_parser.add_argument("--max-price", type=float, default=maps.DEFAULT_MAP_FILTER.max_price)
+    map_parser.add_argument("--include-projects", action="store_true", help="Also show projects of new buildings.")
+
+    export_parser = subparsers.add_parser("export", help="Export the apartments table to Parquet or Arrow.")
+    export_parser.add_argument("path", type=Path, help="Output file, or output directory when partitioning.")
+    export_parser.add_argument("--format", dest="file_format", choices=["parquet", "arrow"], default="parquet")
+    export_parser.add_argument(
+        "--partition-by",
+        nargs="+",
+        choices=export.PARTITION_COLUMNS,
+        default=[],
+        help="Write a hive partitioned Parquet dataset.",
+    )
+    export_parser.add_argument("--include-gone", action="store_true", help="Also export apartments no longer listed.")
+
+    args = parser.parse_args()
+    match args.command:
+        case "crawl":
+            if args.trace:
+                tracing.enable(args.trace)
+            main()
+        case "schedule":
+            if args.trace:
+                tracing.enable(args.trace)
+            jobs = scheduler.load_jobs(args.config)
+            asyncio.run(scheduler.Scheduler(Model(), jobs, max_concurrency=args.max_concurrency).run())
+        case "enqueue":
+            asyncio.run(
+                work_queue.enqueue_crawl(
+                    Model(),
+                    willhaben.AreaId.resolve(args.area),
+                    args.category,
+                    priority=args.priority,
+                    pages_per_task=args.pages_per_task,
+                )
+            )
+        case "worker":
+            worker = work_queue.Worker(Model(), concurrency=args.concurrency, lease_seconds=args.lease)
+            asyncio.run(worker.run())
+        case command if command in DERIVED_DATA_COMMANDS:
+            _, compute = DERIVED_DATA_COMMANDS[command]
+            compute(Model())
+        case "purge-gone":
+            purge_gone(timedelta(days=args.days))
+        case "export":
+            if args.partition_by and args.file_format != "parquet":
+                parser.error("--partition-by is only supported for Parquet exports")
+            export_data(args.path, args.file_format, args.partition_by, args.include_gone)
+        case "map":
+            create_map(
+                MapFilter(
+                    min_post_code=args.min_post_code,
+                    max_post_code=args.max_post_code,
+                    min_rooms=args.min_rooms,
+                    max_price=args.max_price,
+                    include_projects=args.include_projects,
+                )
+            )
+        case _:
+            create_map(maps.DEFAULT_MAP_FILTER)
 
 
 if __name__ == "__main__":
-    create_map()
-    # main()
+    cli()
@@ -1,21 +1,92 @@
+import asyncio
+import json
+import os
+import tempfile
+from collections.abc import AsyncIterator
+from pathlib import Path
 from typing import TYPE_CHECKING
 
-from fastapi import FastAPI, HTTPException, Response
+import orjson
+import prometheus_client
+from fastapi import BackgroundTasks, FastAPI, HTTPException, Response
 from fastapi.exceptions import ResponseValidationError
-from fastapi.responses import PlainTextResponse
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
 from loguru import logger
 
-from apartment_scraper import schemas
-from apartment_scraper.models import Apartment, Model
+from apartment_scraper import districts, export, live, map_tiles, maps, metrics, pkg_path, schemas, snapshot
+from apartment_scraper.models import (
+    SORT_COLUMNS,
+    Apartment,
+    ApartmentQuery,
+    ChangeCursor,
+    CrawlRun,
+    MarketStats,
+    Model,
+    SavedSearch,
+)
 
 
 if TYPE_CHECKING:
     from starlette.requests import Request
 
 MAX_PAGE_SIZE = 500  # max number of apartments to return per page
+MIN_SEARCH_LENGTH = 3  # shorter searches have too few trigrams to be similar to anything
+APARTMENT_COLUMNS = list(schemas.ApartmentSchema.__fields__)
+LIVE_KEEPALIVE = 15  # seconds between keep-alive comments on an idle live feed
 
 app = FastAPI()
+app.add_middleware(metrics.PrometheusMiddleware, excluded_paths=("/metrics", "/apartments/live"))
 model = Model()
+# With READ_SNAPSHOT=1 the read queries are answered from a copy of the apartments in memory instead of the database.
+read_snapshot = snapshot.SnapshotStore(model) if os.environ.get("READ_SNAPSHOT") == "1" else None
+reader: Model | snapshot.SnapshotStore = read_snapshot or model
+broker = live.Broker()
+tile_index = map_tiles.TileIndexCache(reader)
+map_artifacts = maps.MapArtifacts(model)
+listener: live.PostgresListener | None = None
+
+
+def load_live_messages(apartment_ids: list[int]) -> list[bytes]:
+    """Load newly inserted apartments and encode them as JSON messages for the live feed.
+
+    Args:
+        apartment_ids (list[int]): The ids of the inserted apartments.
+
+    Returns:
+        list[bytes]: One JSON encoded apartment per message.
+    """
+    rows = model.get_apartment_rows(apartment_ids, columns=APARTMENT_COLUMNS)
+    return [orjson.dumps(dict(zip(APARTMENT_COLUMNS, row, strict=True))) for row in rows]
+
+
+@app.on_event("startup")
+def start_live_listener() -> None:
+    """Start listening for newly inserted apartments, which is only supported on PostgreSQL."""
+    global listener  # noqa: PLW0603
+    if model.engine.dialect.name == "postgresql":
+        listener = live.PostgresListener(model.engine, broker, load=load_live_messages)
+        listener.start()
+
+
+@app.on_event("shutdown")
+def stop_live_listener() -> None:
+    """Stop listening for newly inserted apartments."""
+    if listener is not None:
+        listener.stop()
+
+
+@app.on_event("startup")
+def start_read_snapshot() -> None:
+    """Load the snapshot of the apartments and keep it up to date, if it is enabled."""
+    if read_snapshot is not None:
+        read_snapshot.start()
+
+
+@app.on_event("shutdown")
+def stop_read_snapshot() -> None:
+    """Stop refreshing the snapshot of the apartments."""
+    if read_snapshot is not None:
+        read_snapshot.stop()
 
 
 @app.exception_handler(ResponseValidationError)
@@ -54,63 +125,325 @@ def read_root() -> dict[str, str]:
     return {"Hello": "World"}
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def query_metrics() -> Response:
+    """Metrics of the API, the database and the crawler in the Prometheus text format.
+
+    Returns:
+        Response: The metrics of this process.
+    """
+    return Response(content=prometheus_client.generate_latest(), media_type=prometheus_client.CONTENT_TYPE_LATEST)
+
+
 @app.get(
     "/apartments/",
     response_model=dict[str, int | list[schemas.ApartmentSchema]],
 )
-def query_all_apartments(
-    pagesize: int = 100, page: int = 0
-) -> dict[str, int | list[Apartment]]:
+def query_all_apartments(pagesize: int = 100, page: int = 0, one_per_cluster: bool = False) -> Response:
     """Endpoint to get all apartments from the database.
 
     Using pagination to limit the number of apartments returned per page.
 
+    The rows are selected as plain tuples and encoded straight to JSON, skipping the per row validation into
+    ApartmentSchema. The response model is still declared, so the OpenAPI schema is unchanged.
+
     Args:
         pagesize (int, optional): The page size. Defaults to 100.
         page (int, optional): What page to return. Defaults to 0.
+        one_per_cluster (bool, optional): Return a single listing per apartment that is listed more than once, e.g. on
+            several platforms. Defaults to False.
 
     Raises:
         HTTPException: In case of demanding a page size greater than 500.
 
     Returns:
-        dict[str, int | list[Apartment]]: Returns a list of data regarding the query as well as the data itself.
+        Response: A JSON response with data regarding the query as well as the data itself.
     """
     if pagesize > MAX_PAGE_SIZE:
         raise HTTPException(
             status_code=413, detail="Pagesize cannot be greater than 500"
         )
-    data, elements, count = model.get_paged_apartments(page=page, pagesize=pagesize)
-    return {
+    columns, rows, elements, count = reader.get_paged_apartment_rows(
+        page=page, pagesize=pagesize, columns=APARTMENT_COLUMNS, one_per_cluster=one_per_cluster
+    )
+    content = {
         "pagesize": pagesize,
         "page": page,
         "fetched_elements": elements,
         "total_elements": count,
-        "data": data,
+        "data": [dict(zip(columns, row, strict=True)) for row in rows],
     }
+    return Response(content=orjson.dumps(content), media_type="application/json")
+
+
+@app.get(
+    "/apartments/changes",
+    response_model=schemas.ChangeFeedSchema,
+)
+def query_apartment_changes(since: str | None = None, limit: int = 100) -> schemas.ChangeFeedSchema:
+    """Endpoint to get the apartments that changed since the last sync.
+
+    Start without a cursor to get all apartments, then pass the returned cursor as `since` to only get the apartments
+    that were inserted, updated or deleted after that. Deleted apartments come without data.
+
+    Args:
+        since (str | None, optional): The cursor returned by the previous request. Defaults to None.
+        limit (int, optional): The max number of changes to return. Defaults to 100.
+
+    Raises:
+        HTTPException: In case of an invalid cursor or demanding a limit greater than 500.
+
+    Returns:
+        schemas.ChangeFeedSchema: The changes in order, the cursor to continue from and whether there are more.
+    """
+    if limit > MAX_PAGE_SIZE:
+        raise HTTPException(
+            status_code=413, detail="Limit cannot be greater than 500"
+        )
+    try:
+        cursor = ChangeCursor.decode(since) if since else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+
+    changes = model.get_changes(since=cursor, limit=limit)
+    if changes:
+        cursor = changes[-1].cursor
+    return schemas.ChangeFeedSchema(
+        changes=[
+            schemas.ChangeSchema(
+                apartment_id=change.apartment_id,
+                deleted=change.deleted,
+                data=schemas.ApartmentSchema(**change.apartment.dict()) if change.apartment else None,
+            )
+            for change in changes
+        ],
+        cursor=cursor.encode() if cursor else None,
+        has_more=len(changes) == limit,
+    )
+
+
+@app.get("/apartments/live", response_class=StreamingResponse)
+async def stream_new_apartments() -> StreamingResponse:
+    """Push newly inserted apartments to the client as server-sent events.
+
+    Each apartment is sent as an `apartment` event with the same JSON as `/apartments/{apartment_id}`. A client that
+    can't keep up is sent a `dropped` event and disconnected, and should catch up using `/apartments/changes`.
+
+    Returns:
+        StreamingResponse: An endless `text/event-stream` response.
+    """
+    subscription = broker.subscribe()
+
+    async def events() -> AsyncIterator[bytes]:
+        try:
+            while True:
+                try:
+                    message = await asyncio.wait_for(subscription.get(), timeout=LIVE_KEEPALIVE)
+                except TimeoutError:
+                    yield b": keep-alive\n\n"
+                    continue
+                if message is None:
+                    yield b"event: dropped\ndata: {}\n\n"
+                    return
+                yield b"event: apartment\ndata: " + message + b"\n\n"
+        finally:
+            broker.unsubscribe(subscription)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get(
+    "/apartments/search",
+    response_model=dict[str, str | int | list[schemas.ApartmentSchema]],
+)
+def search_apartments(q: str, limit: int = 20, one_per_cluster: bool = False) -> Response:
+    """Endpoint to search the apartments by street, post code or neighbourhood, tolerating typos.
+
+    E.g. "Praterstrase" finds the apartments on the Praterstraße. The search always reads the database, which looks it
+    up in a trigram index on PostgreSQL, see `Model.search_apartment_rows`.
+
+    Args:
+        q (str): The search.
+        limit (int, optional): The max number of apartments to return. Defaults to 20.
+        one_per_cluster (bool, optional): Return a single listing per apartment that is listed more than once.
+            Defaults to False.
+
+    Raises:
+        HTTPException: In case of a search shorter than 3 characters or demanding a limit greater than 500.
+
+    Returns:
+        Response: A JSON response with the best matching apartments, best first.
+    """
+    if limit > MAX_PAGE_SIZE:
+        raise HTTPException(
+            status_code=413, detail="Limit cannot be greater than 500"
+        )
+    if len(q.strip()) < MIN_SEARCH_LENGTH:
+        raise HTTPException(
+            status_code=400, detail=f"The search needs at least {MIN_SEARCH_LENGTH} characters"
+        )
+    rows = model.search_apartment_rows(q, columns=APARTMENT_COLUMNS, limit=limit, one_per_cluster=one_per_cluster)
+    content = {
+        "q": q,
+        "fetched_elements": len(rows),
+        "data": [dict(zip(APARTMENT_COLUMNS, row, strict=True)) for row in rows],
+    }
+    return Response(content=orjson.dumps(content), media_type="application/json")
+
+
+@app.get(
+    "/apartments/top",
+    response_model=dict[str, int | list[schemas.ApartmentSchema]],
+)
+def get_top_apartments(k: int = 20, one_per_cluster: bool = False) -> Response:
+    """Endpoint to get the best deals, the apartments with the highest deal score.
+
+    The deal score rates the price per m² against the other apartments of the district, plus the rooms, the free area
+    and the floor, see `scoring.deal_scores`. It is read from an index, see `Model.get_top_apartment_rows`.
+
+    Args:
+        k (int, optional): The number of apartments to return. Defaults to 20.
+        one_per_cluster (bool, optional): Return a single listing per apartment that is listed more than once.
+            Defaults to False.
+
+    Raises:
+        HTTPException: In case of demanding more than 500 apartments.
+
+    Returns:
+        Response: A JSON response with the apartments, best deal first.
+    """
+    if k > MAX_PAGE_SIZE:
+        raise HTTPException(
+            status_code=413, detail="k cannot be greater than 500"
+        )
+    rows = reader.get_top_apartment_rows(k, columns=APARTMENT_COLUMNS, one_per_cluster=one_per_cluster)
+    content = {
+        "fetched_elements": len(rows),
+        "data": [dict(zip(APARTMENT_COLUMNS, row, strict=True)) for row in rows],
+    }
+    return Response(content=orjson.dumps(content), media_type="application/json")
+
+
+@app.get(
+    "/apartments/query",
+    response_model=dict[str, int | list[schemas.ApartmentSchema]],
+)
+def query_apartments(  # noqa: PLR0913
+    min_price: float | None = None,
+    max_price: float | None = None,
+    min_area: int | None = None,
+    max_area: int | None = None,
+    min_rooms: float | None = None,
+    max_rooms: float | None = None,
+    max_price_per_area: float | None = None,
+    post_code: int | None = None,
+    district: int | None = None,
+    property_type: str | None = None,
+    free_area_type: str | None = None,
+    one_per_cluster: bool = False,
+    sort_by: str = "id",
+    descending: bool = False,
+    limit: int = 100,
+    offset: int = 0,
+) -> Response:
+    """Endpoint to filter and sort the apartments.
+
+    A criterion that is not given matches every apartment, apartments without a value never match a criterion on it.
+    Apartments are sorted by `sort_by`, with missing values last and ties in the order of their id.
+
+    Args:
+        min_price (float | None, optional): The lowest price. Defaults to None.
+        max_price (float | None, optional): The highest price. Defaults to None.
+        min_area (int | None, optional): The smallest area in m². Defaults to None.
+        max_area (int | None, optional): The largest area in m². Defaults to None.
+        min_rooms (float | None, optional): The fewest rooms. Defaults to None.
+        max_rooms (float | None, optional): The most rooms. Defaults to None.
+        max_price_per_area (float | None, optional): The highest price per m². Defaults to None.
+        post_code (int | None, optional): The post code. Defaults to None.
+        district (int | None, optional): The code of the district, see `districts.assign_districts`. Defaults to None.
+        property_type (str | None, optional): The property type, e.g. "Wohnung". Defaults to None.
+        free_area_type (str | None, optional): A type of free area the apartment has, e.g. "Balkon". Defaults to None.
+        one_per_cluster (bool, optional): Return a single listing per apartment that is listed more than once.
+            Defaults to False.
+        sort_by (str, optional): The column to sort by, one of SORT_COLUMNS. Defaults to "id".
+        descending (bool, optional): Sort in descending order. Defaults to False.
+        limit (int, optional): The max number of apartments to return. Defaults to 100.
+        offset (int, optional): The number of matching apartments to skip. Defaults to 0.
+
+    Raises:
+        HTTPException: In case of an unknown sort column or demanding a limit greater than 500.
+
+    Returns:
+        Response: A JSON response with the number of matching apartments and a page of them.
+    """
+    if limit > MAX_PAGE_SIZE:
+        raise HTTPException(
+            status_code=413, detail="Limit cannot be greater than 500"
+        )
+    if sort_by not in SORT_COLUMNS:
+        raise HTTPException(
+            status_code=400, detail=f"Cannot sort by {sort_by}, choose from {', '.join(SORT_COLUMNS)}"
+        )
+    query = ApartmentQuery(
+        min_price=min_price,
+        max_price=max_price,
+        min_area=min_area,
+        max_area=max_area,
+        min_rooms=min_rooms,
+        max_rooms=max_rooms,
+        max_price_per_area=max_price_per_area,
+        post_code=post_code,
+        district=district,
+        property_type=property_type,
+        free_area_type=free_area_type,
+        one_per_cluster=one_per_cluster,
+        sort_by=sort_by,
+        descending=descending,
+    )
+    columns, rows, elements, count = reader.query_apartment_rows(
+        query, columns=APARTMENT_COLUMNS, limit=limit, offset=offset
+    )
+    content = {
+        "limit": limit,
+        "offset": offset,
+        "fetched_elements": elements,
+        "total_elements": count,
+        "data": [dict(zip(columns, row, strict=True)) for row in rows],
+    }
+    return Response(content=orjson.dumps(content), media_type="application/json")
 
 
 @app.get(
     "/apartments/{apartment_id}",
-    response_model=schemas.ApartmentSchema,
+    response_model=schemas.ApartmentDetailSchema,
 )
-def query_apartment_by_id(apartment_id: int) -> Apartment:
-    """Retrieves an apartment by its ID.
+def query_apartment_by_id(apartment_id: int) -> Response:
+    """Retrieves an apartment by its ID, with the URLs of its images.
+
+    Like the list of apartments, the row is encoded straight to JSON, without building an Apartment object. The image
+    URLs are only returned here, and always read from the database.
 
     Args:
         apartment_id (int): The ID of the apartment.
 
     Returns:
-        Apartment: The apartment object.
+        Response: A JSON response with the apartment.
 
     Raises:
         HTTPException: Raised when the apartment with the given ID is not found.
     """
-    apartment = model.get_apartment_by_id(apartment_id)
-    if apartment is None:
+    rows = reader.get_apartment_rows([apartment_id], columns=APARTMENT_COLUMNS)
+    if not rows:
         raise HTTPException(
             status_code=404, detail=f"Apartment {apartment_id} not found"
         )
-    return apartment
+    apartment = dict(zip(APARTMENT_COLUMNS, rows[0], strict=True))
+    apartment["image_urls"] = model.get_image_urls([apartment_id]).get(apartment_id, [])
+    return Response(content=orjson.dumps(apartment), media_type="application/json")
 
 
 @app.put(
@@ -126,3 +459,253 @@ def update_prio_of_apartment(
             status_code=404, detail=f"Apartment {apartment_id} not found"
         )
     return Response(status_code=204)
+
+
+@app.put(
+    "/apartments/",
+    response_model=schemas.PrioUpdateResultSchema,
+)
+def update_prio_of_apartments(prios: list[schemas.PrioUpdateSchema]) -> schemas.PrioUpdateResultSchema:
+    """Function to update the priority of several apartments in a single transaction.
+
+    If an apartment_id is given more than once, the last priority is used.
+
+    Args:
+        prios (list[schemas.PrioUpdateSchema]): The new priorities.
+
+    Raises:
+        HTTPException: In case of more updates than the max page size.
+
+    Returns:
+        schemas.PrioUpdateResultSchema: The number of updated apartments and the ids that were not found.
+    """
+    if len(prios) > MAX_PAGE_SIZE:
+        raise HTTPException(
+            status_code=413, detail=f"Cannot update more than {MAX_PAGE_SIZE} apartments at once"
+        )
+    new_prios = {update.apartment_id: update.prio for update in prios}
+    not_found = model.update_apartment_prios(new_prios)
+    return schemas.PrioUpdateResultSchema(updated=len(new_prios) - len(not_found), not_found=not_found)
+
+
+@app.get("/stats/", response_model=list[schemas.MarketStatsSchema])
+def query_market_stats(property_type: str | None = None) -> list[MarketStats]:
+    """Get the precomputed market statistics for all post codes.
+
+    With the snapshot enabled, they are computed from the snapshot instead, so they are always current.
+
+    Args:
+        property_type (str | None, optional): Only return statistics for this property type. Defaults to None.
+
+    Returns:
+        list[MarketStats]: Listing count, average area and price per area percentiles per post code and property type.
+    """
+    return reader.get_market_stats(property_type=property_type)
+
+
+@app.get("/stats/{post_code}", response_model=list[schemas.MarketStatsSchema])
+def query_market_stats_by_post_code(post_code: int, property_type: str | None = None) -> list[MarketStats]:
+    """Get the precomputed market statistics for a single post code.
+
+    Args:
+        post_code (int): The post code, e.g. 1020.
+        property_type (str | None, optional): Only return statistics for this property type. Defaults to None.
+
+    Raises:
+        HTTPException: Raised when there are no statistics for the post code.
+
+    Returns:
+        list[MarketStats]: Listing count, average area and price per area percentiles per property type.
+    """
+    stats = reader.get_market_stats(post_code=post_code, property_type=property_type)
+    if not stats:
+        raise HTTPException(
+            status_code=404, detail=f"No statistics for post code {post_code}"
+        )
+    return stats
+
+
+def _to_saved_search_schema(search: SavedSearch) -> schemas.SavedSearchSchema:
+    """Convert a SavedSearch, decoding its JSON encoded post codes."""
+    return schemas.SavedSearchSchema(**{**search.dict(), "post_codes": json.loads(search.post_codes or "null")})
+
+
+@app.post("/searches/", response_model=schemas.SavedSearchSchema, status_code=201)
+def create_saved_search(search: schemas.SavedSearchCreateSchema) -> schemas.SavedSearchSchema:
+    """Save a search. Apartments matching it are recorded as notifications when they are ingested.
+
+    Args:
+        search (schemas.SavedSearchCreateSchema): The search criteria.
+
+    Returns:
+        schemas.SavedSearchSchema: The saved search.
+    """
+    saved = model.add_saved_search(
+        SavedSearch(**{**search.dict(), "post_codes": json.dumps(search.post_codes) if search.post_codes else None})
+    )
+    return _to_saved_search_schema(saved)
+
+
+@app.get("/searches/", response_model=list[schemas.SavedSearchSchema])
+def query_saved_searches() -> list[schemas.SavedSearchSchema]:
+    """Get all saved searches.
+
+    Returns:
+        list[schemas.SavedSearchSchema]: The saved searches.
+    """
+    return [_to_saved_search_schema(search) for search in model.get_saved_searches()]
+
+
+@app.get("/searches/{search_id}/notifications", response_model=list[schemas.ApartmentSchema])
+def query_search_notifications(search_id: int, limit: int = 100) -> list[Apartment]:
+    """Get the apartments that matched a saved search, newest match first.
+
+    Args:
+        search_id (int): The id of the saved search.
+        limit (int, optional): The max number of apartments to return. Defaults to 100.
+
+    Raises:
+        HTTPException: In case of demanding a limit greater than 500.
+
+    Returns:
+        list[Apartment]: The matching apartments.
+    """
+    if limit > MAX_PAGE_SIZE:
+        raise HTTPException(
+            status_code=413, detail="Limit cannot be greater than 500"
+        )
+    return model.get_search_notifications(search_id=search_id, limit=limit)
+
+
+@app.get("/crawl_runs/", response_model=list[schemas.CrawlRunSchema])
+def query_crawl_runs(limit: int = 100, url: str | None = None) -> list[CrawlRun]:
+    """Get the ledger of the latest crawl runs, newest first.
+
+    Args:
+        limit (int, optional): The max number of runs to return. Defaults to 100.
+        url (str | None, optional): Only return the runs of this category url. Defaults to None.
+
+    Raises:
+        HTTPException: In case of demanding a limit greater than 500.
+
+    Returns:
+        list[CrawlRun]: The runs with their statistics.
+    """
+    if limit > MAX_PAGE_SIZE:
+        raise HTTPException(
+            status_code=413, detail="Limit cannot be greater than 500"
+        )
+    return model.get_crawl_runs(limit=limit, url=url)
+
+
+@app.get("/map/", response_class=FileResponse)
+def show_map() -> FileResponse:
+    """A map of all apartments, which loads the clusters of the visible tiles from `/map/tiles/{z}/{x}/{y}`.
+
+    Returns:
+        FileResponse: The HTML page of the map.
+    """
+    return FileResponse(pkg_path / "static" / "map.html", media_type="text/html")
+
+
+@app.get("/map/rendered", response_class=FileResponse)
+def show_rendered_map() -> FileResponse:
+    """The rendered map of the apartments with the districts, as built by `maps.MapArtifacts`.
+
+    The map is served from a file on disk. If the data changed since it was rendered, it is rebuilt in the background
+    and the previous map is served until then.
+
+    Raises:
+        HTTPException: Raised when no map was built yet, the first build is started in the background.
+
+    Returns:
+        FileResponse: The HTML page of the map.
+    """
+    path = map_artifacts.get()
+    if path is None:
+        raise HTTPException(status_code=503, detail="The map is being built", headers={"Retry-After": "30"})
+    return FileResponse(path, media_type="text/html")
+
+
+@app.get("/map/districts")
+def query_district_choropleth() -> Response:
+    """Get the districts as GeoJSON, with the number of apartments and their median price per m² in each.
+
+    The apartments are assigned to the districts by their coordinates, see `districts.assign_districts`.
+
+    Raises:
+        HTTPException: Raised when no districts are configured.
+
+    Returns:
+        Response: The GeoJSON FeatureCollection of the districts.
+    """
+    index = districts.get_index()
+    if index is None:
+        raise HTTPException(status_code=404, detail="No districts configured")
+    content = orjson.dumps(districts.get_choropleth(model, index))
+    return Response(content=content, media_type="application/geo+json", headers={"Cache-Control": "max-age=60"})
+
+
+@app.get("/map/tiles/{z}/{x}/{y}")
+def query_map_tile(z: int, x: int, y: int) -> Response:
+    """Get the apartments of a map tile as GeoJSON points, clustered per zoom level.
+
+    At low zoom levels, the apartments of a tile are grouped into clusters with their number and median price, so a
+    tile stays small whatever the number of apartments. From zoom level 16 on, the apartments are returned one by one.
+
+    Args:
+        z (int): The zoom level.
+        x (int): The column of the tile, from west to east.
+        y (int): The row of the tile, from north to south.
+
+    Raises:
+        HTTPException: Raised when the tile doesn't exist.
+
+    Returns:
+        Response: The GeoJSON FeatureCollection of the tile.
+    """
+    try:
+        content = tile_index.get().tile_geojson(z, x, y)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e)) from e
+    return Response(content=content, media_type="application/geo+json", headers={"Cache-Control": "max-age=60"})
+
+
+@app.get("/export/apartments.parquet", response_class=FileResponse)
+def export_apartments_parquet(background_tasks: BackgroundTasks, include_gone: bool = False) -> FileResponse:
+    """Export the whole apartments table as a Parquet file.
+
+    Parquet needs its footer written before the file can be read, so the export is written to a temporary file that is
+    removed again once it has been sent.
+
+    Args:
+        background_tasks (BackgroundTasks): Used to clean up the temporary file after the response.
+        include_gone (bool, optional): Also export the apartments that are no longer listed. Defaults to False.
+
+    Returns:
+        FileResponse: The Parquet file.
+    """
+    with tempfile.NamedTemporaryFile(suffix=".parquet", delete=False) as tmp:
+        path = Path(tmp.name)
+    export.write_parquet(model, path, include_gone=include_gone)
+    background_tasks.add_task(path.unlink, missing_ok=True)
+    return FileResponse(path, media_type="application/vnd.apache.parquet", filename="apartments.parquet")
+
+
+@app.get("/export/apartments.arrow", response_class=StreamingResponse)
+def export_apartments_arrow(include_gone: bool = False) -> StreamingResponse:
+    """Stream the whole apartments table in the Arrow IPC stream format.
+
+    The record batches are streamed straight from a server side cursor, so the table is never held in memory.
+
+    Args:
+        include_gone (bool, optional): Also export the apartments that are no longer listed. Defaults to False.
+
+    Returns:
+        StreamingResponse: The Arrow IPC stream.
+    """
+    return StreamingResponse(
+        export.iter_arrow_stream(model, include_gone=include_gone),
+        media_type="application/vnd.apache.arrow.stream",
+        headers={"Content-Disposition": 'attachment; filename="apartments.arrow"'},
+    )
@@ -0,0 +1,86 @@
+import asyncio
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+from loguru import logger
+
+from apartment_scraper import matching, scoring, tracing, willhaben
+from apartment_scraper.id_sets import SeenIds
+from apartment_scraper.models import COMPLETE_FRACTION, CrawlRun, Model
+from apartment_scraper.willhaben.area_id import Area
+
+
+async def crawl(
+    model: Model, area: Area, category: str, source: str = "willhaben", seen: SeenIds | None = None
+) -> CrawlRun:
+    """Crawl one category of an area, store the apartments and record the run in the crawl run ledger.
+
+    Large areas are split into their districts, see `willhaben.get_area_data`. New apartments are matched against the
+    saved searches. If the crawl is complete, i.e. no page failed and nearly all reported rows were fetched, the
+    apartments of the category that weren't seen anymore are marked as gone. The database calls run in a thread, so
+    other crawls on the event loop can continue meanwhile.
+
+    Args:
+        model (Model): The database model.
+        area (Area): The area, e.g. `willhaben.AreaId.WIEN.ALL`.
+        category (str): The category, one of `willhaben.CATEGORIES`.
+        source (str, optional): The site that is crawled. Defaults to "willhaben".
+        seen (SeenIds | None, optional): The apartment_ids of earlier crawls of the same run, which are skipped.
+            Defaults to None.
+
+    Returns:
+        CrawlRun: The recorded run.
+    """
+    url = willhaben.Request(area_id=area).category_url(category)
+    run = CrawlRun(source=source, area=area.qualified_name, url=url, started=datetime.now(tz=ZoneInfo("UTC")))
+    stats = willhaben.CrawlStats()
+    try:
+        with tracing.span("crawl", area=area.qualified_name, url=url):
+            apartments = await willhaben.get_area_data(area, category, stats=stats, seen=seen)
+            for apartment in apartments:
+                apartment.scope = url
+            result = await asyncio.to_thread(model.upsert_apartments, apartments)
+            run.inserted = len(result.inserted_ids)
+            run.updated = result.updated_count
+
+            with tracing.span("score_deals", apartments=len(apartments)):
+                await asyncio.to_thread(
+                    scoring.score_deals, model, [apartment.apartment_id for apartment in apartments]
+                )
+
+            inserted = set(result.inserted_ids)
+            with tracing.span("match_saved_searches", apartments=len(inserted)):
+                await asyncio.to_thread(
+                    matching.notify_matches,
+                    model,
+                    [apartment for apartment in apartments if apartment.apartment_id in inserted],
+                )
+
+            fetched = len(apartments) + len(stats.skipped_ids)
+            if stats.pages_failed == 0 and fetched >= stats.rows_found * COMPLETE_FRACTION:
+                seen_ids = {apartment.apartment_id for apartment in apartments} | set(stats.skipped_ids)
+                run.gone = await asyncio.to_thread(model.mark_gone_apartments, url, seen_ids)
+            else:
+                logger.warning(f"Incomplete crawl of {url}, {fetched} of {stats.rows_found} rows fetched")
+    except (willhaben.NoConnectionError, willhaben.NoRowsFoundError) as e:
+        run.error = repr(e)
+    except Exception as e:
+        run.error = repr(e)
+        raise
+    finally:
+        run.finished = datetime.now(tz=ZoneInfo("UTC"))
+        run.rows_found = stats.rows_found
+        run.pages_requested = stats.pages_requested
+        run.pages_failed = stats.pages_failed
+        run.parsed = stats.parsed
+        run.duplicates = stats.duplicates
+        run.skipped = len(stats.skipped_ids)
+        run.bytes_transferred = stats.bytes_transferred
+        run.p95_page_latency_ms = stats.p95_page_latency_ms
+        run = await asyncio.to_thread(model.add_crawl_run, run)
+        await asyncio.to_thread(tracing.flush)
+    logger.info(
+        f"Crawled {url}: {run.parsed} parsed, {run.inserted} inserted, {run.updated} updated, {run.gone} gone, "
+        f"{run.pages_failed}/{run.pages_requested} pages failed"
+    )
+    return run
@@ -0,0 +1,235 @@
+import os
+from functools import cache
+from pathlib import Path
+from time import perf_counter
+from typing import TYPE_CHECKING, Any, Self
+
+import numpy as np
+import orjson
+from loguru import logger
+from sqlalchemy import or_
+from sqlmodel import select
+
+from apartment_scraper.models import Apartment, percentile
+
+
+if TYPE_CHECKING:
+    from apartment_scraper.models import Model
+
+# GeoJSON with a feature per district, with the district code in the property "iso" and its name in "name".
+DISTRICTS_GEOJSON = Path(os.environ.get("DISTRICTS_GEOJSON", "bezirke_95_geo.json"))
+CHUNK_SIZE = 2048  # number of points tested against all edges of a district at once
+
+
+class DistrictIndex:
+    """The district polygons, prepared for point-in-polygon tests of many points at once.
+
+    The edges of all rings of a district, including its holes and the parts of a multipolygon, are kept in one array.
+    A point is inside the district if a ray from it crosses an odd number of these edges. Each district is only tested
+    against the points within its bounding box, which are found by a binary search in the points sorted by longitude.
+    """
+
+    def __init__(self: Self, geojson: dict[str, Any]) -> None:
+        """Prepare the districts of a GeoJSON FeatureCollection.
+
+        Args:
+            geojson (dict[str, Any]): The districts, with a Polygon or MultiPolygon and the properties "iso" and
+                "name" per feature.
+        """
+        self.geojson = geojson
+        self.codes: list[int] = []
+        self.names: dict[int, str] = {}
+        self.edges: list[np.ndarray] = []
+        bounds = []
+        for feature in geojson["features"]:
+            geometry = feature["geometry"]
+            polygons = [geometry["coordinates"]] if geometry["type"] == "Polygon" else geometry["coordinates"]
+            rings = [np.asarray(ring, dtype=np.float64)[:, :2] for polygon in polygons for ring in polygon]
+            edges = np.concatenate([np.hstack([ring, np.roll(ring, -1, axis=0)]) for ring in rings])
+            x0, y0, x1, y1 = edges.T
+            with np.errstate(divide="ignore", invalid="ignore"):
+                slopes = np.where(y0 == y1, 0, (x1 - x0) / (y1 - y0))  # horizontal edges are never crossed
+            self.edges.append(np.column_stack([x0, y0, y1, slopes]))
+            points = np.concatenate(rings)
+            bounds.append((*points.min(axis=0), *points.max(axis=0)))
+            code = int(feature["properties"]["iso"])
+            self.codes.append(code)
+            self.names[code] = feature["properties"]["name"]
+        self.bounds = np.asarray(bounds, dtype=np.float64).reshape(-1, 4)
+
+    @classmethod
+    def load(cls: type[Self], path: Path = DISTRICTS_GEOJSON) -> Self:
+        """Load the districts from a GeoJSON file.
+
+        Args:
+            path (Path, optional): The GeoJSON file. Defaults to DISTRICTS_GEOJSON.
+
+        Returns:
+            DistrictIndex: The prepared districts.
+        """
+        return cls(orjson.loads(path.read_bytes()))
+
+    def assign(self: Self, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+        """Find the district of each point.
+
+        Args:
+            lats (np.ndarray): The latitudes of the points.
+            lons (np.ndarray): The longitudes of the points.
+
+        Returns:
+            np.ndarray: The code of the district of each point, 0 for points outside all districts.
+        """
+        result = np.zeros(len(lats), dtype=np.int32)
+        order = np.argsort(lons, kind="stable")
+        sorted_lons = lons[order]
+        for code, (min_lon, min_lat, max_lon, max_lat), edges in zip(self.codes, self.bounds, self.edges, strict=True):
+            start = np.searchsorted(sorted_lons, min_lon, side="left")
+            stop = np.searchsorted(sorted_lons, max_lon, side="right")
+            candidates = order[start:stop]
+            candidates = candidates[
+                (lats[candidates] >= min_lat) & (lats[candidates] <= max_lat) & (result[candidates] == 0)
+            ]
+            for offset in range(0, len(candidates), CHUNK_SIZE):
+                chunk = candidates[offset : offset + CHUNK_SIZE]
+                result[chunk[_contains(edges, lats[chunk], lons[chunk])]] = code
+        return result
+
+
+def _contains(edges: np.ndarray, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    """Test which points are inside a polygon, by counting the edges crossed by a ray from each point to the east.
+
+    Args:
+        edges (np.ndarray): The edges of the polygon, with the columns x0, y0, y1 and the slope dx/dy.
+        lats (np.ndarray): The latitudes of the points.
+        lons (np.ndarray): The longitudes of the points.
+
+    Returns:
+        np.ndarray: A mask of the points inside the polygon.
+    """
+    x0, y0, y1, slopes = edges.T
+    y = lats[:, None]
+    spanned = (y0 > y) != (y1 > y)
+    crossed = spanned & (lons[:, None] < x0 + (y - y0) * slopes)
+    return np.count_nonzero(crossed, axis=1) % 2 == 1
+
+
+@cache
+def get_index(path: Path = DISTRICTS_GEOJSON) -> DistrictIndex | None:
+    """Get the prepared districts of a GeoJSON file, loading them once.
+
+    Args:
+        path (Path, optional): The GeoJSON file. Defaults to DISTRICTS_GEOJSON.
+
+    Returns:
+        DistrictIndex | None: The prepared districts, or None if the file doesn't exist.
+    """
+    if not path.exists():
+        logger.warning(f"No districts found at {path}, set DISTRICTS_GEOJSON to the GeoJSON file of the districts")
+        return None
+    return DistrictIndex.load(path)
+
+
+def parse_coordinates(coordinates: list[str]) -> tuple[np.ndarray, np.ndarray]:
+    """Parse the "lat,lon" strings stored by the parser into two arrays, with NaN for coordinates that can't be parsed.
+
+    Args:
+        coordinates (list[str]): The coordinates.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The latitudes and the longitudes.
+    """
+    try:
+        values = np.array(",".join(coordinates).split(","), dtype=np.float64).reshape(-1, 2)
+    except ValueError:
+        # Some coordinates are missing or broken, parse them one by one.
+        values = np.full((len(coordinates), 2), np.nan)
+        for row, value in enumerate(coordinates):
+            parts = value.split(",")
+            if len(parts) == 2:  # noqa: PLR2004
+                try:
+                    values[row] = (float(parts[0]), float(parts[1]))
+                except ValueError:
+                    continue
+    return values[:, 0], values[:, 1]
+
+
+def assign_districts(model: "Model", index: DistrictIndex | None = None) -> int:
+    """Assign each apartment to the district its coordinates are in, and store it in `Apartment.district`.
+
+    Unlike the post code, which is given by the advertiser, the district is derived from the coordinates. Apartments
+    without coordinates, or outside all districts, get no district. Only the apartments whose district changed are
+    written.
+
+    Args:
+        model (Model): The database model.
+        index (DistrictIndex | None, optional): The districts. Defaults to the districts of DISTRICTS_GEOJSON.
+
+    Returns:
+        int: The number of apartments in a district.
+    """
+    index = index or get_index()
+    if index is None:
+        return 0
+    start_time = perf_counter()
+    with model.engine.connect() as connection:
+        rows = connection.execute(select(Apartment.id, Apartment.coordinates, Apartment.district)).all()
+    lats, lons = parse_coordinates([coordinates or "" for _, coordinates, _ in rows])
+    assigned = index.assign(lats, lons).tolist()
+    changes = {
+        apartment_id: district or None
+        for (apartment_id, _, old_district), district in zip(rows, assigned, strict=True)
+        if (district or None) != old_district
+    }
+    model.update_districts(changes)
+    count = len(assigned) - assigned.count(0)
+    logger.info(
+        f"Assigned {count} of {len(rows)} apartments to districts in {perf_counter() - start_time:.2f}s, "
+        f"{len(changes)} changed their district"
+    )
+    return count
+
+
+def get_choropleth(model: "Model", index: DistrictIndex) -> dict[str, Any]:
+    """Get the districts as GeoJSON, with the number of apartments and their median price per area in each.
+
+    Of a cluster of duplicates only the first listing is counted.
+
+    Args:
+        model (Model): The database model.
+        index (DistrictIndex): The districts.
+
+    Returns:
+        dict[str, Any]: The GeoJSON FeatureCollection of the districts, with the added properties "count" and
+            "median_price_per_area".
+    """
+    stmt = select(Apartment.district, Apartment.price_per_area).where(
+        Apartment.district.is_not(None),
+        or_(Apartment.cluster_id.is_(None), Apartment.cluster_id == Apartment.id),
+    )
+    with model.engine.connect() as connection:
+        rows = np.array(
+            [(district, price_per_area or np.nan) for district, price_per_area in connection.execute(stmt)],
+            dtype=np.float64,
+        ).reshape(-1, 2)
+
+    counts: dict[int, int] = {}
+    medians: dict[int, float | None] = {}
+    rows = rows[np.lexsort((rows[:, 1], rows[:, 0]))]  # by district, then by price per area with NaN last
+    districts, starts, group_counts = np.unique(rows[:, 0], return_index=True, return_counts=True)
+    for district, start, count in zip(districts.astype(int), starts, group_counts, strict=True):
+        prices = rows[start : start + count, 1]
+        counts[district] = int(count)
+        medians[district] = percentile(prices[~np.isnan(prices)].tolist(), 0.5)
+
+    features = [
+        {
+            **feature,
+            "properties": {
+                **feature["properties"],
+                "count": counts.get(code, 0),
+                "median_price_per_area": medians.get(code),
+            },
+        }
+        for code, feature in zip(index.codes, index.geojson["features"], strict=True)
+    ]
+    return {"type": "FeatureCollection", "features": features}
@@ -0,0 +1,194 @@
+import itertools
+import math
+from collections import defaultdict
+from time import perf_counter
+from typing import TYPE_CHECKING, NamedTuple
+
+from loguru import logger
+from sqlmodel import select
+
+from apartment_scraper import text
+from apartment_scraper.models import Apartment
+
+
+if TYPE_CHECKING:
+    from apartment_scraper.models import Model
+
+CELL_DEGREES = 0.003  # size of the coordinate grid cells, about 330 m north-south and 220 m east-west in Vienna
+AREA_BUCKET = 3  # m², listings whose areas differ by more than this are never duplicates
+GROUND_FLOOR = 0  # also the floor the parser falls back to, so it is not known to contradict another floor
+MATCH_SCORE = 0.75  # score from 0 to 1 above which two listings are considered the same apartment
+PRICE_TOLERANCE = 0.10  # relative price difference at which the price similarity drops to 0
+
+# Weights of the similarities of a pair, summing up to 1.
+WEIGHTS = {"price": 0.35, "rooms": 0.2, "floor": 0.15, "address": 0.3}
+
+
+class Listing(NamedTuple):
+    """The fields of an apartment that are compared to find duplicates."""
+    id: int  # noqa: A003
+    post_code: int
+    area: int
+    lat: float | None
+    lon: float | None
+    price: float
+    rooms: float
+    floor: float
+    address: frozenset[str]
+    cluster_id: int | None
+
+
+def load_listings(model: "Model") -> list[Listing]:
+    """Load the compared fields of all listed apartments, with the addresses already normalized into sets of tokens."""
+    stmt = select(
+        Apartment.id,
+        Apartment.post_code,
+        Apartment.area,
+        Apartment.coordinates,
+        Apartment.price,
+        Apartment.rooms,
+        Apartment.floor,
+        Apartment.address,
+        Apartment.cluster_id,
+    ).where(Apartment.gone.is_(None))
+    listings = []
+    with model.engine.connect() as connection:
+        for row in connection.execute(stmt):
+            lat, lon = _split_coordinates(row.coordinates)
+            listings.append(
+                Listing(
+                    row.id,
+                    row.post_code,
+                    row.area,
+                    lat,
+                    lon,
+                    row.price,
+                    row.rooms,
+                    row.floor,
+                    frozenset(text.normalize(row.address).split()),
+                    row.cluster_id,
+                )
+            )
+    return listings
+
+
+def _split_coordinates(coordinates: str | None) -> tuple[float | None, float | None]:
+    """Split the "lat,lon" string stored by the parser into two floats, or None if they can't be parsed."""
+    try:
+        lat, lon = (coordinates or "").split(",")
+        return float(lat), float(lon)
+    except ValueError:
+        return None, None
+
+
+def score(first: Listing, second: Listing) -> float:
+    """Score how likely two listings of the same block are the same apartment.
+
+    The price, the number of rooms, the floor and the address are compared. A missing price, number of rooms or
+    address counts as half a match, as it neither confirms nor contradicts the other listing. Listings whose areas
+    differ too much, or that are on different floors above the ground floor, are never the same apartment, however
+    similar the rest is.
+
+    Args:
+        first (Listing): A listing.
+        second (Listing): Another listing.
+
+    Returns:
+        float: The weighted similarity from 0 to 1.
+    """
+    if abs(first.area - second.area) > AREA_BUCKET:
+        return 0.0
+    if GROUND_FLOOR not in (first.floor, second.floor) and first.floor != second.floor:
+        return 0.0
+
+    if first.price > 0 and second.price > 0:
+        difference = abs(first.price - second.price) / max(first.price, second.price)
+        price = max(1 - difference / PRICE_TOLERANCE, 0)
+    else:
+        price = 0.5
+    rooms = 0.5 if not first.rooms or not second.rooms else float(first.rooms == second.rooms)
+    floor = float(first.floor == second.floor)
+    if first.address and second.address:
+        address = len(first.address & second.address) / len(first.address | second.address)
+    else:
+        address = 0.5
+
+    return (
+        WEIGHTS["price"] * price + WEIGHTS["rooms"] * rooms + WEIGHTS["floor"] * floor + WEIGHTS["address"] * address
+    )
+
+
+def find_clusters(listings: list[Listing]) -> dict[int, int]:
+    """Group listings of the same apartment into clusters.
+
+    Comparing all pairs grows quadratically, so listings are blocked by post code, a grid of coordinate cells and
+    buckets of the area. Each listing is only scored against the listings already seen in its own block and the
+    neighbouring blocks, so duplicates at the border of a cell or bucket are still found. Listings without coordinates
+    form their own blocks. Matching pairs are joined into clusters with union-find.
+
+    Args:
+        listings (list[Listing]): All listings.
+
+    Returns:
+        dict[int, int]: The cluster of each listing that has a duplicate, identified by the smallest id of its members.
+    """
+    blocks: defaultdict[tuple[int, int | None, int | None, int], list[Listing]] = defaultdict(list)
+    parents: dict[int, int] = {}
+
+    def find(listing_id: int) -> int:
+        root = listing_id
+        while parents.get(root, root) != root:
+            root = parents[root]
+        while listing_id != root:
+            parents[listing_id], listing_id = root, parents[listing_id]
+        return root
+
+    for listing in listings:
+        area_bucket = listing.area // AREA_BUCKET
+        if listing.lat is None or listing.lon is None:
+            lat_cell = lon_cell = None
+            neighbours = [(listing.post_code, None, None, area_bucket + offset) for offset in (-1, 0, 1)]
+        else:
+            lat_cell = math.floor(listing.lat / CELL_DEGREES)
+            lon_cell = math.floor(listing.lon / CELL_DEGREES)
+            neighbours = [
+                (listing.post_code, lat_cell + lat_offset, lon_cell + lon_offset, area_bucket + area_offset)
+                for lat_offset, lon_offset, area_offset in itertools.product((-1, 0, 1), repeat=3)
+            ]
+
+        for key in neighbours:
+            for other in blocks.get(key, ()):
+                if score(listing, other) >= MATCH_SCORE:
+                    first, second = find(listing.id), find(other.id)
+                    parents[min(first, second)] = min(first, second)
+                    parents[max(first, second)] = min(first, second)
+        blocks[(listing.post_code, lat_cell, lon_cell, area_bucket)].append(listing)
+
+    return {listing_id: find(listing_id) for listing_id in parents}
+
+
+def assign_clusters(model: "Model") -> int:
+    """Detect duplicate listings and store their cluster in `Apartment.cluster_id`.
+
+    Listings without a duplicate get no cluster. Only the listings whose cluster changed are written.
+
+    Args:
+        model (Model): The database model.
+
+    Returns:
+        int: The number of listings that have a duplicate.
+    """
+    start_time = perf_counter()
+    listings = load_listings(model)
+    clusters = find_clusters(listings)
+    changes = {
+        listing.id: cluster_id
+        for listing in listings
+        if (cluster_id := clusters.get(listing.id)) != listing.cluster_id
+    }
+    model.update_cluster_ids(changes)
+    logger.info(
+        f"Found {len(clusters)} listings with duplicates among {len(listings)} in {perf_counter() - start_time:.2f}s, "
+        f"{len(changes)} changed their cluster"
+    )
+    return len(clusters)
@@ -0,0 +1,265 @@
+import io
+from collections.abc import Iterator, Sequence
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from loguru import logger
+from sqlmodel import select
+
+from apartment_scraper.models import Apartment
+
+
+if TYPE_CHECKING:
+    from sqlalchemy.engine import Row
+
+    from apartment_scraper.models import Model
+
+BATCH_SIZE = 10_000  # number of rows fetched from the database per record batch
+PARTITION_COLUMNS = ("post_code", "updated_date")
+
+ARROW_SCHEMA = pa.schema(
+    [
+        pa.field("id", pa.int64()),
+        pa.field("apartment_id", pa.int64()),
+        pa.field("status", pa.bool_()),
+        pa.field("product_id", pa.string()),
+        pa.field("property_type", pa.string()),
+        pa.field("area", pa.int64()),
+        pa.field("url", pa.string()),
+        pa.field("rooms", pa.float64()),
+        pa.field("floor", pa.float64()),
+        pa.field("address", pa.string()),
+        pa.field("post_code", pa.int32()),
+        pa.field("location", pa.string()),
+        pa.field("lat", pa.float64()),
+        pa.field("lon", pa.float64()),
+        pa.field("price", pa.float64()),
+        pa.field("price_per_area", pa.float64()),
+        pa.field("free_area_type", pa.list_(pa.string())),
+        pa.field("free_area", pa.int64()),
+        pa.field("image_urls", pa.list_(pa.string())),
+        pa.field("advertiser", pa.string()),
+        pa.field("prio", pa.int32()),
+        pa.field("updated", pa.timestamp("us", tz="UTC")),
+        pa.field("gone", pa.timestamp("us", tz="UTC")),
+        pa.field("updated_date", pa.date32()),  # the day the listing last changed, not when it was last crawled
+    ]
+)
+
+_EXPORT_COLUMNS = (
+    Apartment.id,
+    Apartment.apartment_id,
+    Apartment.status,
+    Apartment.product_id,
+    Apartment.property_type,
+    Apartment.area,
+    Apartment.url,
+    Apartment.rooms,
+    Apartment.floor,
+    Apartment.address,
+    Apartment.post_code,
+    Apartment.location,
+    Apartment.coordinates,
+    Apartment.price,
+    Apartment.price_per_area,
+    Apartment.free_area_type,
+    Apartment.free_area,
+    Apartment.advertiser,
+    Apartment.prio,
+    Apartment.updated,
+    Apartment.gone,
+)
+
+
+def _split_coordinates(coordinates: str | None) -> tuple[float | None, float | None]:
+    """Split the "lat,lon" string stored by the parser into two floats.
+
+    Args:
+        coordinates (str | None): The coordinates as stored in the database.
+
+    Returns:
+        tuple[float | None, float | None]: Latitude and longitude, or (None, None) if they can't be parsed.
+    """
+    if not coordinates:
+        return None, None
+    try:
+        lat, lon = coordinates.split(",")
+        return float(lat), float(lon)
+    except ValueError:
+        return None, None
+
+
+def rows_to_record_batch(rows: Sequence["Row[Any]"], image_urls: dict[int, list[str]]) -> pa.RecordBatch:
+    """Convert a chunk of database rows into an Arrow record batch.
+
+    Args:
+        rows (Sequence[Row]): Rows selected with the export columns.
+        image_urls (dict[int, list[str]]): The image URLs per apartment_id, see `Model.get_image_urls`.
+
+    Returns:
+        pa.RecordBatch: A record batch following `ARROW_SCHEMA`.
+    """
+    columns: dict[str, list[Any]] = {field.name: [] for field in ARROW_SCHEMA}
+    for row in rows:
+        lat, lon = _split_coordinates(row.coordinates)
+        columns["id"].append(row.id)
+        columns["apartment_id"].append(row.apartment_id)
+        columns["status"].append(row.status)
+        columns["product_id"].append(row.product_id)
+        columns["property_type"].append(row.property_type)
+        columns["area"].append(row.area)
+        columns["url"].append(row.url)
+        columns["rooms"].append(row.rooms)
+        columns["floor"].append(row.floor)
+        columns["address"].append(row.address)
+        columns["post_code"].append(row.post_code)
+        columns["location"].append(row.location)
+        columns["lat"].append(lat)
+        columns["lon"].append(lon)
+        columns["price"].append(row.price)
+        columns["price_per_area"].append(row.price_per_area)
+        columns["free_area_type"].append(row.free_area_type)
+        columns["free_area"].append(row.free_area)
+        columns["image_urls"].append(image_urls.get(row.apartment_id, []))
+        columns["advertiser"].append(row.advertiser)
+        columns["prio"].append(row.prio)
+        columns["updated"].append(row.updated)
+        columns["gone"].append(row.gone)
+        columns["updated_date"].append(row.updated.date() if row.updated else None)
+    return pa.RecordBatch.from_pydict(columns, schema=ARROW_SCHEMA)
+
+
+def iter_record_batches(
+    model: "Model", batch_size: int = BATCH_SIZE, include_gone: bool = False
+) -> Iterator[pa.RecordBatch]:
+    """Stream the apartments table as Arrow record batches.
+
+    A server side cursor is used, so only one batch of rows is held in memory at a time. The image URLs are read per
+    batch.
+
+    Args:
+        model (Model): The database model to export from.
+        batch_size (int, optional): Number of rows per record batch. Defaults to BATCH_SIZE.
+        include_gone (bool, optional): Also export the apartments that are no longer listed, with the time they were
+            found gone in `gone`. Defaults to False.
+
+    Yields:
+        pa.RecordBatch: Record batches following `ARROW_SCHEMA`.
+    """
+    stmt = select(*_EXPORT_COLUMNS).order_by(Apartment.id)
+    if not include_gone:
+        stmt = stmt.where(Apartment.gone.is_(None))
+    with model.engine.connect() as connection:
+        result = connection.execution_options(stream_results=True).execute(stmt)
+        for rows in result.partitions(batch_size):
+            image_urls = model.get_image_urls([row.apartment_id for row in rows])
+            yield rows_to_record_batch(rows, image_urls)
+
+
+def write_parquet(
+    model: "Model",
+    path: Path,
+    partition_by: Sequence[str] = (),
+    batch_size: int = BATCH_SIZE,
+    include_gone: bool = False,
+) -> int:
+    """Export the apartments table to Parquet.
+
+    Without partitioning a single file is written to `path`. With partitioning, `path` is used as the root directory of
+    a hive partitioned dataset, e.g. `path/post_code=1020/updated_date=2023-10-01/part-0.parquet`.
+
+    Args:
+        model (Model): The database model to export from.
+        path (Path): The output file, or the output directory when partitioning.
+        partition_by (Sequence[str], optional): Columns to partition by. Any of `PARTITION_COLUMNS`. Defaults to ().
+        batch_size (int, optional): Number of rows per record batch. Defaults to BATCH_SIZE.
+        include_gone (bool, optional): Also export the apartments that are no longer listed. Defaults to False.
+
+    Raises:
+        ValueError: If partitioning by an unsupported column.
+
+    Returns:
+        int: The number of exported rows.
+    """
+    if unknown := set(partition_by) - set(PARTITION_COLUMNS):
+        msg = f"Cannot partition by {sorted(unknown)}, choose from {PARTITION_COLUMNS}"
+        raise ValueError(msg)
+
+    row_count = 0
+
+    def counted(batches: Iterator[pa.RecordBatch]) -> Iterator[pa.RecordBatch]:
+        nonlocal row_count
+        for batch in batches:
+            row_count += batch.num_rows
+            yield batch
+
+    batches = counted(iter_record_batches(model, batch_size=batch_size, include_gone=include_gone))
+    if partition_by:
+        ds.write_dataset(
+            batches,
+            base_dir=path,
+            schema=ARROW_SCHEMA,
+            format="parquet",
+            partitioning=list(partition_by),
+            partitioning_flavor="hive",
+            existing_data_behavior="overwrite_or_ignore",
+        )
+    else:
+        with pq.ParquetWriter(path, ARROW_SCHEMA) as writer:
+            for batch in batches:
+                writer.write_batch(batch)
+    logger.info(f"Exported {row_count} apartments to {path}")
+    return row_count
+
+
+def write_arrow(model: "Model", path: Path, batch_size: int = BATCH_SIZE, include_gone: bool = False) -> int:
+    """Export the apartments table to an Arrow IPC (Feather v2) file.
+
+    Args:
+        model (Model): The database model to export from.
+        path (Path): The output file.
+        batch_size (int, optional): Number of rows per record batch. Defaults to BATCH_SIZE.
+        include_gone (bool, optional): Also export the apartments that are no longer listed. Defaults to False.
+
+    Returns:
+        int: The number of exported rows.
+    """
+    row_count = 0
+    with pa.OSFile(str(path), "wb") as sink, pa.ipc.new_file(sink, ARROW_SCHEMA) as writer:
+        for batch in iter_record_batches(model, batch_size=batch_size, include_gone=include_gone):
+            writer.write_batch(batch)
+            row_count += batch.num_rows
+    logger.info(f"Exported {row_count} apartments to {path}")
+    return row_count
+
+
+def iter_arrow_stream(model: "Model", batch_size: int = BATCH_SIZE, include_gone: bool = False) -> Iterator[bytes]:
+    """Encode the apartments table as an Arrow IPC stream, chunk by chunk.
+
+    Used to stream the export over HTTP without materializing the whole table.
+
+    Args:
+        model (Model): The database model to export from.
+        batch_size (int, optional): Number of rows per record batch. Defaults to BATCH_SIZE.
+        include_gone (bool, optional): Also export the apartments that are no longer listed. Defaults to False.
+
+    Yields:
+        bytes: Consecutive chunks of the IPC stream.
+    """
+    buffer = io.BytesIO()
+
+    def drain() -> bytes:
+        chunk = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return chunk
+
+    with pa.ipc.new_stream(buffer, ARROW_SCHEMA) as writer:
+        yield drain()
+        for batch in iter_record_batches(model, batch_size=batch_size, include_gone=include_gone):
+            writer.write_batch(batch)
+            yield drain()
+    yield drain()
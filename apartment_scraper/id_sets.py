@@ -0,0 +1,135 @@
+import time
+from typing import Protocol, Self
+
+import numpy as np
+
+
+class SeenIds(Protocol):
+    """A set of apartment_ids that have been seen, e.g. by earlier crawls of the same run."""
+
+    def add(self: Self, apartment_id: int) -> None:
+        """Add an apartment_id."""
+        ...
+
+    def __contains__(self: Self, apartment_id: object) -> bool:
+        """Check whether an apartment_id has been seen."""
+        ...
+
+
+class IdSet:
+    """An exact set of apartment_ids.
+
+    Fine for a crawl of a few areas, the memory grows with about 60 bytes per id.
+    """
+
+    def __init__(self: Self) -> None:
+        """Initialize an empty set."""
+        self.ids: set[int] = set()
+
+    def add(self: Self, apartment_id: int) -> None:
+        """Add an apartment_id."""
+        self.ids.add(apartment_id)
+
+    def __contains__(self: Self, apartment_id: object) -> bool:
+        """Check whether an apartment_id has been seen."""
+        return apartment_id in self.ids
+
+    def __len__(self: Self) -> int:
+        """The number of ids."""
+        return len(self.ids)
+
+
+class SortedIds:
+    """A compact exact set of apartment_ids, e.g. of the adverts fetched by a crawl.
+
+    The ids are kept in a sorted int64 array, about 8 bytes per id. New ids are buffered in a small set and merged into
+    the array once `BUFFER_SIZE` of them are pending, so adding stays cheap.
+    """
+
+    BUFFER_SIZE = 1024  # number of pending ids merged into the sorted array at once
+
+    def __init__(self: Self) -> None:
+        """Initialize an empty set."""
+        self.ids = np.empty(0, dtype=np.int64)
+        self._pending: set[int] = set()
+
+    def add(self: Self, apartment_id: int) -> None:
+        """Add an apartment_id."""
+        if apartment_id in self:
+            return
+        self._pending.add(apartment_id)
+        if len(self._pending) >= self.BUFFER_SIZE:
+            self.ids = np.union1d(self.ids, np.fromiter(self._pending, dtype=np.int64, count=len(self._pending)))
+            self._pending.clear()
+
+    def __contains__(self: Self, apartment_id: object) -> bool:
+        """Check whether an apartment_id has been added."""
+        if not isinstance(apartment_id, int):
+            return False
+        if apartment_id in self._pending:
+            return True
+        position = np.searchsorted(self.ids, apartment_id)
+        return bool(position < len(self.ids) and self.ids[position] == apartment_id)
+
+    def __len__(self: Self) -> int:
+        """The number of ids."""
+        return len(self.ids) + len(self._pending)
+
+
+class RecentIds:
+    """The apartment_ids fetched by the crawls of a long running process within the last `max_age` seconds.
+
+    Jobs of overlapping areas, like a district and its city, share it to skip the listings that another job fetched
+    shortly before, see `for_scope`. A job never skips the listings it fetched itself, so each job still refreshes its
+    own listings on every run. Ids older than `max_age` are dropped as the set grows, so its memory stays bounded by the
+    listings fetched within `max_age`.
+    """
+
+    def __init__(self: Self, max_age: float) -> None:
+        """Initialize an empty set.
+
+        Args:
+            max_age (float): Seconds for which a fetched id is skipped by the other scopes.
+        """
+        self.max_age = max_age
+        self.ids: dict[int, tuple[float, str]] = {}
+        self._pruned_size = 0
+
+    def for_scope(self: Self, scope: str) -> "ScopedIds":
+        """Get the view of a scope, e.g. the category url of a job, to pass as `seen` to its crawls."""
+        return ScopedIds(self, scope)
+
+    def add(self: Self, apartment_id: int, scope: str) -> None:
+        """Add an apartment_id fetched by a scope."""
+        self.ids[apartment_id] = (time.monotonic(), scope)
+        if len(self.ids) > 2 * self._pruned_size:
+            oldest = time.monotonic() - self.max_age
+            self.ids = {id_: entry for id_, entry in self.ids.items() if entry[0] >= oldest}
+            self._pruned_size = max(len(self.ids), 1_000)
+
+    def seen_elsewhere(self: Self, apartment_id: int, scope: str) -> bool:
+        """Check whether another scope fetched an apartment_id within the last `max_age` seconds."""
+        entry = self.ids.get(apartment_id)
+        return entry is not None and entry[1] != scope and time.monotonic() - entry[0] <= self.max_age
+
+
+class ScopedIds:
+    """The view of one scope of `RecentIds`, which contains the ids recently fetched by the other scopes."""
+
+    def __init__(self: Self, recent: RecentIds, scope: str) -> None:
+        """Initialize the view.
+
+        Args:
+            recent (RecentIds): The ids of all scopes.
+            scope (str): The scope of the crawls using this view.
+        """
+        self.recent = recent
+        self.scope = scope
+
+    def add(self: Self, apartment_id: int) -> None:
+        """Add an apartment_id fetched by this scope."""
+        self.recent.add(apartment_id, self.scope)
+
+    def __contains__(self: Self, apartment_id: object) -> bool:
+        """Check whether another scope fetched an apartment_id recently."""
+        return isinstance(apartment_id, int) and self.recent.seen_elsewhere(apartment_id, self.scope)
@@ -0,0 +1,175 @@
+import asyncio
+import select
+import threading
+from collections.abc import Callable
+from typing import TYPE_CHECKING, Self
+
+from loguru import logger
+
+
+if TYPE_CHECKING:
+    from sqlalchemy.future.engine import Engine
+
+CHANNEL = "apartments_inserted"  # PostgreSQL channel used to announce newly inserted apartments
+MAX_PAYLOAD_BYTES = 7_900  # PostgreSQL limits the payload of a NOTIFY to 8000 bytes
+
+
+class Subscription:
+    """A subscriber of the broker, with a bounded buffer of messages."""
+
+    def __init__(self: Self, buffer_size: int) -> None:
+        """Initialize the subscription.
+
+        Args:
+            buffer_size (int): The max number of messages buffered before the subscriber is dropped.
+        """
+        self.queue: asyncio.Queue[bytes] = asyncio.Queue(maxsize=buffer_size)
+        self.dropped = False
+
+    async def get(self: Self) -> bytes | None:
+        """Wait for the next published message.
+
+        Returns:
+            bytes | None: The message, or None once the subscriber has been dropped for being too slow and its buffer is
+                drained.
+        """
+        if self.dropped and self.queue.empty():
+            return None
+        return await self.queue.get()
+
+
+class Broker:
+    """In-process pub/sub that fans out messages to all subscribers.
+
+    Each subscriber has a bounded buffer. A subscriber that doesn't keep up is dropped instead of slowing down the
+    publisher or growing the memory. All methods must be called from the thread running the event loop.
+    """
+
+    def __init__(self: Self, buffer_size: int = 100) -> None:
+        """Initialize the broker.
+
+        Args:
+            buffer_size (int, optional): The buffer size of each subscriber. Defaults to 100.
+        """
+        self.buffer_size = buffer_size
+        self.subscriptions: set[Subscription] = set()
+
+    def subscribe(self: Self) -> Subscription:
+        """Add a subscriber."""
+        subscription = Subscription(self.buffer_size)
+        self.subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self: Self, subscription: Subscription) -> None:
+        """Remove a subscriber."""
+        self.subscriptions.discard(subscription)
+
+    def publish(self: Self, message: bytes) -> None:
+        """Publish a message to all subscribers, dropping the ones with a full buffer.
+
+        Args:
+            message (bytes): The message to publish.
+        """
+        for subscription in list(self.subscriptions):
+            try:
+                subscription.queue.put_nowait(message)
+            except asyncio.QueueFull:
+                logger.warning("Dropping a slow subscriber of the live feed")
+                subscription.dropped = True
+                self.unsubscribe(subscription)
+
+
+def notify_payloads(apartment_ids: list[int]) -> list[str]:
+    """Split apartment ids into comma separated NOTIFY payloads that fit the size limit of PostgreSQL.
+
+    Args:
+        apartment_ids (list[int]): The ids of the inserted apartments.
+
+    Returns:
+        list[str]: The payloads.
+    """
+    payloads: list[str] = []
+    current: list[str] = []
+    size = 0
+    for apartment_id in map(str, apartment_ids):
+        if current and size + len(apartment_id) + 1 > MAX_PAYLOAD_BYTES:
+            payloads.append(",".join(current))
+            current, size = [], 0
+        current.append(apartment_id)
+        size += len(apartment_id) + 1
+    if current:
+        payloads.append(",".join(current))
+    return payloads
+
+
+class PostgresListener:
+    """Listens for newly inserted apartments announced with NOTIFY and publishes them to a broker.
+
+    The ingest path notifies the ids of inserted apartments on `CHANNEL` when it commits, so every API worker receives
+    them, no matter which process did the ingest. The listener runs in a thread with its own connection, loads the
+    apartments once per notification and hands the messages over to the event loop of the broker.
+    """
+
+    def __init__(
+        self: Self,
+        engine: "Engine",
+        broker: Broker,
+        load: Callable[[list[int]], list[bytes]],
+        poll_interval: float = 1.0,
+    ) -> None:
+        """Initialize the listener.
+
+        Args:
+            engine (Engine): An engine connected to PostgreSQL.
+            broker (Broker): The broker to publish to.
+            load (Callable[[list[int]], list[bytes]]): Turns apartment ids into the messages to publish.
+            poll_interval (float, optional): Seconds between checks whether the listener should stop. Defaults to 1.0.
+        """
+        self.engine = engine
+        self.broker = broker
+        self.load = load
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    def start(self: Self) -> None:
+        """Start listening in a background thread. Must be called from the thread running the event loop."""
+        self._loop = asyncio.get_running_loop()
+        self._thread = threading.Thread(target=self._run, name="postgres-listener", daemon=True)
+        self._thread.start()
+
+    def stop(self: Self) -> None:
+        """Stop listening and wait for the thread to finish."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self: Self) -> None:
+        """Listen for notifications until stopped."""
+        connection = self.engine.raw_connection()
+        connection.detach()  # the connection is changed to autocommit, so it must not go back to the pool
+        try:
+            connection.set_isolation_level(0)  # autocommit, required to receive notifications
+            with connection.cursor() as cursor:
+                cursor.execute(f"LISTEN {CHANNEL}")
+            while not self._stop.is_set():
+                if not select.select([connection], [], [], self.poll_interval)[0]:
+                    continue
+                connection.poll()
+                while connection.notifies:
+                    notification = connection.notifies.pop(0)
+                    self._publish([int(apartment_id) for apartment_id in notification.payload.split(",")])
+        finally:
+            connection.close()
+
+    def _publish(self: Self, apartment_ids: list[int]) -> None:
+        """Load the apartments and publish them on the event loop of the broker."""
+        try:
+            messages = self.load(apartment_ids)
+        except Exception:
+            logger.exception(f"Failed to load {len(apartment_ids)} apartments for the live feed")
+            return
+        if self._loop is not None:
+            for message in messages:
+                self._loop.call_soon_threadsafe(self.broker.publish, message)
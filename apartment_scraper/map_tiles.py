@@ -0,0 +1,248 @@
+import math
+import threading
+import time
+from collections import defaultdict
+from typing import TYPE_CHECKING, Any, NamedTuple, Self
+
+import orjson
+from loguru import logger
+
+from apartment_scraper.models import percentile
+
+
+if TYPE_CHECKING:
+    from apartment_scraper.models import Model
+    from apartment_scraper.snapshot import SnapshotStore
+
+TILE_SIZE = 256  # pixels of a map tile
+CELL_SIZE = 64  # pixels, apartments closer than about this on the screen are joined into one cluster
+CELLS_PER_TILE = TILE_SIZE // CELL_SIZE
+MAX_CLUSTER_ZOOM = 15  # at higher zoom levels the apartments are served one by one
+MAX_ZOOM = 20
+MAX_LATITUDE = 85.05112878  # the web mercator projection is cut off at this latitude
+
+
+class MapPoint(NamedTuple):
+    """An apartment on the map, with its position in web mercator coordinates from 0 to 1."""
+    apartment_id: int
+    lat: float
+    lon: float
+    x: float
+    y: float
+    price: float
+
+
+class Cluster(NamedTuple):
+    """A group of apartments of a grid cell, placed at their average position. A single apartment keeps its id."""
+    lat: float
+    lon: float
+    count: int
+    median_price: float | None
+    apartment_id: int | None
+
+
+def project(lat: float, lon: float) -> tuple[float, float]:
+    """Project a position to web mercator coordinates, from 0 to 1 from west to east and from north to south.
+
+    Args:
+        lat (float): The latitude.
+        lon (float): The longitude.
+
+    Returns:
+        tuple[float, float]: The x and y coordinates.
+    """
+    sin_lat = math.sin(math.radians(max(min(lat, MAX_LATITUDE), -MAX_LATITUDE)))
+    x = (lon + 180) / 360
+    y = 0.5 - math.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)
+    return min(max(x, 0), 1 - 1e-12), min(max(y, 0), 1 - 1e-12)
+
+
+def to_points(rows: list[tuple[int, str, float]]) -> list[MapPoint]:
+    """Turn the rows of `Model.get_map_points` into map points, skipping coordinates that can't be parsed."""
+    points = []
+    for apartment_id, coordinates, price in rows:
+        try:
+            lat, lon = (float(value) for value in coordinates.split(","))
+        except ValueError:
+            continue
+        points.append(MapPoint(apartment_id, lat, lon, *project(lat, lon), price))
+    return points
+
+
+class TileIndex:
+    """The apartments pre-clustered per zoom level and grouped by map tile.
+
+    At each zoom level up to `MAX_CLUSTER_ZOOM`, the apartments are grouped in a grid of cells of `CELL_SIZE` pixels,
+    with the number of apartments and their median price per cell. Each zoom level is built from the cells of the next
+    higher one, as four cells make up one cell of the level below. At higher zoom levels, the apartments of a tile are
+    served one by one. A tile at any zoom level is then looked up without going through all apartments.
+    """
+
+    def __init__(self: Self, points: list[MapPoint]) -> None:
+        """Cluster the apartments for all zoom levels.
+
+        Args:
+            points (list[MapPoint]): The apartments.
+        """
+        self.point_count = len(points)
+        self.clusters: list[dict[tuple[int, int], list[Cluster]]] = []
+        self.points: defaultdict[tuple[int, int], list[MapPoint]] = defaultdict(list)
+
+        # The cells of a zoom level, with the number, the summed positions and the prices of their apartments, and the
+        # id of the first apartment, which is kept for cells with a single apartment.
+        scale = 2**MAX_CLUSTER_ZOOM
+        cells: dict[tuple[int, int], tuple[int, float, float, list[float], int]] = {}
+        for point in points:
+            self.points[(int(point.x * scale), int(point.y * scale))].append(point)
+            key = (int(point.x * scale * CELLS_PER_TILE), int(point.y * scale * CELLS_PER_TILE))
+            if key in cells:
+                count, lat_sum, lon_sum, prices, first_id = cells[key]
+                prices.append(point.price)
+                cells[key] = (count + 1, lat_sum + point.lat, lon_sum + point.lon, prices, first_id)
+            else:
+                cells[key] = (1, point.lat, point.lon, [point.price], point.apartment_id)
+
+        for _ in range(MAX_CLUSTER_ZOOM + 1):
+            tiles: defaultdict[tuple[int, int], list[Cluster]] = defaultdict(list)
+            parents: dict[tuple[int, int], tuple[int, float, float, list[float], int]] = {}
+            for (cell_x, cell_y), (count, lat_sum, lon_sum, prices, first_id) in cells.items():
+                prices.sort()
+                tiles[(cell_x // CELLS_PER_TILE, cell_y // CELLS_PER_TILE)].append(
+                    Cluster(
+                        round(lat_sum / count, 6),
+                        round(lon_sum / count, 6),
+                        count,
+                        percentile(prices, 0.5),
+                        first_id if count == 1 else None,
+                    )
+                )
+                parent_key = (cell_x >> 1, cell_y >> 1)
+                if parent_key in parents:
+                    parent_count, parent_lat, parent_lon, parent_prices, parent_id = parents[parent_key]
+                    parent_prices.extend(prices)
+                    parents[parent_key] = (
+                        parent_count + count, parent_lat + lat_sum, parent_lon + lon_sum, parent_prices, parent_id
+                    )
+                else:
+                    parents[parent_key] = (count, lat_sum, lon_sum, prices, first_id)
+            self.clusters.append(tiles)
+            cells = parents
+        self.clusters.reverse()
+
+    def tile(self: Self, z: int, x: int, y: int) -> list[Cluster]:
+        """Get the clusters, or the single apartments, of a map tile.
+
+        Args:
+            z (int): The zoom level.
+            x (int): The column of the tile, from west to east.
+            y (int): The row of the tile, from north to south.
+
+        Raises:
+            ValueError: If the tile doesn't exist.
+
+        Returns:
+            list[Cluster]: The clusters of the tile.
+        """
+        if not 0 <= z <= MAX_ZOOM or not 0 <= x < 2**z or not 0 <= y < 2**z:
+            msg = f"There is no tile {z}/{x}/{y}"
+            raise ValueError(msg)
+        if z <= MAX_CLUSTER_ZOOM:
+            return self.clusters[z].get((x, y), [])
+
+        shift = z - MAX_CLUSTER_ZOOM
+        scale = 2**z
+        return [
+            Cluster(point.lat, point.lon, 1, point.price, point.apartment_id)
+            for point in self.points.get((x >> shift, y >> shift), [])
+            if int(point.x * scale) == x and int(point.y * scale) == y
+        ]
+
+    def tile_geojson(self: Self, z: int, x: int, y: int) -> bytes:
+        """Get a map tile as a GeoJSON FeatureCollection of points.
+
+        A cluster has the properties `cluster`, `point_count` and `median_price`, a single apartment the properties
+        `cluster`, `apartment_id` and `price`.
+
+        Args:
+            z (int): The zoom level.
+            x (int): The column of the tile, from west to east.
+            y (int): The row of the tile, from north to south.
+
+        Raises:
+            ValueError: If the tile doesn't exist.
+
+        Returns:
+            bytes: The encoded GeoJSON.
+        """
+        features = []
+        for cluster in self.tile(z, x, y):
+            properties: dict[str, Any]
+            if cluster.apartment_id is None:
+                properties = {"cluster": True, "point_count": cluster.count, "median_price": cluster.median_price}
+            else:
+                properties = {"cluster": False, "apartment_id": cluster.apartment_id, "price": cluster.median_price}
+            features.append(
+                {
+                    "type": "Feature",
+                    "geometry": {"type": "Point", "coordinates": [cluster.lon, cluster.lat]},
+                    "properties": properties,
+                }
+            )
+        return orjson.dumps({"type": "FeatureCollection", "features": features})
+
+
+class TileIndexCache:
+    """Keeps the tile index of all apartments in memory and rebuilds it once it is older than `max_age` seconds.
+
+    Only the first request waits for the index to be built. An index that is too old is rebuilt in a background thread,
+    like `maps.MapArtifacts`, and the old index is served until the new one replaces it.
+    """
+
+    def __init__(self: Self, model: "Model | SnapshotStore", max_age: float = 300) -> None:
+        """Initialize the cache. The index is built on the first request.
+
+        Args:
+            model (Model | SnapshotStore): The database model, or the snapshot of the apartments.
+            max_age (float, optional): Seconds after which the index is rebuilt. Defaults to 300.
+        """
+        self.model = model
+        self.max_age = max_age
+        self._index: TileIndex | None = None
+        self._built = 0.0
+        self._lock = threading.Lock()
+        self._builder: threading.Thread | None = None
+
+    def get(self: Self) -> TileIndex:
+        """Get the tile index, and start a rebuild in the background if it is too old."""
+        index = self._index
+        if index is None:
+            with self._lock:
+                return self._index or self.build()
+        if time.monotonic() - self._built > self.max_age:
+            self.build_in_background()
+        return index
+
+    def build(self: Self) -> TileIndex:
+        """Build the tile index of the current apartments and replace the served one with it."""
+        start_time = time.perf_counter()
+        index = TileIndex(to_points(self.model.get_map_points()))
+        self._index, self._built = index, time.monotonic()
+        logger.info(
+            f"Built the map tile index of {index.point_count} apartments in {time.perf_counter() - start_time:.2f}s"
+        )
+        return index
+
+    def build_in_background(self: Self) -> None:
+        """Start `build` in a background thread, unless a build is already running."""
+        with self._lock:
+            if self._builder is not None and self._builder.is_alive():
+                return
+            self._builder = threading.Thread(target=self._build_logged, name="tile-index-builder", daemon=True)
+            self._builder.start()
+
+    def _build_logged(self: Self) -> None:
+        """Run `build`, logging instead of raising errors, as nobody waits for the background thread."""
+        try:
+            self.build()
+        except Exception:
+            logger.exception("Building the map tile index failed")
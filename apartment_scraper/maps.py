@@ -0,0 +1,305 @@
+import functools
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from collections.abc import Callable
+from pathlib import Path
+from typing import Self
+
+import folium
+from loguru import logger
+
+from apartment_scraper import districts
+from apartment_scraper.models import MapFilter, MarketStats, Model
+
+
+# The rendered maps, outside of the package, which may be installed read-only. Share it between the API and the
+# scheduler by setting it to the same directory.
+MAP_CACHE_DIR = Path(os.environ.get("MAP_CACHE_DIR", Path(tempfile.gettempdir()) / "apartment_scraper" / "maps"))
+
+# The apartments shown on the map by default, the larger affordable apartments of Vienna.
+DEFAULT_MAP_FILTER = MapFilter(min_post_code=1000, max_post_code=1999, min_rooms=3, max_price=400_000)
+
+
+def get_price_per_area_thresholds(stats: list[MarketStats]) -> tuple[float, float, float]:
+    """Derive the thresholds used by `get_color` from the market statistics.
+
+    The 25th percentile, the median and the 75th percentile of each group are averaged, weighted by the number of
+    listings in the group. This approximates the percentiles over all the groups without going through the apartments.
+
+    Args:
+        stats (list[MarketStats]): Market statistics, e.g. for all post codes of Vienna.
+
+    Returns:
+        tuple[float, float, float]: The cheap, average and expensive thresholds of the price per area.
+    """
+    weighted = [stat for stat in stats if stat.price_per_area_median is not None]
+    total = sum(stat.listing_count for stat in weighted)
+    if not total:
+        return (2_000, 3_500, 5_000)
+    return (
+        round(sum((stat.price_per_area_p25 or 0) * stat.listing_count for stat in weighted) / total, 2),
+        round(sum((stat.price_per_area_median or 0) * stat.listing_count for stat in weighted) / total, 2),
+        round(sum((stat.price_per_area_p75 or 0) * stat.listing_count for stat in weighted) / total, 2),
+    )
+
+
+def get_color(price_per_area: float, thresholds: tuple[float, float, float] = (2_000, 3_500, 5_000)) -> str:
+    """Determines the color category based on the price per area.
+
+    Args:
+        price_per_area (float): The price per area of the apartment.
+        thresholds (tuple[float, float, float], optional): The cheap, average and expensive price per area, for example
+            from `get_price_per_area_thresholds`. Defaults to (2_000, 3_500, 5_000).
+
+    Returns:
+        str: The color category of the apartment. Possible values are "green", "yellow", "orange", or "red".
+
+    Raises:
+        None
+    """
+    cheap, average, expensive = thresholds
+
+    if price_per_area < cheap:
+        return "green"
+    elif price_per_area < average:
+        return "yellow"
+    elif price_per_area < expensive:
+        return "orange"
+    else:
+        return "red"
+
+
+def get_rooms_color(rooms: float) -> str:
+    """Determines the color category based on the number of rooms.
+
+    Args:
+        rooms (int): The number of rooms in the apartment.
+
+    Returns:
+        str: The color category of the apartment. Possible values are "red", "orange", "yellow", or "green".
+
+    Raises:
+        None
+    """
+    small_apartment = 3
+    average_apartment = 4
+    big_apartment = 5
+
+    if rooms < small_apartment:
+        return "red"
+    elif rooms < average_apartment:
+        return "orange"
+    elif rooms < big_apartment:
+        return "yellow"
+    else:
+        return "green"
+
+
+def add_district_choropleth(
+    base_map: folium.Map,
+    model: Model,
+    index: districts.DistrictIndex,
+    thresholds: tuple[float, float, float] | None = None,
+) -> None:
+    """Add the districts to a map, colored by the median price per area of their apartments.
+
+    Args:
+        base_map (folium.Map): The map.
+        model (Model): The database model.
+        index (districts.DistrictIndex): The districts.
+        thresholds (tuple[float, float, float] | None, optional): The thresholds of the colors, see `get_color`.
+            Defaults to the thresholds of the market statistics.
+    """
+    thresholds = thresholds or get_price_per_area_thresholds(model.get_market_stats())
+
+    def style(feature: dict) -> dict[str, str | float]:
+        median = feature["properties"]["median_price_per_area"]
+        return {
+            "fillColor": "gray" if median is None else get_color(median, thresholds),
+            "fillOpacity": 0.3,
+            "color": "black",
+            "weight": 1,
+        }
+
+    folium.GeoJson(
+        districts.get_choropleth(model, index),
+        style_function=style,
+        tooltip=folium.GeoJsonTooltip(
+            fields=["name", "count", "median_price_per_area"], aliases=["District", "Apartments", "Median €/m²"]
+        ),
+    ).add_to(base_map)
+
+
+def render_map(
+    model: Model,
+    map_filter: MapFilter = DEFAULT_MAP_FILTER,
+    price_color: Callable[[float], str] | None = None,
+    rooms_color: Callable[[float], str] = get_rooms_color,
+) -> folium.Map:
+    """Render a map of the apartments, on top of the districts colored by their median price per area.
+
+    The apartments and the districts are colored by the same bands of the price per area, derived from the market
+    statistics, so the colors follow the market instead of fixed prices.
+
+    Args:
+        model (Model): The database model.
+        map_filter (MapFilter, optional): Criteria of the apartments to show. Defaults to DEFAULT_MAP_FILTER.
+        price_color (Callable[[float], str] | None, optional): The fill color of an apartment by its price per area.
+            Defaults to `get_color` with the thresholds of `get_price_per_area_thresholds`.
+        rooms_color (Callable[[float], str], optional): The border color of an apartment by its number of rooms.
+            Defaults to get_rooms_color.
+
+    Returns:
+        folium.Map: The map.
+    """
+    base_map = folium.Map(location=[48.20849, 16.37208], zoom_start=11)
+    thresholds = get_price_per_area_thresholds(model.get_market_stats())
+    if price_color is None:
+        price_color = functools.partial(get_color, thresholds=thresholds)
+
+    index = districts.get_index()
+    if index is not None:
+        add_district_choropleth(base_map, model, index, thresholds)
+
+    for apartment in model.iter_map_data(map_filter):
+        folium.Circle(
+            location=apartment.coordinates.split(","),
+            tooltip=(
+                f"Price: {apartment.price}<br>Area: {apartment.area}<br>Rooms: {apartment.rooms}<br>"
+                f"Price/m2: {apartment.price_per_area}<br>Free area: {apartment.free_area}"
+            ),
+            popup=f"<a href='{apartment.url}'>{apartment.apartment_id}</a>",
+            color=rooms_color(apartment.rooms),
+            radius=100,
+            fill=True,
+            fillOpacity=0.4,
+            fillColor="gray" if apartment.price_per_area is None else price_color(apartment.price_per_area),
+        ).add_to(base_map)
+    return base_map
+
+
+class MapArtifacts:
+    """Rendered maps, cached on disk as HTML files per version of the dataset.
+
+    A map is rendered once per dataset version, e.g. by the crawler after each ingest, and then served as a static
+    file. When the dataset changed and the map of the new version doesn't exist yet, it is rebuilt in a background
+    thread, and the map of the previous version is served meanwhile. The file name also contains a key of the
+    database, the filter and the color functions, so maps of other databases or rendered with different settings
+    sharing the directory are never served or replaced.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self: Self,
+        model: Model,
+        directory: Path = MAP_CACHE_DIR,
+        map_filter: MapFilter = DEFAULT_MAP_FILTER,
+        price_color: Callable[[float], str] | None = None,
+        rooms_color: Callable[[float], str] = get_rooms_color,
+        check_interval: float = 30,
+        keep: int = 2,
+    ) -> None:
+        """Initialize the cache.
+
+        Args:
+            model (Model): The database model.
+            directory (Path, optional): The directory of the HTML files. Defaults to MAP_CACHE_DIR.
+            map_filter (MapFilter, optional): Criteria of the apartments to show. Defaults to DEFAULT_MAP_FILTER.
+            price_color (Callable[[float], str] | None, optional): The fill color of an apartment by its price per area.
+                Defaults to the colors of the market statistics, see `render_map`.
+            rooms_color (Callable[[float], str], optional): The border color of an apartment by its number of rooms.
+                Defaults to get_rooms_color.
+            check_interval (float, optional): Seconds between checks of the dataset version in `get`. Defaults to 30.
+            keep (int, optional): The number of versions kept on disk. Defaults to 2.
+        """
+        self.model = model
+        self.directory = directory
+        self.map_filter = map_filter
+        self.price_color = price_color
+        self.rooms_color = rooms_color
+        self.check_interval = check_interval
+        self.keep = keep
+        price_color_name = f"{price_color.__module__}.{price_color.__qualname__}" if price_color else "market_stats"
+        database = model.engine.url.render_as_string(hide_password=True)
+        settings = f"{database}|{map_filter}|{price_color_name}|"
+        settings += f"{rooms_color.__module__}.{rooms_color.__qualname__}"
+        self.key = hashlib.sha256(settings.encode()).hexdigest()[:8]
+        self._checked = -float("inf")
+        self._lock = threading.Lock()
+        self._builder: threading.Thread | None = None
+
+    def path(self: Self, version: str) -> Path:
+        """The HTML file of the map of a dataset version."""
+        return self.directory / f"map-{self.key}-{version}.html"
+
+    def version(self: Self) -> str:
+        """The version of the data shown on the map: the apartments, the market statistics and the districts."""
+        return f"{self.model.get_dataset_version()}{self.model.get_derived_data_version()[:8]}"
+
+    def build(self: Self) -> Path:
+        """Render the map of the current dataset version, unless it exists already.
+
+        The map is written to a temporary file first and then renamed, so a half written map is never served. Older
+        versions beyond `keep` are removed.
+
+        Returns:
+            Path: The HTML file of the map.
+        """
+        version = self.version()
+        path = self.path(version)
+        if path.exists():
+            return path
+
+        start_time = time.perf_counter()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f".{threading.get_ident()}.tmp")
+        render_map(self.model, self.map_filter, self.price_color, self.rooms_color).save(tmp_path)
+        tmp_path.replace(path)
+        logger.info(f"Built the map of dataset version {version} in {time.perf_counter() - start_time:.2f}s")
+
+        for old_path in self._versions()[self.keep :]:
+            old_path.unlink(missing_ok=True)
+        return path
+
+    def build_in_background(self: Self) -> None:
+        """Start `build` in a background thread, unless a build is already running."""
+        with self._lock:
+            if self._builder is not None and self._builder.is_alive():
+                return
+            self._builder = threading.Thread(target=self._build_logged, name="map-builder", daemon=True)
+            self._builder.start()
+
+    def _build_logged(self: Self) -> None:
+        """Run `build`, logging instead of raising errors, as nobody waits for the background thread."""
+        try:
+            self.build()
+        except Exception:
+            logger.exception("Building the map failed")
+
+    def get(self: Self) -> Path | None:
+        """Get the latest map, and start a rebuild in the background if the dataset changed.
+
+        The dataset version is checked at most once per `check_interval`, so most calls only look at the files.
+
+        Returns:
+            Path | None: The HTML file of the latest map, or None if no map was built yet.
+        """
+        now = time.monotonic()
+        if now - self._checked > self.check_interval:
+            self._checked = now
+            if not self.path(self.version()).exists():
+                self.build_in_background()
+        versions = self._versions()
+        return versions[0] if versions else None
+
+    def _versions(self: Self) -> list[Path]:
+        """The HTML files of the maps with these settings, newest first."""
+        versions = []
+        for path in self.directory.glob(f"map-{self.key}-*.html"):
+            try:
+                versions.append((path.stat().st_mtime, path))
+            except FileNotFoundError:  # removed by a build in the meantime
+                continue
+        return [path for _, path in sorted(versions, reverse=True)]
@@ -0,0 +1,172 @@
+import json
+from bisect import bisect_left, bisect_right
+from collections.abc import Iterable
+from typing import TYPE_CHECKING, Self
+
+from loguru import logger
+
+from apartment_scraper.models import Apartment, SavedSearch
+
+
+if TYPE_CHECKING:
+    from apartment_scraper.models import Model
+
+# Apartment field -> (lower bound, upper bound) attribute of SavedSearch.
+RANGE_FIELDS: dict[str, tuple[str | None, str | None]] = {
+    "rooms": ("min_rooms", "max_rooms"),
+    "area": ("min_area", "max_area"),
+    "price": ("min_price", "max_price"),
+    "price_per_area": ("min_price_per_area", "max_price_per_area"),
+    "free_area": ("min_free_area", None),
+}
+
+
+class _LowerBounds:
+    """Finds the searches whose lower bound of a field is satisfied by a value.
+
+    Searches are represented as bits of an integer. The bounds are sorted, and for every prefix of the sorted bounds the
+    union of the search bits is precomputed, so a lookup is a binary search plus one bitwise OR.
+    """
+
+    def __init__(self: Self, bounds: list[tuple[float, int]], unbounded: int) -> None:
+        """Initialize the index.
+
+        Args:
+            bounds (list[tuple[float, int]]): The lower bound and the bit of each search with a bound.
+            unbounded (int): The bits of the searches without a bound.
+        """
+        bounds.sort()
+        self.values = [value for value, _ in bounds]
+        self.masks = [0]
+        for _, bit in bounds:
+            self.masks.append(self.masks[-1] | bit)
+        self.unbounded = unbounded
+
+    def match(self: Self, value: float | None) -> int:
+        """Get the bits of the searches with a lower bound <= value."""
+        if value is None:
+            return self.unbounded
+        return self.masks[bisect_right(self.values, value)] | self.unbounded
+
+
+class _UpperBounds:
+    """Finds the searches whose upper bound of a field is satisfied by a value, see `_LowerBounds`."""
+
+    def __init__(self: Self, bounds: list[tuple[float, int]], unbounded: int) -> None:
+        """Initialize the index.
+
+        Args:
+            bounds (list[tuple[float, int]]): The upper bound and the bit of each search with a bound.
+            unbounded (int): The bits of the searches without a bound.
+        """
+        bounds.sort()
+        self.values = [value for value, _ in bounds]
+        self.masks = [0]
+        for _, bit in reversed(bounds):
+            self.masks.append(self.masks[-1] | bit)
+        self.masks.reverse()
+        self.unbounded = unbounded
+
+    def match(self: Self, value: float | None) -> int:
+        """Get the bits of the searches with an upper bound >= value."""
+        if value is None:
+            return self.unbounded
+        return self.masks[bisect_left(self.values, value)] | self.unbounded
+
+
+class SearchIndex:
+    """Saved searches compiled into an index over their numeric ranges and post code sets.
+
+    Matching an apartment costs a binary search per range and a few bitwise operations, instead of evaluating every
+    saved search. The cost of matching a batch therefore grows with the number of apartments, and only marginally with
+    the number of saved searches.
+    """
+
+    def __init__(self: Self, searches: list[SavedSearch]) -> None:
+        """Compile the saved searches.
+
+        Args:
+            searches (list[SavedSearch]): The saved searches to match against.
+        """
+        self.search_ids = [search.id for search in searches]
+        everything = (1 << len(searches)) - 1
+
+        self.by_post_code: dict[int, int] = {}
+        self.any_post_code = 0
+        for position, search in enumerate(searches):
+            if post_codes := json.loads(search.post_codes or "null"):
+                for post_code in post_codes:
+                    self.by_post_code[post_code] = self.by_post_code.get(post_code, 0) | 1 << position
+            else:
+                self.any_post_code |= 1 << position
+
+        self.bounds: list[tuple[str, _LowerBounds | _UpperBounds]] = []
+        for field, (lower, upper) in RANGE_FIELDS.items():
+            for attribute, bounds_class in ((lower, _LowerBounds), (upper, _UpperBounds)):
+                if attribute is None:
+                    continue
+                bounds = [
+                    (value, 1 << position)
+                    for position, search in enumerate(searches)
+                    if (value := getattr(search, attribute)) is not None
+                ]
+                unbounded = everything & ~sum(bit for _, bit in bounds)
+                if unbounded != everything:
+                    self.bounds.append((field, bounds_class(bounds, unbounded)))
+
+    def match(self: Self, apartment: Apartment) -> list[int]:
+        """Get the ids of the saved searches matching an apartment.
+
+        Args:
+            apartment (Apartment): An apartment.
+
+        Returns:
+            list[int]: The ids of the matching saved searches.
+        """
+        mask = self.by_post_code.get(apartment.post_code, 0) | self.any_post_code
+        for field, bounds in self.bounds:
+            if not mask:
+                return []
+            mask &= bounds.match(getattr(apartment, field))
+
+        matches = []
+        while mask:
+            lowest = mask & -mask
+            matches.append(self.search_ids[lowest.bit_length() - 1])
+            mask ^= lowest
+        return matches
+
+    def match_many(self: Self, apartments: Iterable[Apartment]) -> list[tuple[int, int]]:
+        """Match a batch of apartments.
+
+        Args:
+            apartments (Iterable[Apartment]): The apartments.
+
+        Returns:
+            list[tuple[int, int]]: A (search id, apartment_id) pair per match.
+        """
+        return [
+            (search_id, apartment.apartment_id)
+            for apartment in apartments
+            for search_id in self.match(apartment)
+        ]
+
+
+def notify_matches(model: "Model", apartments: list[Apartment]) -> int:
+    """Match freshly ingested apartments against all saved searches and record the matches as notifications.
+
+    Args:
+        model (Model): The database model.
+        apartments (list[Apartment]): The new apartments.
+
+    Returns:
+        int: The number of new notifications.
+    """
+    searches = model.get_saved_searches()
+    if not searches or not apartments:
+        return 0
+
+    matches = SearchIndex(searches).match_many(apartments)
+    count = model.add_search_notifications(matches)
+    logger.info(f"Matched {len(apartments)} apartments against {len(searches)} saved searches: {count} notifications")
+    return count
@@ -0,0 +1,146 @@
+from time import perf_counter
+from typing import TYPE_CHECKING, Self
+
+from prometheus_client import Counter, Gauge, Histogram
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+
+
+if TYPE_CHECKING:
+    from sqlalchemy.future.engine import Engine
+    from sqlalchemy.pool.base import _ConnectionFairy, _ConnectionRecord
+    from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Buckets in seconds, from fast API responses to slow pages of the crawl.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Buckets in seconds for holding a connection, from a lookup by primary key to a long write or export.
+POOL_CHECKOUT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30)
+
+API_REQUEST_DURATION = Histogram(
+    "apartment_api_request_duration_seconds",
+    "Latency of API requests per endpoint.",
+    ["method", "endpoint", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+CRAWL_PAGE_DURATION = Histogram(
+    "apartment_crawl_page_duration_seconds",
+    "Latency of fetching a page of search results.",
+    ["source"],
+    buckets=LATENCY_BUCKETS,
+)
+CRAWL_PAGE_RESPONSES = Counter(
+    "apartment_crawl_page_responses_total",
+    "Fetched pages of search results per HTTP status code.",
+    ["source", "status"],
+)
+PARSE_DURATION = Histogram(
+    "apartment_parse_duration_seconds",
+    "Time to parse a page of adverts.",
+    ["source"],
+    buckets=LATENCY_BUCKETS,
+)
+PARSED_ADVERTS = Counter(
+    "apartment_parsed_adverts_total",
+    "Parsed adverts.",
+    ["source"],
+)
+PARSE_FAILURES = Counter(
+    "apartment_parse_failures_total",
+    "Adverts where a field could not be parsed, per field.",
+    ["field"],
+)
+DB_ROWS_WRITTEN = Counter(
+    "apartment_db_rows_written_total",
+    "Rows written to the database.",
+    ["table", "operation"],
+)
+DB_COMMIT_DURATION = Histogram(
+    "apartment_db_commit_duration_seconds",
+    "Latency of committing a transaction.",
+    ["operation"],
+    buckets=LATENCY_BUCKETS,
+)
+DB_POOL_CONNECTIONS = Gauge(
+    "apartment_db_pool_connections",
+    "Connections of the database pool. Saturated when checked_out reaches size plus max_overflow.",
+    ["state"],
+)
+DB_POOL_CHECKOUT_DURATION = Histogram(
+    "apartment_db_pool_checkout_duration_seconds",
+    "Time a connection is checked out of the pool, from taking it to returning it.",
+    buckets=POOL_CHECKOUT_BUCKETS,
+)
+
+
+def track_pool(engine: "Engine", max_overflow: int = 0) -> None:
+    """Report the connections of the pool of an engine and how long they are checked out, by the events of the pool.
+
+    Only pools with a fixed size, i.e. a QueuePool as used for PostgreSQL, have a saturation to report. By Little's law,
+    the rate of checkouts times their mean duration is the number of connections a process needs.
+
+    Args:
+        engine (Engine): The engine to track.
+        max_overflow (int, optional): The connections the pool may open beyond its size, as passed to `create_engine`.
+            Defaults to 0.
+    """
+    pool = engine.pool
+
+    def on_checkout(_dbapi_connection: object, record: "_ConnectionRecord", _proxy: "_ConnectionFairy") -> None:
+        record.info["checked_out"] = perf_counter()
+
+    def on_checkin(_dbapi_connection: object, record: "_ConnectionRecord") -> None:
+        if (start := record.info.pop("checked_out", None)) is not None:
+            DB_POOL_CHECKOUT_DURATION.observe(perf_counter() - start)
+
+    event.listen(pool, "checkout", on_checkout)
+    event.listen(pool, "checkin", on_checkin)
+    if not isinstance(pool, QueuePool):
+        return
+    DB_POOL_CONNECTIONS.labels(state="size").set_function(pool.size)
+    DB_POOL_CONNECTIONS.labels(state="checked_out").set_function(pool.checkedout)
+    DB_POOL_CONNECTIONS.labels(state="checked_in").set_function(pool.checkedin)
+    DB_POOL_CONNECTIONS.labels(state="overflow").set_function(lambda: max(pool.overflow(), 0))
+    DB_POOL_CONNECTIONS.labels(state="max_overflow").set(max_overflow)
+
+
+class PrometheusMiddleware:
+    """ASGI middleware that records the latency of each request in `API_REQUEST_DURATION`.
+
+    Requests are labelled with the path template of the route, e.g. `/apartments/{apartment_id}`, to keep the number of
+    time series bounded. Paths in `excluded_paths`, like endless streams, are not recorded.
+    """
+
+    def __init__(self: Self, app: "ASGIApp", excluded_paths: tuple[str, ...] = ()) -> None:
+        """Initialize the middleware.
+
+        Args:
+            app (ASGIApp): The application to wrap.
+            excluded_paths (tuple[str, ...], optional): Paths that are not recorded. Defaults to ().
+        """
+        self.app = app
+        self.excluded_paths = excluded_paths
+
+    async def __call__(self: Self, scope: "Scope", receive: "Receive", send: "Send") -> None:
+        """Handle a request."""
+        if scope["type"] != "http" or scope["path"] in self.excluded_paths:
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        start = perf_counter()
+
+        async def send_with_status(message: "Message") -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            API_REQUEST_DURATION.labels(
+                method=scope["method"],
+                endpoint=route.path if route is not None else "unmatched",
+                status=status,
+            ).observe(perf_counter() - start)
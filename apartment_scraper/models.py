@@ -1,24 +1,133 @@
+import base64
+import hashlib
+import math
 import os
-from datetime import datetime
-from typing import TYPE_CHECKING, NamedTuple, Self
+from collections import defaultdict
+from datetime import datetime, timedelta
+from enum import StrEnum
+from typing import TYPE_CHECKING, Any, NamedTuple, Self
 from zoneinfo import ZoneInfo
 
 from loguru import logger
-from sqlalchemy.engine import URL
-from sqlmodel import Field, Session, SQLModel, create_engine, select, update
+from pydantic import PrivateAttr
+from sqlalchemy import (
+    DDL,
+    JSON,
+    Boolean,
+    Column,
+    DateTime,
+    ForeignKey,
+    Index,
+    UniqueConstraint,
+    and_,
+    bindparam,
+    case,
+    inspect,
+    literal,
+    or_,
+    table,
+    tuple_,
+)
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import URL, make_url
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ColumnClause
+from sqlalchemy.sql.functions import FunctionElement, now
+from sqlmodel import Field, Session, SQLModel, create_engine, delete, func, select, update
 
-from apartment_scraper import pkg_path
+from apartment_scraper import live, metrics, pkg_path, text, tracing
 
 
 if TYPE_CHECKING:
+    from collections.abc import Iterator
+
+    from sqlalchemy.engine import Connection, Dialect
     from sqlalchemy.engine.cursor import CursorResult
+    from sqlalchemy.engine.reflection import Inspector
     from sqlalchemy.future.engine import Engine
+    from sqlalchemy.schema import Table
+    from sqlalchemy.sql.compiler import SQLCompiler
+
+
+# The sessions of the PostgreSQL server, to find the transactions that are still writing, see `Model._settled_until`.
+_PG_STAT_ACTIVITY = table(
+    "pg_stat_activity",
+    ColumnClause("datname"),
+    ColumnClause("xact_start", DateTime(timezone=True)),
+    ColumnClause("backend_xid"),
+)
+# The installed extensions of the PostgreSQL database, to find out whether the trigram search is available.
+_PG_EXTENSION = table("pg_extension", ColumnClause("extname"))
+# The trigram index of the fuzzy search, created once by `Model.create_search_index`, as it needs `pg_trgm`.
+_SEARCH_TEXT_INDEX = DDL(
+    "CREATE INDEX IF NOT EXISTS ix_apartments_search_text_trgm ON apartments USING gin (search_text gin_trgm_ops)"
+)
+
+# Keeps the newest row of each apartment_id, before the unique index of apartment_id is added to an older table.
+_DELETE_DUPLICATE_APARTMENTS = DDL(
+    "DELETE FROM apartments WHERE id NOT IN (SELECT max(id) FROM apartments GROUP BY apartment_id)"
+)
+# Moves the image URLs of the JSON text column `image_urls` of older tables to `apartment_images`, by dialect.
+_MOVE_IMAGE_URLS = {
+    "postgresql": DDL(
+        "INSERT INTO apartment_images (apartment_id, position, url) "
+        "SELECT apartments.apartment_id, images.position - 1, images.url FROM apartments, "
+        "jsonb_array_elements_text(apartments.image_urls::jsonb) WITH ORDINALITY AS images(url, position) "
+        "ON CONFLICT DO NOTHING"
+    ),
+    "sqlite": DDL(
+        "INSERT INTO apartment_images (apartment_id, position, url) "
+        "SELECT apartments.apartment_id, images.key, images.value FROM apartments, json_each(apartments.image_urls) "
+        "AS images WHERE true ON CONFLICT DO NOTHING"
+    ),
+}
+
+
+@compiles(now, "sqlite")
+def _sqlite_now(element: now, compiler: "SQLCompiler", **kw: "Any") -> str:  # noqa: ANN401
+    """Render now() on SQLite with microseconds, in the same format SQLAlchemy stores datetimes.
+
+    SQLite's CURRENT_TIMESTAMP only has a resolution of seconds and a different format, which breaks the ordering of the
+    change feed when comparing to timestamps bound from Python.
+    """
+    return "(strftime('%Y-%m-%d %H:%M:%f000', 'now'))"
+
+
+class json_array_contains(FunctionElement):  # noqa: N801
+    """Whether a JSON array column contains a value, e.g. `json_array_contains(Apartment.free_area_type, "Balkon")`.
+
+    On PostgreSQL this is the containment operator of JSONB, which is answered from a GIN index on the column.
+    """
+    type = Boolean()  # noqa: A003
+    name = "json_array_contains"
+    inherit_cache = True
+
+
+@compiles(json_array_contains)
+def _json_array_contains(element: json_array_contains, compiler: "SQLCompiler", **kw: "Any") -> str:  # noqa: ANN401
+    """Render json_array_contains with the JSON1 functions of SQLite."""
+    column, value = (compiler.process(clause, **kw) for clause in element.clauses)
+    return f"EXISTS (SELECT 1 FROM json_each({column}) WHERE json_each.value = {value})"  # noqa: S608
+
+
+@compiles(json_array_contains, "postgresql")
+def _pg_json_array_contains(element: json_array_contains, compiler: "SQLCompiler", **kw: "Any") -> str:  # noqa: ANN401
+    """Render json_array_contains with the containment operator of JSONB."""
+    column, value = (compiler.process(clause, **kw) for clause in element.clauses)
+    return f"{column} @> jsonb_build_array(CAST({value} AS TEXT))"
 
 class Apartment(SQLModel, table=True):
     """The main model to store apartments in the database."""
     __tablename__ = "apartments"
+    __table_args__ = (
+        # The best deals are read by scanning this index backwards, see `Model.get_top_apartment_rows`.
+        Index("ix_apartments_deal_score_id", "deal_score", "id"),
+        # Answers `json_array_contains` on PostgreSQL. A plain index on other databases.
+        Index("ix_apartments_free_area_type", "free_area_type", postgresql_using="gin"),
+    )
     id: int | None = Field(default=None, primary_key=True)  # noqa: A003
-    apartment_id: int
+    apartment_id: int = Field(index=True, sa_column_kwargs={"unique": True})
     status: bool
     product_id: str
     property_type: str
@@ -32,14 +141,229 @@ class Apartment(SQLModel, table=True):
     coordinates: str | None
     price: float
     price_per_area: float | None
-    free_area_type: str | None
+    # The types of the free areas, e.g. ["Balkon", "Terrasse"]. JSONB on PostgreSQL.
+    free_area_type: list[str] | None = Field(
+        default=None, sa_column=Column(JSON().with_variant(postgresql.JSONB(), "postgresql"))
+    )
     free_area: int | None
-    image_urls: str | None
     advertiser: str
     prio: int = 0
+    # The category url the apartment was last crawled from, to find the apartments that are gone after a crawl.
+    scope: str | None = Field(default=None, index=True)
+    # When a complete crawl of the scope no longer found the apartment, see `Model.mark_gone_apartments`. None while
+    # it is listed. Gone apartments are kept, but left out of lists, queries, maps and statistics.
+    gone: datetime | None = Field(default=None, sa_column=Column(DateTime(timezone=True), index=True))
+    # The smallest id of the listings of the same apartment, see `duplicates.assign_clusters`. None without duplicates.
+    cluster_id: int | None = Field(default=None, index=True)
+    # The code of the district the coordinates are in, see `districts.assign_districts`.
+    district: int | None = Field(default=None, index=True)
+    # The normalized address, post code and location, see `search_text`.
+    search_text: str | None = None
+    # How good a deal the apartment is, from 0 to 100, see `scoring.score_deals`. None without a price per m².
+    deal_score: float | None = None
     updated: datetime | None = Field(
-        default=datetime.now(tz=ZoneInfo("UTC"))
+        default_factory=lambda: datetime.now(tz=ZoneInfo("UTC"))
+    )
+    # Set by the database on every insert and update, used as the cursor of the change feed.
+    modified: datetime | None = Field(
+        default=None,
+        sa_column=Column(
+            DateTime(timezone=True),
+            nullable=False,
+            index=True,
+            server_default=func.now(),
+            # Also set by SQLAlchemy, for tables upgraded on SQLite, which can't add the column with its server default.
+            default=func.now(),
+            onupdate=func.now(),
+        ),
+    )
+    # Set by the database whenever a derived column, like the cluster or the deal score, is written, which leaves
+    # `modified` as it is, see `Model._update_derived_column`. Lets copies of the table pick up the derived data.
+    derived_modified: datetime | None = Field(default=None, sa_column=Column(DateTime(timezone=True), index=True))
+    # Kept in their own table, `ApartmentImage`, as they are by far the largest part of an apartment.
+    _image_urls: list[str] | None = PrivateAttr(default=None)
+
+    def __init__(self: Self, image_urls: list[str] | None = None, **data: Any) -> None:  # noqa: ANN401
+        """Create an apartment, with the URLs of its images if it was crawled."""
+        super().__init__(**data)
+        self._image_urls = image_urls
+
+    @property
+    def image_urls(self: Self) -> list[str] | None:
+        """The image URLs given when the apartment was created, which are stored when adding or upserting it.
+
+        None for apartments loaded from the database, see `Model.get_image_urls`, and for apartments created without
+        them, whose stored images are kept.
+        """
+        return getattr(self, "_image_urls", None)
+
+
+class ApartmentImage(SQLModel, table=True):
+    """An image of an apartment, in the order of the advert."""
+    __tablename__ = "apartment_images"
+    apartment_id: int = Field(
+        sa_column=Column(ForeignKey("apartments.apartment_id", ondelete="CASCADE"), primary_key=True)
+    )
+    position: int = Field(primary_key=True)
+    url: str
+
+
+class ApartmentTombstone(SQLModel, table=True):
+    """Marks an apartment that has been deleted, so the change feed can report it."""
+    __tablename__ = "apartment_tombstones"
+    apartment_id: int = Field(primary_key=True)
+    deleted: datetime | None = Field(
+        default=None,
+        sa_column=Column(
+            DateTime(timezone=True),
+            nullable=False,
+            index=True,
+            server_default=func.now(),
+        ),
+    )
+
+class DerivedDataVersion(SQLModel, table=True):
+    """When a column derived from the crawled data, like `Apartment.district`, was last written.
+
+    Writing derived columns leaves `Apartment.modified` as it is, so the rendered maps watch this instead, see
+    `Model.get_derived_data_version`.
+    """
+    __tablename__ = "derived_data_versions"
+    name: str = Field(primary_key=True)
+    updated: datetime = Field(sa_column=Column(DateTime(timezone=True), nullable=False))
+
+
+class MarketStats(SQLModel, table=True):
+    """Precomputed market statistics per post code and property type.
+
+    The table is refreshed after each crawl with `Model.refresh_market_stats`, so reading it does not depend on the
+    size of the apartments table.
+    """
+    __tablename__ = "market_stats"
+    post_code: int = Field(primary_key=True)
+    property_type: str = Field(primary_key=True)
+    listing_count: int
+    average_area: float
+    price_per_area_p10: float | None
+    price_per_area_p25: float | None
+    price_per_area_median: float | None
+    price_per_area_p75: float | None
+    price_per_area_p90: float | None
+    refreshed: datetime
+
+
+class SavedSearch(SQLModel, table=True):
+    """Criteria of a user that new apartments are matched against.
+
+    All criteria are optional, a missing criterion matches every apartment. `post_codes` is a JSON encoded list.
+    """
+    __tablename__ = "saved_searches"
+    id: int | None = Field(default=None, primary_key=True)  # noqa: A003
+    name: str
+    post_codes: str | None = None
+    min_rooms: float | None = None
+    max_rooms: float | None = None
+    min_area: int | None = None
+    max_area: int | None = None
+    min_price: float | None = None
+    max_price: float | None = None
+    min_price_per_area: float | None = None
+    max_price_per_area: float | None = None
+    min_free_area: int | None = None
+    created: datetime | None = Field(
+        default_factory=lambda: datetime.now(tz=ZoneInfo("UTC"))
+    )
+
+
+class SearchNotification(SQLModel, table=True):
+    """An apartment that matched a saved search when it was ingested."""
+    __tablename__ = "search_notifications"
+    __table_args__ = (UniqueConstraint("search_id", "apartment_id"),)
+    id: int | None = Field(default=None, primary_key=True)  # noqa: A003
+    search_id: int = Field(foreign_key="saved_searches.id", index=True)
+    apartment_id: int
+    created: datetime | None = Field(
+        default=None,
+        sa_column=Column(
+            DateTime(timezone=True),
+            nullable=False,
+            server_default=func.now(),
+        ),
+    )
+
+
+class CrawlRun(SQLModel, table=True):
+    """Ledger entry of a crawl of one category of an area, with the statistics of the run.
+
+    `error` is set if the crawl failed before any page was fetched, or if tasks of an enqueued crawl failed. `gone` is
+    only counted for complete runs, see `Model.mark_gone_apartments`. The run of an enqueued crawl is added with its
+    tasks and finished by `Model.close_crawl_run`.
+    """
+    __tablename__ = "crawl_runs"
+    id: int | None = Field(default=None, primary_key=True)  # noqa: A003
+    source: str
+    area: str
+    url: str = Field(index=True)
+    started: datetime = Field(index=True)
+    finished: datetime | None = None
+    rows_found: int = 0
+    pages_requested: int = 0
+    pages_failed: int = 0
+    parsed: int = 0
+    inserted: int = 0
+    updated: int = 0
+    gone: int = 0
+    duplicates: int = 0  # copies of a listing on several pages of the crawl
+    skipped: int = 0  # listings skipped as an earlier crawl of the run or another job had just fetched them
+    bytes_transferred: int = 0
+    p95_page_latency_ms: float | None = None
+    error: str | None = None
+
+
+class CrawlTaskStatus(StrEnum):
+    """Status of a task in the crawl work queue."""
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+
+class CrawlTask(SQLModel, table=True):
+    """A range of pages of a category url in the crawl work queue.
+
+    A worker claims a task by setting the lease, and keeps extending the lease while it is working on it. A running
+    task with an expired lease belongs to a dead worker and can be claimed again. `available` delays the retry of a
+    failed task.
+    """
+    __tablename__ = "crawl_tasks"
+    id: int | None = Field(default=None, primary_key=True)  # noqa: A003
+    # The ledger entry shared by the tasks of a url that were enqueued together, see `Model.close_crawl_run`.
+    run_id: int | None = Field(default=None, foreign_key="crawl_runs.id", index=True)
+    source: str
+    area: str
+    url: str = Field(index=True)
+    first_page: int
+    last_page: int
+    rows_per_page: int = 200
+    priority: int = 0
+    status: str = Field(default=CrawlTaskStatus.PENDING, index=True)
+    attempts: int = 0
+    lease_owner: str | None = None
+    lease_expires: datetime | None = Field(default=None, sa_column=Column(DateTime(timezone=True), index=True))
+    available: datetime = Field(
+        default_factory=lambda: datetime.now(tz=ZoneInfo("UTC")), sa_column=Column(DateTime(timezone=True))
+    )
+    created: datetime = Field(
+        default_factory=lambda: datetime.now(tz=ZoneInfo("UTC")), sa_column=Column(DateTime(timezone=True))
     )
+    finished: datetime | None = Field(default=None, sa_column=Column(DateTime(timezone=True)))
+    parsed: int = 0
+    inserted: int = 0
+    updated: int = 0
+    # The apartment_ids the task fetched, to find the apartments that are gone once all tasks of the run are done.
+    apartment_ids: list[int] | None = Field(default=None, sa_column=Column(JSON))
+    error: str | None = None
+
 
 class TransactionResult(NamedTuple):
     """Named tuple to group the results of a transaction."""
@@ -48,22 +372,149 @@ class TransactionResult(NamedTuple):
     total_count: int
 
 
+class RowsResult(NamedTuple):
+    """Named tuple to group the results of a transaction returning plain rows instead of Apartment objects."""
+    columns: list[str]
+    rows: list[tuple[Any, ...]]
+    element_count: int
+    total_count: int
+
+
+class MapRow(NamedTuple):
+    """The columns of an apartment that are shown on a map."""
+    apartment_id: int
+    url: str
+    coordinates: str
+    price: float
+    area: int
+    rooms: float
+    price_per_area: float | None
+    free_area: int | None
+
+
+class MapFilter(NamedTuple):
+    """Criteria of the apartments shown on a map. A criterion that is None matches every apartment.
+
+    Apartments without a price are always left out, and so are projects unless `include_projects` is set. With
+    `one_per_cluster`, only the first listing of each cluster of duplicates is shown.
+    """
+    min_post_code: int | None = None
+    max_post_code: int | None = None
+    min_rooms: float | None = None
+    max_price: float | None = None
+    include_projects: bool = False
+    one_per_cluster: bool = True
+
+
+class ApartmentQuery(NamedTuple):
+    """Criteria and order of a query of apartments. A criterion that is None matches every apartment.
+
+    Apartments are sorted by `sort_by`, one of `SORT_COLUMNS`, with missing values last and ties in the order of their
+    id. With `one_per_cluster`, only the first listing of each cluster of duplicates is returned. `free_area_type`
+    matches the apartments with a free area of that type, e.g. "Balkon".
+    """
+    min_price: float | None = None
+    max_price: float | None = None
+    min_area: int | None = None
+    max_area: int | None = None
+    min_rooms: float | None = None
+    max_rooms: float | None = None
+    max_price_per_area: float | None = None
+    post_code: int | None = None
+    district: int | None = None
+    property_type: str | None = None
+    free_area_type: str | None = None
+    one_per_cluster: bool = False
+    sort_by: str = "id"
+    descending: bool = False
+
+
+# Columns an ApartmentQuery can be sorted by.
+SORT_COLUMNS = ("id", "price", "price_per_area", "area", "rooms", "floor", "free_area", "prio", "deal_score")
+POOL_SIZE = 5  # connections the pool keeps open on PostgreSQL, the default of SQLAlchemy
+MAX_OVERFLOW = 10  # connections the pool opens beyond POOL_SIZE under load, the default of SQLAlchemy
+# Share of the rows reported by the API that a crawl must have parsed to count as complete. Listings come and go while
+# the pages are fetched, so a complete crawl doesn't always see exactly the reported number.
+COMPLETE_FRACTION = 0.95
+
+
+class ApartmentChanges(NamedTuple):
+    """The apartments changed since a time, see `Model.get_changed_apartment_rows`."""
+    rows: list[tuple[Any, ...]]  # the rows of the inserted and updated apartments
+    deleted: list[tuple[int, datetime]]  # the apartment_id and the time of deletion of the deleted apartments
+    until: datetime  # all changes before this time are committed, the `since` of the next read
+
+
+class UpsertResult(NamedTuple):
+    """Named tuple to group the results of an upsert."""
+    inserted_ids: list[int]
+    updated_count: int
+
+
+class ChangeCursor(NamedTuple):
+    """Position in the change feed.
+
+    Changes are ordered by their timestamp, then upserts before deletions, then by id. The cursor is passed to clients
+    as an opaque string.
+    """
+    timestamp: datetime
+    deleted: bool
+    key: int
+
+    def encode(self: Self) -> str:
+        """Encode the cursor as an url safe string."""
+        raw = f"{self.timestamp.isoformat()}|{int(self.deleted)}|{self.key}"
+        return base64.urlsafe_b64encode(raw.encode()).decode()
+
+    @classmethod
+    def decode(cls: type[Self], cursor: str) -> Self:
+        """Decode a cursor created by `encode`.
+
+        Raises:
+            ValueError: If the cursor is not valid.
+        """
+        try:
+            timestamp, deleted, key = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+            return cls(datetime.fromisoformat(timestamp), deleted == "1", int(key))
+        except (ValueError, UnicodeDecodeError) as e:
+            msg = f"Invalid cursor {cursor!r}"
+            raise ValueError(msg) from e
+
+
+class Change(NamedTuple):
+    """A single entry of the change feed. `apartment` is None for deleted apartments."""
+    apartment_id: int
+    deleted: bool
+    cursor: ChangeCursor
+    apartment: Apartment | None
+
+
 class Model:
     """A class to manage the database."""
-    def __init__(self: Self) -> None:
+    def __init__(self: Self, url: str | URL | None = None) -> None:
         """Initialize the database.
 
-        Creates an engine and the database if it does not exist.
+        Creates an engine and the database if it does not exist. Without an explicit url, the environment variable
+        DATABASE_URL is used if set, otherwise the PostgreSQL url is built from USERNAME, PASSWORD, HOST and DATABASE.
+
+        Args:
+            url (str | URL | None, optional): A SQLAlchemy database url. Defaults to None.
         """
-        url_object = URL.create(
-            "postgresql",
-            username=from_env("USERNAME"),
-            password=from_env("PASSWORD"),
-            host=from_env("HOST"),
-            database=from_env("DATABASE"),
-        )
-        self.engine = create_engine(url_object)
+        if url is None:
+            url = os.environ.get("DATABASE_URL") or URL.create(
+                "postgresql",
+                username=from_env("USERNAME"),
+                password=from_env("PASSWORD"),
+                host=from_env("HOST"),
+                database=from_env("DATABASE"),
+            )
+        pool_options = {"pool_size": POOL_SIZE, "max_overflow": MAX_OVERFLOW}
+        self.engine = create_engine(url, **pool_options if make_url(url).get_backend_name() == "postgresql" else {})
+        metrics.track_pool(self.engine, max_overflow=MAX_OVERFLOW)
+        with self.engine.begin() as connection:
+            _upgrade_schema(connection)
         SQLModel.metadata.create_all(self.engine)
+        self._trigram_search: bool | None = None  # whether pg_trgm is installed, looked up on the first search
 
     def get_engine(self: Self) -> "Engine":
         """Get the engine.
@@ -81,9 +532,15 @@ class Model:
         Args:
             apartment (Apartment): An apartment object.
         """
+        apartment.search_text = search_text(apartment.address, apartment.post_code, apartment.location)
         with Session(self.engine) as session:
             session.add(apartment)
-            session.commit()
+            session.flush()
+            image_count = self._replace_changed_images(session, [apartment])
+            with metrics.DB_COMMIT_DURATION.labels(operation="add_apartment").time():
+                session.commit()
+        metrics.DB_ROWS_WRITTEN.labels(table="apartments", operation="insert").inc()
+        metrics.DB_ROWS_WRITTEN.labels(table="apartment_images", operation="insert").inc(image_count)
 
     def add_apartments(self: Self, apartments: list[Apartment]) -> None:
         """Add several apartments to the database.
@@ -91,34 +548,435 @@ class Model:
         Args:
             apartments (list[Apartment]): A list of Apartment objects
         """
+        for apartment in apartments:
+            apartment.search_text = search_text(apartment.address, apartment.post_code, apartment.location)
         with Session(self.engine) as session:
             session.add_all(apartments)
-            session.commit()
+            session.flush()
+            image_count = self._replace_changed_images(session, apartments)
+            with metrics.DB_COMMIT_DURATION.labels(operation="add_apartments").time():
+                session.commit()
+        metrics.DB_ROWS_WRITTEN.labels(table="apartments", operation="insert").inc(len(apartments))
+        metrics.DB_ROWS_WRITTEN.labels(table="apartment_images", operation="insert").inc(image_count)
 
-    def get_map_data(self: Self) -> list[Apartment]:
-        """Export all apartments to a mapping function.
+    def upsert_apartments(self: Self, apartments: list[Apartment], chunk_size: int = 2_000) -> UpsertResult:
+        """Insert new apartments and update the ones that already exist, identified by their apartment_id.
 
-        Several filters are applied to the data to make it more useful.
+        Existing apartments are only updated if any of their crawled fields changed, so `modified` and thereby the
+        change feed reflect actual changes and not every crawl. The priority is never overwritten. The scope is
+        updated, but as it flips between overlapping crawls, a new scope alone is not a change. If an apartment is
+        given more than once, the last one wins. The search text is set from the address, post code and location.
+        The images are only replaced for the apartments whose image URLs changed, which does not count as an update.
+
+        Args:
+            apartments (list[Apartment]): A list of Apartment objects.
+            chunk_size (int, optional): Number of apartments per INSERT statement. Defaults to 2_000.
 
         Returns:
-            list[Apartment]: A list of Apartment objects.
+            UpsertResult: The apartment_ids of the inserted apartments and the number of updated apartments.
         """
-        stmt = select(Apartment).filter(
-            Apartment.post_code >= 1000,  # noqa: PLR2004
-            Apartment.post_code < 2000,  # noqa: PLR2004
-            Apartment.rooms >= 3,  # noqa: PLR2004
-            Apartment.price <= 400_000,  # noqa: PLR2004
-            Apartment.price > 0,
-            Apartment.product_id != "project",
+        for apartment in apartments:
+            apartment.search_text = search_text(apartment.address, apartment.post_code, apartment.location)
+        rows = {
+            apartment.apartment_id: apartment.dict(exclude={"id", "modified", "derived_modified"})
+            for apartment in apartments
+        }
+        if not rows:
+            return UpsertResult([], 0)
+
+        insert = postgresql.insert if self.engine.dialect.name == "postgresql" else sqlite.insert
+        columns = Apartment.__table__.c  # type: ignore[attr-defined]
+        kept_fields = ("apartment_id", "prio", "updated", "cluster_id", "district", "deal_score")
+        crawled_fields = [name for name in next(iter(rows.values())) if name not in kept_fields]
+        changed_fields = [name for name in crawled_fields if name != "scope"]
+        chunks = [list(rows.values())[i : i + chunk_size] for i in range(0, len(rows), chunk_size)]
+        existing_stmt = select(Apartment.apartment_id).where(Apartment.apartment_id.in_(list(rows)))
+
+        changed_count = 0
+        with tracing.span("upsert_apartments", rows=len(rows)) as upsert_span, Session(self.engine) as session:
+            existing = set(session.scalars(existing_stmt))
+            for chunk in chunks:
+                stmt = insert(Apartment).values(chunk)
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[columns.apartment_id],
+                    set_={
+                        **{name: stmt.excluded[name] for name in crawled_fields},
+                        "updated": stmt.excluded.updated,
+                        "modified": func.now(),
+                    },
+                    where=or_(*(columns[name].is_distinct_from(stmt.excluded[name]) for name in changed_fields)),
+                )
+                result: "CursorResult" = session.execute(stmt)
+                changed_count += result.rowcount
+            self._update_scopes(session, rows)
+            image_count = self._replace_changed_images(session, apartments)
+
+            inserted_ids = [apartment_id for apartment_id in rows if apartment_id not in existing]
+            if self.engine.dialect.name == "postgresql":
+                # Delivered to the listeners of the live feed when the transaction commits.
+                for payload in live.notify_payloads(inserted_ids):
+                    session.execute(select(func.pg_notify(live.CHANNEL, payload)))
+            with tracing.span("commit"), metrics.DB_COMMIT_DURATION.labels(operation="upsert_apartments").time():
+                session.commit()
+            upsert_span.set_attribute("inserted", len(inserted_ids))
+            upsert_span.set_attribute("updated", changed_count - len(inserted_ids))
+
+        metrics.DB_ROWS_WRITTEN.labels(table="apartments", operation="insert").inc(len(inserted_ids))
+        metrics.DB_ROWS_WRITTEN.labels(table="apartments", operation="update").inc(changed_count - len(inserted_ids))
+        metrics.DB_ROWS_WRITTEN.labels(table="apartment_images", operation="insert").inc(image_count)
+
+        logger.info(f"Upserted apartments: {len(inserted_ids)} inserted, {changed_count - len(inserted_ids)} updated")
+        return UpsertResult(inserted_ids, changed_count - len(inserted_ids))
+
+    def _replace_changed_images(self: Self, session: Session, apartments: list[Apartment]) -> int:
+        """Replace the stored images of the apartments whose image URLs differ from the stored ones.
+
+        The images are inserted as plain rows, without building `ApartmentImage` objects. Apartments without image URLs,
+        see `Apartment.image_urls`, keep their stored images.
+
+        Args:
+            session (Session): The session of the write, which is committed by the caller.
+            apartments (list[Apartment]): The written apartments, the last one wins for an apartment given twice.
+
+        Returns:
+            int: The number of inserted images.
+        """
+        urls = {
+            apartment.apartment_id: apartment.image_urls for apartment in apartments if apartment.image_urls is not None
+        }
+        if not urls:
+            return 0
+        stored_stmt = (
+            select(ApartmentImage.apartment_id, ApartmentImage.url)
+            .where(ApartmentImage.apartment_id.in_(list(urls)))
+            .order_by(ApartmentImage.apartment_id, ApartmentImage.position)
         )
+        stored: defaultdict[int, list[str]] = defaultdict(list)
+        for apartment_id, url in session.execute(stored_stmt):
+            stored[apartment_id].append(url)
+        changed = [apartment_id for apartment_id, new_urls in urls.items() if new_urls != stored[apartment_id]]
+        if not changed:
+            return 0
+
+        session.execute(delete(ApartmentImage).where(ApartmentImage.apartment_id.in_(changed)))
+        images = [
+            {"apartment_id": apartment_id, "position": position, "url": url}
+            for apartment_id in changed
+            for position, url in enumerate(urls[apartment_id])
+        ]
+        if images:
+            session.execute(ApartmentImage.__table__.insert(), images)  # type: ignore[attr-defined]
+        return len(images)
+
+    @staticmethod
+    def _update_scopes(session: Session, rows: dict[int, dict[str, Any]]) -> None:
+        """Set the scope of the upserted apartments that were otherwise unchanged, leaving `modified` as it is.
+
+        Args:
+            session (Session): The session of the upsert.
+            rows (dict[int, dict[str, Any]]): The upserted rows per apartment_id.
+        """
+        scopes: defaultdict[str | None, list[int]] = defaultdict(list)
+        for apartment_id, row in rows.items():
+            scopes[row["scope"]].append(apartment_id)
+        for scope, apartment_ids in scopes.items():
+            session.execute(
+                update(Apartment)
+                .where(Apartment.apartment_id.in_(apartment_ids), Apartment.scope.is_distinct_from(scope))
+                .values(scope=scope, modified=Apartment.modified)
+                .execution_options(synchronize_session=False)
+            )
+
+    def delete_apartments(self: Self, apartment_ids: list[int]) -> int:
+        """Delete apartments and leave a tombstone for each of them in the change feed.
+
+        Args:
+            apartment_ids (list[int]): The ids of the apartments to delete.
+
+        Returns:
+            int: The number of deleted apartments.
+        """
+        if not apartment_ids:
+            return 0
+
+        insert = postgresql.insert if self.engine.dialect.name == "postgresql" else sqlite.insert
+        existing_stmt = select(Apartment.apartment_id).where(Apartment.apartment_id.in_(apartment_ids))
+
         with Session(self.engine) as session:
-            return list(session.scalars(stmt))
+            existing = list(session.scalars(existing_stmt))
+            if existing:
+                session.execute(delete(ApartmentImage).where(ApartmentImage.apartment_id.in_(existing)))
+                session.execute(delete(Apartment).where(Apartment.apartment_id.in_(existing)))
+                tombstone_stmt = insert(ApartmentTombstone).values([{"apartment_id": id_} for id_ in existing])
+                session.execute(
+                    tombstone_stmt.on_conflict_do_update(
+                        index_elements=[ApartmentTombstone.apartment_id], set_={"deleted": func.now()}
+                    )
+                )
+            with metrics.DB_COMMIT_DURATION.labels(operation="delete_apartments").time():
+                session.commit()
+        metrics.DB_ROWS_WRITTEN.labels(table="apartments", operation="delete").inc(len(existing))
+        return len(existing)
+
+    def mark_gone_apartments(self: Self, scope: str, seen_ids: set[int]) -> int:
+        """Mark the apartments of a scope that a complete crawl of it didn't see as gone, as they are no longer listed.
+
+        They get `status` False and the time in `gone`, which counts as a change in the change feed. They are kept, so
+        their history stays available, until `delete_gone_apartments` removes them. An apartment that is listed again
+        is no longer gone after its next upsert.
+
+        Args:
+            scope (str): The category url that was crawled.
+            seen_ids (set[int]): The apartment_ids returned by the crawl.
+
+        Returns:
+            int: The number of apartments marked as gone.
+        """
+        with Session(self.engine) as session:
+            gone = self._mark_gone(session, scope, seen_ids)
+            with metrics.DB_COMMIT_DURATION.labels(operation="mark_gone_apartments").time():
+                session.commit()
+        metrics.DB_ROWS_WRITTEN.labels(table="apartments", operation="update").inc(gone)
+        return gone
+
+    def _mark_gone(self: Self, session: Session, scope: str, seen_ids: set[int]) -> int:
+        """Mark the listed apartments of a scope that aren't in `seen_ids` as gone, in the session's transaction."""
+        stmt = select(Apartment.apartment_id).where(Apartment.scope == scope, Apartment.gone.is_(None))
+        gone = sorted(set(session.scalars(stmt)) - seen_ids)
+        if gone:
+            session.execute(
+                update(Apartment)
+                .where(Apartment.apartment_id.in_(gone))
+                .values(status=False, gone=datetime.now(tz=ZoneInfo("UTC")))
+                .execution_options(synchronize_session=False)
+            )
+        return len(gone)
+
+    def delete_gone_apartments(self: Self, before: datetime) -> int:
+        """Delete the apartments that are gone since before a time, the retention of gone apartments.
+
+        Args:
+            before (datetime): Delete the apartments that were marked as gone before this time.
+
+        Returns:
+            int: The number of deleted apartments.
+        """
+        stmt = select(Apartment.apartment_id).where(Apartment.gone < before)
+        with self.engine.connect() as connection:
+            gone = list(connection.execute(stmt).scalars())
+        return self.delete_apartments(gone)
+
+    def update_cluster_ids(self: Self, cluster_ids: dict[int, int | None]) -> None:
+        """Set the duplicate cluster of apartments.
+
+        Args:
+            cluster_ids (dict[int, int | None]): The cluster per id of an apartment, None to remove it from its cluster.
+        """
+        self._update_derived_column("cluster_id", cluster_ids, operation="update_cluster_ids")
+
+    def update_districts(self: Self, districts: dict[int, int | None]) -> None:
+        """Set the district of apartments.
+
+        Args:
+            districts (dict[int, int | None]): The district code per id of an apartment, None for no district.
+        """
+        self._update_derived_column("district", districts, operation="update_districts")
+
+    def update_deal_scores(self: Self, scores: dict[int, float | None]) -> None:
+        """Set the deal score of apartments.
+
+        Args:
+            scores (dict[int, float | None]): The deal score per id of an apartment, None for no score.
+        """
+        self._update_derived_column("deal_score", scores, operation="update_deal_scores")
+
+    def _update_derived_column(self: Self, column: str, values: dict[int, Any], operation: str) -> None:
+        """Set a column that is derived from the crawled data, like the cluster or the district, of apartments.
+
+        `modified` is left as it is, so derived data doesn't show up as changed apartments in the change feed. Instead,
+        `derived_modified` of the apartments and the version of the derived column are updated in the same transaction,
+        see `get_changed_apartment_rows` and `get_derived_data_version`.
+
+        Args:
+            column (str): The name of the Apartment column.
+            values (dict[int, Any]): The value per id of an apartment.
+            operation (str): The name of the operation in the metrics.
+        """
+        if not values:
+            return
+        stmt = (
+            update(Apartment)
+            .where(Apartment.id == bindparam("_id"))
+            .values({column: bindparam("_value"), "modified": Apartment.modified, "derived_modified": func.now()})
+            .execution_options(synchronize_session=False)
+        )
+        insert = postgresql.insert if self.engine.dialect.name == "postgresql" else sqlite.insert
+        version_stmt = insert(DerivedDataVersion).values(name=column, updated=datetime.now(tz=ZoneInfo("UTC")))
+        version_stmt = version_stmt.on_conflict_do_update(
+            index_elements=[DerivedDataVersion.name], set_={"updated": version_stmt.excluded.updated}
+        )
+        with Session(self.engine) as session:
+            session.execute(stmt, [{"_id": id_, "_value": value} for id_, value in values.items()])
+            session.execute(version_stmt)
+            with metrics.DB_COMMIT_DURATION.labels(operation=operation).time():
+                session.commit()
+        metrics.DB_ROWS_WRITTEN.labels(table="apartments", operation="update").inc(len(values))
+
+    def create_search_index(self: Self) -> bool:
+        """Install `pg_trgm` and create the trigram index of the fuzzy search, see `search_apartment_rows`.
+
+        Run once per database, e.g. by the `search-index` command, as creating an extension needs more privileges than
+        the crawler and the API usually have. Without the extension, the search falls back to matching substrings.
+
+        Returns:
+            bool: Whether the typo tolerant search is available, always False on other databases than PostgreSQL.
+        """
+        if self.engine.dialect.name != "postgresql":
+            return False
+        try:
+            with self.engine.begin() as connection:
+                connection.execute(DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+                connection.execute(_SEARCH_TEXT_INDEX)
+        except DBAPIError as e:
+            logger.warning(f"Could not install pg_trgm, the search won't tolerate typos: {e}")
+            self._trigram_search = False
+        else:
+            self._trigram_search = True
+        return self._trigram_search
+
+    def _has_trigram_search(self: Self, connection: "Connection") -> bool:
+        """Check once whether `pg_trgm` is installed in the PostgreSQL database."""
+        if self._trigram_search is None:
+            stmt = select(_PG_EXTENSION.c.extname).where(_PG_EXTENSION.c.extname == "pg_trgm")
+            self._trigram_search = connection.execute(stmt).first() is not None
+            if not self._trigram_search:
+                logger.warning("pg_trgm is not installed, run the search-index command for a typo tolerant search")
+        return self._trigram_search
+
+    def fill_search_texts(self: Self) -> int:
+        """Set the search text of the apartments that were stored before it was introduced.
+
+        Returns:
+            int: The number of apartments that got a search text.
+        """
+        stmt = select(Apartment.id, Apartment.address, Apartment.post_code, Apartment.location).where(
+            Apartment.search_text.is_(None)
+        )
+        with self.engine.connect() as connection:
+            texts = {
+                id_: search_text(address, post_code, location)
+                for id_, address, post_code, location in connection.execute(stmt)
+            }
+        if not texts:
+            return 0
+        self._update_derived_column("search_text", texts, operation="fill_search_texts")
+        logger.info(f"Filled the search text of {len(texts)} apartments")
+        return len(texts)
+
+    def get_changes(self: Self, since: ChangeCursor | None, limit: int) -> list[Change]:
+        """Get the apartments that were inserted, updated or deleted after a position in the change feed.
+
+        Both the apartments and the tombstones are read through their index on the modification timestamp, and the two
+        are merged into one ordered feed.
+
+        The timestamp is the start of the writing transaction, not its commit, so a transaction that started earlier
+        can commit rows behind a cursor that was already handed out. On PostgreSQL, only changes from before the start
+        of the oldest transaction that is still writing are returned, see `_settled_until`, so the cursor never passes
+        rows that are yet to be committed.
+
+        Args:
+            since (ChangeCursor | None): The cursor of the last change the client has seen, or None to start over.
+            limit (int): The max number of changes to return.
+
+        Returns:
+            list[Change]: The changes in the order they happened.
+        """
+        modified = Apartment.modified  # type: ignore[attr-defined]
+        deleted = ApartmentTombstone.deleted  # type: ignore[attr-defined]
+        apartments_stmt = select(Apartment).order_by(modified, Apartment.id).limit(limit)
+        tombstones_stmt = select(ApartmentTombstone).order_by(deleted, ApartmentTombstone.apartment_id).limit(limit)
+        if since is not None and since.deleted:
+            apartments_stmt = apartments_stmt.where(modified > since.timestamp)
+            tombstones_stmt = tombstones_stmt.where(
+                tuple_(deleted, ApartmentTombstone.apartment_id) > tuple_(since.timestamp, since.key)
+            )
+        elif since is not None:
+            apartments_stmt = apartments_stmt.where(
+                tuple_(modified, Apartment.id) > tuple_(since.timestamp, since.key)
+            )
+            tombstones_stmt = tombstones_stmt.where(deleted >= since.timestamp)
+
+        with Session(self.engine) as session:
+            if (settled := self._settled_until(session)) is not None:
+                apartments_stmt = apartments_stmt.where(modified < settled)
+                tombstones_stmt = tombstones_stmt.where(deleted < settled)
+            changes = [
+                Change(a.apartment_id, False, ChangeCursor(a.modified, False, a.id), a)
+                for a in session.scalars(apartments_stmt)
+            ] + [
+                Change(t.apartment_id, True, ChangeCursor(t.deleted, True, t.apartment_id), None)
+                for t in session.scalars(tombstones_stmt)
+            ]
+        return sorted(changes, key=lambda change: change.cursor)[:limit]
+
+    def _settled_until(self: Self, session: Session) -> datetime | None:
+        """Get the time before which all changes are committed, the start of the oldest transaction still writing.
+
+        Every transaction that has written anything has a transaction id, and its changes are stamped with its start,
+        so any change stamped earlier than the oldest of them is committed. The writers have to connect as the same role
+        as the reader, or the reader needs `pg_read_all_stats`, to see their transactions. None on other databases than
+        PostgreSQL, which have a single writer.
+        """
+        if self.engine.dialect.name != "postgresql":
+            return None
+        activity = _PG_STAT_ACTIVITY.c
+        stmt = select(func.coalesce(func.min(activity.xact_start), func.clock_timestamp())).where(
+            activity.datname == func.current_database(), activity.backend_xid.is_not(None)
+        )
+        return session.execute(stmt).scalar_one()
+
+    def iter_map_data(self: Self, map_filter: MapFilter | None = None, batch_size: int = 1_000) -> "Iterator[MapRow]":
+        """Stream the apartments to show on a map.
+
+        Only the columns of `MapRow` are selected and the rows are fetched from a server side cursor in batches, so
+        neither Apartment objects nor the whole result are held in memory. Apartments without coordinates are left out.
+
+        Args:
+            map_filter (MapFilter | None, optional): Criteria of the apartments. Defaults to all apartments.
+            batch_size (int, optional): Number of rows fetched at a time. Defaults to 1_000.
+
+        Yields:
+            MapRow: The apartments.
+        """
+        stmt = select(*(getattr(Apartment, column) for column in MapRow._fields)).where(
+            *_map_conditions(map_filter or MapFilter())
+        )
+        with self.engine.connect() as connection:
+            result = connection.execution_options(stream_results=True).execute(stmt).yield_per(batch_size)
+            for row in result:
+                yield MapRow(*row)
+
+    def get_map_points(self: Self, map_filter: MapFilter | None = None) -> list[tuple[int, str, float]]:
+        """Get the apartment_id, coordinates and price of all apartments that can be placed on a map.
+
+        Args:
+            map_filter (MapFilter | None, optional): Criteria of the apartments. Defaults to all apartments.
+
+        Returns:
+            list[tuple[int, str, float]]: The apartment_id, the "lat,lon" coordinates and the price of each apartment.
+        """
+        stmt = select(Apartment.apartment_id, Apartment.coordinates, Apartment.price).where(
+            *_map_conditions(map_filter or MapFilter())
+        )
+        with self.engine.connect() as connection:
+            return [tuple(row) for row in connection.execute(stmt)]
 
     def get_paged_apartments(self: Self, page: int, pagesize: int) -> TransactionResult:
         """Get a page of apartments.
 
         This is used to get a "page" of apartments from the database. This is used to paginate the database and to avoid
-        dumping the whole database in one query.
+        dumping the whole database in one query. The listed apartments are ordered by id and the page is skipped to
+        after filtering, so every page but the last is full.
 
         Args:
             self (Self): _description_
@@ -128,13 +986,233 @@ class Model:
         Returns:
             TransactionResult: _description_
         """
-        stmt = select(Apartment).where(Apartment.id > page * pagesize).limit(pagesize)
+        stmt = (
+            select(Apartment)
+            .where(Apartment.gone.is_(None))
+            .order_by(Apartment.id)
+            .offset(page * pagesize)
+            .limit(pagesize)
+        )
 
         with Session(self.engine) as session:
-            total_count = session.query(Apartment).count()
+            total_count = session.query(Apartment).filter(Apartment.gone.is_(None)).count()
             results: list[Apartment] = list(session.scalars(stmt))
         return TransactionResult(results, len(results), total_count or 0)
 
+    def get_paged_apartment_rows(
+        self: Self, page: int, pagesize: int, columns: list[str], one_per_cluster: bool = False
+    ) -> RowsResult:
+        """Get a page of apartments as plain rows.
+
+        Same page as `get_paged_apartments`, but only the requested columns are selected and the rows are returned as
+        tuples. No Apartment objects are built, which makes this the cheap path for endpoints that only serialize.
+
+        Args:
+            page (int): What page to return.
+            pagesize (int): The number of apartments per page.
+            columns (list[str]): Names of the Apartment columns to select.
+            one_per_cluster (bool, optional): Only return the first listing of each cluster of duplicates, see
+                `duplicates.assign_clusters`. Defaults to False.
+
+        Returns:
+            RowsResult: The column names, the rows and the counts of the query.
+        """
+        stmt = (
+            select(*(getattr(Apartment, column) for column in columns))
+            .where(Apartment.gone.is_(None))
+            .order_by(Apartment.id)
+            .offset(page * pagesize)
+            .limit(pagesize)
+        )
+        count_stmt = select(func.count()).select_from(Apartment).where(Apartment.gone.is_(None))
+        if one_per_cluster:
+            first_of_cluster = or_(Apartment.cluster_id.is_(None), Apartment.cluster_id == Apartment.id)
+            stmt = stmt.where(first_of_cluster)
+            count_stmt = count_stmt.where(first_of_cluster)
+
+        with self.engine.connect() as connection:
+            total_count = connection.execute(count_stmt).scalar_one()
+            rows = [tuple(row) for row in connection.execute(stmt)]
+        return RowsResult(columns, rows, len(rows), total_count or 0)
+
+    def get_apartment_rows(self: Self, apartment_ids: list[int], columns: list[str]) -> list[tuple[Any, ...]]:
+        """Get several apartments as plain rows.
+
+        Args:
+            apartment_ids (list[int]): The ids of the apartments.
+            columns (list[str]): Names of the Apartment columns to select.
+
+        Returns:
+            list[tuple[Any, ...]]: The rows of the apartments that exist.
+        """
+        stmt = select(*(getattr(Apartment, column) for column in columns)).where(
+            Apartment.apartment_id.in_(apartment_ids)
+        )
+
+        with self.engine.connect() as connection:
+            return [tuple(row) for row in connection.execute(stmt)]
+
+    def query_apartment_rows(
+        self: Self, query: ApartmentQuery, columns: list[str], limit: int, offset: int = 0
+    ) -> RowsResult:
+        """Get the apartments matching a query as plain rows, in the order of the query.
+
+        Args:
+            query (ApartmentQuery): The criteria and the order.
+            columns (list[str]): Names of the Apartment columns to select.
+            limit (int): The max number of apartments to return.
+            offset (int, optional): The number of matching apartments to skip. Defaults to 0.
+
+        Returns:
+            RowsResult: The column names, the rows and the counts of the query, the total count being the number of all
+                matching apartments.
+        """
+        conditions = _query_conditions(query)
+        sort_column = getattr(Apartment, query.sort_by)
+        order = (sort_column.desc() if query.descending else sort_column.asc()).nulls_last()
+        stmt = (
+            select(*(getattr(Apartment, column) for column in columns))
+            .where(*conditions)
+            .order_by(order, Apartment.id)
+            .offset(offset)
+            .limit(limit)
+        )
+        count_stmt = select(func.count()).select_from(Apartment).where(*conditions)
+
+        with self.engine.connect() as connection:
+            total_count = connection.execute(count_stmt).scalar_one()
+            rows = [tuple(row) for row in connection.execute(stmt)]
+        return RowsResult(columns, rows, len(rows), total_count or 0)
+
+    def get_image_urls(self: Self, apartment_ids: list[int]) -> dict[int, list[str]]:
+        """Get the image URLs of apartments, which are not part of the rows of apartments.
+
+        Args:
+            apartment_ids (list[int]): The ids of the apartments.
+
+        Returns:
+            dict[int, list[str]]: The image URLs per id of an apartment, in the order of the advert. Apartments without
+                images are left out.
+        """
+        stmt = (
+            select(ApartmentImage.apartment_id, ApartmentImage.url)
+            .where(ApartmentImage.apartment_id.in_(apartment_ids))
+            .order_by(ApartmentImage.apartment_id, ApartmentImage.position)
+        )
+        urls: defaultdict[int, list[str]] = defaultdict(list)
+        with self.engine.connect() as connection:
+            for apartment_id, url in connection.execute(stmt):
+                urls[apartment_id].append(url)
+        return dict(urls)
+
+    def get_top_apartment_rows(
+        self: Self, k: int, columns: list[str], one_per_cluster: bool = False
+    ) -> list[tuple[Any, ...]]:
+        """Get the apartments with the best deal score as plain rows, best first.
+
+        The order matches the index on the deal score and the id, so only the first `k` entries of the index are read,
+        from its end, instead of sorting all apartments.
+
+        Args:
+            k (int): The number of apartments to return.
+            columns (list[str]): Names of the Apartment columns to select.
+            one_per_cluster (bool, optional): Only return the first listing of each cluster of duplicates. Defaults to
+                False.
+
+        Returns:
+            list[tuple[Any, ...]]: The rows of the apartments, ties in the descending order of their id.
+        """
+        stmt = (
+            select(*(getattr(Apartment, column) for column in columns))
+            .where(Apartment.deal_score.is_not(None), Apartment.gone.is_(None))
+            .order_by(Apartment.deal_score.desc(), Apartment.id.desc())
+            .limit(k)
+        )
+        if one_per_cluster:
+            stmt = stmt.where(or_(Apartment.cluster_id.is_(None), Apartment.cluster_id == Apartment.id))
+
+        with self.engine.connect() as connection:
+            return [tuple(row) for row in connection.execute(stmt)]
+
+    def search_apartment_rows(  # noqa: PLR0913
+        self: Self,
+        search: str,
+        columns: list[str],
+        limit: int,
+        one_per_cluster: bool = False,
+        min_similarity: float = 0.5,
+    ) -> list[tuple[Any, ...]]:
+        """Search the apartments by address, post code and location, tolerating typos.
+
+        The search is normalized like the stored `search_text`, so umlauts, ß and the spelling of "Straße" don't matter.
+        On PostgreSQL with `pg_trgm`, see `create_search_index`, apartments match if the search is similar to a part of
+        their search text, by the trigrams looked up in the trigram index. They are ordered by that similarity.
+        Otherwise, every word of the search has to be contained in the search text, without typo tolerance, in the
+        order of their id.
+
+        Args:
+            search (str): The search, e.g. "Praterstrasse" or "leopoldstadt".
+            columns (list[str]): Names of the Apartment columns to select.
+            limit (int): The max number of apartments to return.
+            one_per_cluster (bool, optional): Only return the first listing of each cluster of duplicates. Defaults to
+                False.
+            min_similarity (float, optional): The word similarity from 0 to 1 an apartment needs to match, with
+                `pg_trgm`. Defaults to 0.5.
+
+        Returns:
+            list[tuple[Any, ...]]: The rows of the best matching apartments, best first.
+        """
+        normalized = text.normalize(search)
+        if not normalized:
+            return []
+        stmt = select(*(getattr(Apartment, column) for column in columns)).where(Apartment.gone.is_(None)).limit(limit)
+        if one_per_cluster:
+            stmt = stmt.where(or_(Apartment.cluster_id.is_(None), Apartment.cluster_id == Apartment.id))
+
+        with self.engine.connect() as connection:
+            if self.engine.dialect.name == "postgresql" and self._has_trigram_search(connection):
+                # The threshold of the %> operator, for this transaction only.
+                threshold = func.set_config("pg_trgm.word_similarity_threshold", str(min_similarity), True)
+                connection.execute(select(threshold))
+                stmt = stmt.where(Apartment.search_text.op("%>")(normalized)).order_by(
+                    func.word_similarity(normalized, Apartment.search_text).desc(), Apartment.id
+                )
+            else:
+                stmt = stmt.where(*(Apartment.search_text.contains(word) for word in normalized.split())).order_by(
+                    Apartment.id
+                )
+            return [tuple(row) for row in connection.execute(stmt)]
+
+    def get_changed_apartment_rows(self: Self, columns: list[str], since: datetime | None) -> ApartmentChanges:
+        """Get the apartments inserted, updated and deleted since a time, to keep a copy of the table up to date.
+
+        Apartments whose derived columns were written count as updated. All are read through their indexes on the
+        modification timestamps, see `snapshot.SnapshotStore`. The timestamps are the start of the writing transaction,
+        so a transaction that started earlier can still commit changes stamped before the latest one read. The returned
+        `until` is therefore the time before which all changes are committed, see `_settled_until`. Reading from there
+        the next time can return some changes twice, but never misses one.
+
+        Args:
+            columns (list[str]): Names of the Apartment columns to select.
+            since (datetime | None): Get the changes at or after this time, or None for all apartments.
+
+        Returns:
+            ApartmentChanges: The changed rows, the deleted apartments, none if `since` is None, and the time to read
+                the next changes from.
+        """
+        stmt = select(*(getattr(Apartment, column) for column in columns))
+        deleted_stmt = select(ApartmentTombstone.apartment_id, ApartmentTombstone.deleted)
+        with Session(self.engine) as session:
+            until = self._settled_until(session)
+            if until is None:
+                until = session.execute(select(now())).scalar_one()
+            if since is None:
+                return ApartmentChanges([tuple(row) for row in session.execute(stmt)], [], until)
+            stmt = stmt.where(or_(Apartment.modified >= since, Apartment.derived_modified >= since))
+            rows = [tuple(row) for row in session.execute(stmt)]
+            deleted = [tuple(row) for row in session.execute(deleted_stmt.where(ApartmentTombstone.deleted >= since))]
+        return ApartmentChanges(rows, deleted, until)
+
     def get_apartment_by_id(self: Self, apartment_id: int) -> Apartment | None:
         """Get details about a single apartment.
 
@@ -155,6 +1233,430 @@ class Model:
         with Session(self.engine) as session:
             return session.query(Apartment).count()
 
+    def get_dataset_version(self: Self) -> str:
+        """Get a version of the data shown on maps, which changes whenever apartments or market statistics change.
+
+        It is derived from the number of apartments, the latest modification, the latest deletion and the latest
+        refresh of the market statistics, which are all cheap to query from their indexes. Writes of derived columns
+        are not included, see `get_derived_data_version`.
+
+        Returns:
+            str: The version, a short hex string.
+        """
+        with self.engine.connect() as connection:
+            count, modified = connection.execute(select(func.count(Apartment.id), func.max(Apartment.modified))).one()
+            deleted = connection.execute(select(func.max(ApartmentTombstone.deleted))).scalar_one()
+            refreshed = connection.execute(select(func.max(MarketStats.refreshed))).scalar_one()
+        raw = f"{count}|{modified}|{deleted}|{refreshed}"
+        return hashlib.sha256(raw.encode()).hexdigest()[:16]
+
+    def get_derived_data_version(self: Self) -> str:
+        """Get a version of the derived columns, which changes whenever clusters, districts or deal scores are written.
+
+        These writes don't change `get_dataset_version`, as they leave the modification timestamp of the apartments as
+        it is.
+
+        Returns:
+            str: The version, a short hex string.
+        """
+        with self.engine.connect() as connection:
+            versions = connection.execute(
+                select(DerivedDataVersion.name, DerivedDataVersion.updated).order_by(DerivedDataVersion.name)
+            ).all()
+        raw = "|".join(f"{name}={updated}" for name, updated in versions)
+        return hashlib.sha256(raw.encode()).hexdigest()[:16]
+
+    def refresh_market_stats(self: Self) -> int:
+        """Recompute the market statistics per post code and property type.
+
+        Only the four needed columns are streamed from the database. Apartments without a valid price per area still
+        count as listings, but are left out of the percentiles. The old statistics are replaced in one transaction.
+
+        Returns:
+            int: The number of (post_code, property_type) groups.
+        """
+        stmt = select(Apartment.post_code, Apartment.property_type, Apartment.area, Apartment.price_per_area).where(
+            Apartment.gone.is_(None)
+        )
+        areas: defaultdict[tuple[int, str], list[int]] = defaultdict(list)
+        prices_per_area: defaultdict[tuple[int, str], list[float]] = defaultdict(list)
+
+        with self.engine.connect() as connection:
+            for post_code, property_type, area, price_per_area in connection.execute(stmt):
+                key = (post_code, property_type)
+                areas[key].append(area)
+                if price_per_area:
+                    prices_per_area[key].append(price_per_area)
+
+        refreshed = datetime.now(tz=ZoneInfo("UTC"))
+        stats: list[MarketStats] = []
+        for (post_code, property_type), group_areas in areas.items():
+            values = sorted(prices_per_area[(post_code, property_type)])
+            stats.append(
+                MarketStats(
+                    post_code=post_code,
+                    property_type=property_type,
+                    listing_count=len(group_areas),
+                    average_area=round(sum(group_areas) / len(group_areas), 2),
+                    price_per_area_p10=percentile(values, 0.10),
+                    price_per_area_p25=percentile(values, 0.25),
+                    price_per_area_median=percentile(values, 0.50),
+                    price_per_area_p75=percentile(values, 0.75),
+                    price_per_area_p90=percentile(values, 0.90),
+                    refreshed=refreshed,
+                )
+            )
+
+        with Session(self.engine) as session:
+            session.execute(delete(MarketStats))
+            session.add_all(stats)
+            with metrics.DB_COMMIT_DURATION.labels(operation="refresh_market_stats").time():
+                session.commit()
+        metrics.DB_ROWS_WRITTEN.labels(table="market_stats", operation="insert").inc(len(stats))
+        logger.info(f"Refreshed market statistics for {len(stats)} groups")
+        return len(stats)
+
+    def get_market_stats(
+        self: Self, post_code: int | None = None, property_type: str | None = None
+    ) -> list[MarketStats]:
+        """Get precomputed market statistics.
+
+        Args:
+            post_code (int | None, optional): Only return statistics for this post code. Defaults to None.
+            property_type (str | None, optional): Only return statistics for this property type. Defaults to None.
+
+        Returns:
+            list[MarketStats]: The matching statistics, ordered by post code and property type.
+        """
+        stmt = select(MarketStats).order_by(MarketStats.post_code, MarketStats.property_type)
+        if post_code is not None:
+            stmt = stmt.where(MarketStats.post_code == post_code)
+        if property_type is not None:
+            stmt = stmt.where(MarketStats.property_type == property_type)
+
+        with Session(self.engine) as session:
+            return list(session.scalars(stmt))
+
+    def add_saved_search(self: Self, search: SavedSearch) -> SavedSearch:
+        """Add a saved search.
+
+        Args:
+            search (SavedSearch): The search criteria.
+
+        Returns:
+            SavedSearch: The stored search, including its id.
+        """
+        with Session(self.engine) as session:
+            session.add(search)
+            session.commit()
+            session.refresh(search)
+        return search
+
+    def get_saved_searches(self: Self) -> list[SavedSearch]:
+        """Get all saved searches."""
+        with Session(self.engine) as session:
+            return list(session.scalars(select(SavedSearch).order_by(SavedSearch.id)))
+
+    def add_search_notifications(self: Self, matches: list[tuple[int, int]]) -> int:
+        """Record apartments matching saved searches. Matches that were already recorded are ignored.
+
+        Args:
+            matches (list[tuple[int, int]]): A (search id, apartment_id) pair per match.
+
+        Returns:
+            int: The number of new notifications.
+        """
+        if not matches:
+            return 0
+
+        insert = postgresql.insert if self.engine.dialect.name == "postgresql" else sqlite.insert
+        stmt = insert(SearchNotification).values(
+            [{"search_id": search_id, "apartment_id": apartment_id} for search_id, apartment_id in matches]
+        )
+        with Session(self.engine) as session:
+            result: "CursorResult" = session.execute(stmt.on_conflict_do_nothing())
+            row_count: int = result.rowcount
+            with metrics.DB_COMMIT_DURATION.labels(operation="add_search_notifications").time():
+                session.commit()
+        metrics.DB_ROWS_WRITTEN.labels(table="search_notifications", operation="insert").inc(row_count)
+        return row_count
+
+    def get_search_notifications(self: Self, search_id: int, limit: int) -> list[Apartment]:
+        """Get the most recent apartments matching a saved search.
+
+        Args:
+            search_id (int): The id of the saved search.
+            limit (int): The max number of apartments to return.
+
+        Returns:
+            list[Apartment]: The matching apartments, newest match first.
+        """
+        stmt = (
+            select(Apartment)
+            .join(SearchNotification, SearchNotification.apartment_id == Apartment.apartment_id)
+            .where(SearchNotification.search_id == search_id)
+            .order_by(SearchNotification.id.desc())
+            .limit(limit)
+        )
+        with Session(self.engine) as session:
+            return list(session.scalars(stmt))
+
+    def add_crawl_run(self: Self, run: CrawlRun) -> CrawlRun:
+        """Record a crawl run in the ledger.
+
+        Args:
+            run (CrawlRun): The finished run.
+
+        Returns:
+            CrawlRun: The run with its id.
+        """
+        with Session(self.engine) as session:
+            session.add(run)
+            with metrics.DB_COMMIT_DURATION.labels(operation="add_crawl_run").time():
+                session.commit()
+            session.refresh(run)
+        metrics.DB_ROWS_WRITTEN.labels(table="crawl_runs", operation="insert").inc()
+        return run
+
+    def get_crawl_runs(self: Self, limit: int, url: str | None = None) -> list[CrawlRun]:
+        """Get the latest crawl runs, newest first.
+
+        Args:
+            limit (int): The max number of runs to return.
+            url (str | None, optional): Only return the runs of this category url. Defaults to None.
+
+        Returns:
+            list[CrawlRun]: The runs.
+        """
+        stmt = select(CrawlRun).order_by(CrawlRun.started.desc()).limit(limit)  # type: ignore[attr-defined]
+        if url is not None:
+            stmt = stmt.where(CrawlRun.url == url)
+
+        with Session(self.engine) as session:
+            return list(session.scalars(stmt))
+
+    def enqueue_crawl_tasks(self: Self, tasks: list[CrawlTask], run: CrawlRun | None = None) -> int:
+        """Add tasks to the crawl work queue.
+
+        Args:
+            tasks (list[CrawlTask]): The tasks.
+            run (CrawlRun | None, optional): The ledger entry of the crawl the tasks belong to, which is added with
+                them and closed once they are all done, see `close_crawl_run`. Defaults to None.
+
+        Returns:
+            int: The number of added tasks.
+        """
+        with Session(self.engine) as session:
+            if run is not None:
+                session.add(run)
+                session.flush()
+                for task in tasks:
+                    task.run_id = run.id
+            session.add_all(tasks)
+            with metrics.DB_COMMIT_DURATION.labels(operation="enqueue_crawl_tasks").time():
+                session.commit()
+            if run is not None:
+                session.refresh(run)
+        metrics.DB_ROWS_WRITTEN.labels(table="crawl_tasks", operation="insert").inc(len(tasks))
+        return len(tasks)
+
+    def count_open_crawl_tasks(self: Self, url: str) -> int:
+        """Count the pending and running tasks of a category url in the crawl work queue."""
+        stmt = (
+            select(func.count())
+            .select_from(CrawlTask)
+            .where(
+                CrawlTask.url == url,
+                CrawlTask.status.in_([CrawlTaskStatus.PENDING, CrawlTaskStatus.RUNNING]),  # type: ignore[attr-defined]
+            )
+        )
+        with self.engine.connect() as connection:
+            return connection.execute(stmt).scalar_one()
+
+    def claim_crawl_task(self: Self, worker_id: str, lease_seconds: float, max_attempts: int) -> CrawlTask | None:
+        """Claim the next task of the crawl work queue, by priority.
+
+        Pending tasks that are available and running tasks whose lease expired, i.e. whose worker died, can be claimed.
+        The candidate row is locked with `FOR UPDATE SKIP LOCKED`, so concurrent workers never claim the same task and
+        never wait for each other. Reclaimed tasks that already used up their attempts are marked as failed.
+
+        Args:
+            worker_id (str): The id of the claiming worker.
+            lease_seconds (float): How long the task is leased to the worker, unless the lease is extended.
+            max_attempts (int): The max number of attempts per task.
+
+        Returns:
+            CrawlTask | None: The claimed task, or None if there is no task to claim.
+        """
+        stmt = (
+            select(CrawlTask)
+            .where(
+                or_(
+                    and_(
+                        CrawlTask.status == CrawlTaskStatus.PENDING,
+                        CrawlTask.available <= bindparam("now"),  # type: ignore[operator]
+                    ),
+                    and_(
+                        CrawlTask.status == CrawlTaskStatus.RUNNING,
+                        CrawlTask.lease_expires < bindparam("now"),  # type: ignore[operator]
+                    ),
+                )
+            )
+            .order_by(CrawlTask.priority, CrawlTask.id)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+        )
+
+        with Session(self.engine) as session:
+            while True:
+                now = datetime.now(tz=ZoneInfo("UTC"))
+                task = session.scalars(stmt, {"now": now}).first()
+                if task is None:
+                    session.commit()
+                    return None
+                if task.attempts >= max_attempts:
+                    logger.warning(f"Crawl task {task.id} failed after {task.attempts} attempts")
+                    task.status = CrawlTaskStatus.FAILED
+                    task.finished = now
+                    run_id = task.run_id
+                    session.commit()
+                    if run_id is not None:
+                        self.close_crawl_run(run_id)
+                    continue
+                task.status = CrawlTaskStatus.RUNNING
+                task.lease_owner = worker_id
+                task.lease_expires = now + timedelta(seconds=lease_seconds)
+                task.attempts += 1
+                with metrics.DB_COMMIT_DURATION.labels(operation="claim_crawl_task").time():
+                    session.commit()
+                session.refresh(task)
+                return task
+
+    def extend_crawl_task_lease(self: Self, task_id: int, worker_id: str, lease_seconds: float) -> bool:
+        """Extend the lease of a running task, as a heartbeat of its worker.
+
+        Args:
+            task_id (int): The id of the task.
+            worker_id (str): The id of the worker holding the lease.
+            lease_seconds (float): The new lease, counted from now.
+
+        Returns:
+            bool: False if the worker lost the lease, e.g. because it expired and another worker claimed the task.
+        """
+        stmt = (
+            update(CrawlTask)
+            .where(
+                CrawlTask.id == task_id,
+                CrawlTask.lease_owner == worker_id,
+                CrawlTask.status == CrawlTaskStatus.RUNNING,
+            )
+            .values(lease_expires=datetime.now(tz=ZoneInfo("UTC")) + timedelta(seconds=lease_seconds))
+        )
+        with Session(self.engine) as session:
+            result: "CursorResult" = session.execute(stmt)
+            session.commit()
+        return bool(result.rowcount)
+
+    def finish_crawl_task(  # noqa: PLR0913
+        self: Self,
+        task: CrawlTask,
+        worker_id: str,
+        error: str | None = None,
+        retry_delay: float = 60,
+        max_attempts: int = 3,
+    ) -> bool:
+        """Mark a task as done, or release it for a retry after an error.
+
+        A task with an error is retried after `retry_delay` times its number of attempts, and fails for good once it
+        used up its attempts. The result counts are taken from `task`.
+
+        Args:
+            task (CrawlTask): The claimed task, with the counts of its result.
+            worker_id (str): The id of the worker holding the lease.
+            error (str | None, optional): The error if the task failed. Defaults to None.
+            retry_delay (float, optional): Seconds before the first retry. Defaults to 60.
+            max_attempts (int, optional): The max number of attempts per task. Defaults to 3.
+
+        Returns:
+            bool: False if the worker lost the lease, in which case the task is left alone.
+        """
+        now = datetime.now(tz=ZoneInfo("UTC"))
+        values: dict[str, Any] = {
+            "lease_owner": None,
+            "lease_expires": None,
+            "parsed": task.parsed,
+            "inserted": task.inserted,
+            "updated": task.updated,
+            "apartment_ids": task.apartment_ids,
+            "error": error,
+        }
+        if error is None:
+            values |= {"status": CrawlTaskStatus.DONE, "finished": now}
+        elif task.attempts >= max_attempts:
+            values |= {"status": CrawlTaskStatus.FAILED, "finished": now}
+        else:
+            values |= {
+                "status": CrawlTaskStatus.PENDING,
+                "available": now + timedelta(seconds=retry_delay * task.attempts),
+            }
+        stmt = (
+            update(CrawlTask)
+            .where(
+                CrawlTask.id == task.id,
+                CrawlTask.lease_owner == worker_id,
+                CrawlTask.status == CrawlTaskStatus.RUNNING,
+            )
+            .values(**values)
+        )
+        with Session(self.engine) as session:
+            result: "CursorResult" = session.execute(stmt)
+            with metrics.DB_COMMIT_DURATION.labels(operation="finish_crawl_task").time():
+                session.commit()
+        return bool(result.rowcount)
+
+    def close_crawl_run(self: Self, run_id: int) -> CrawlRun | None:
+        """Complete the ledger entry of an enqueued crawl once none of its tasks is pending or running anymore.
+
+        The counts of the tasks are added up. If no task failed and the tasks fetched nearly all reported rows, the
+        apartments of the url that none of the tasks fetched are marked as gone, like after `crawl.crawl`. The run is
+        locked, so of the workers finishing the last tasks at the same time only one closes it.
+
+        Args:
+            run_id (int): The id of the run.
+
+        Returns:
+            CrawlRun | None: The closed run, or None if it still has open tasks or was closed already.
+        """
+        run_stmt = select(CrawlRun).where(CrawlRun.id == run_id).with_for_update()
+        tasks_stmt = select(CrawlTask).where(CrawlTask.run_id == run_id)
+        open_statuses = (CrawlTaskStatus.PENDING, CrawlTaskStatus.RUNNING)
+        with Session(self.engine) as session:
+            run = session.scalars(run_stmt).first()
+            tasks = list(session.scalars(tasks_stmt))
+            if run is None or run.finished is not None or any(task.status in open_statuses for task in tasks):
+                session.commit()
+                return None
+
+            failed = [task for task in tasks if task.status == CrawlTaskStatus.FAILED]
+            run.pages_requested = sum(task.last_page - task.first_page + 1 for task in tasks)
+            run.pages_failed = sum(task.last_page - task.first_page + 1 for task in failed)
+            run.parsed = sum(task.parsed for task in tasks)
+            run.inserted = sum(task.inserted for task in tasks)
+            run.updated = sum(task.updated for task in tasks)
+            seen_ids = {apartment_id for task in tasks for apartment_id in task.apartment_ids or []}
+            if failed:
+                run.error = f"{len(failed)} of {len(tasks)} tasks failed, e.g. {failed[0].error}"
+            elif len(seen_ids) >= run.rows_found * COMPLETE_FRACTION:
+                run.gone = self._mark_gone(session, run.url, seen_ids)
+            else:
+                logger.warning(f"Incomplete crawl of {run.url}, {len(seen_ids)} of {run.rows_found} rows fetched")
+            run.finished = datetime.now(tz=ZoneInfo("UTC"))
+            with metrics.DB_COMMIT_DURATION.labels(operation="close_crawl_run").time():
+                session.commit()
+            session.refresh(run)
+        metrics.DB_ROWS_WRITTEN.labels(table="apartments", operation="update").inc(run.gone)
+        return run
+
     def update_apartment_prio(self: Self, apartment_id: int, prio: int) -> bool:
         """Update the priority of an apartment.
 
@@ -174,10 +1676,206 @@ class Model:
         with Session(self.engine) as session:
             result: "CursorResult" = session.execute(stmt)
             row_count: int = result.rowcount
-            session.commit()
+            with metrics.DB_COMMIT_DURATION.labels(operation="update_apartment_prio").time():
+                session.commit()
+        metrics.DB_ROWS_WRITTEN.labels(table="apartments", operation="update").inc(row_count)
 
         return bool(row_count)
 
+    def update_apartment_prios(self: Self, prios: dict[int, int]) -> list[int]:
+        """Update the priority of several apartments at once.
+
+        All priorities are set by a single UPDATE, mapping each apartment_id to its new priority with a CASE
+        expression, in the same transaction as the lookup of the apartments that do not exist.
+
+        Args:
+            prios (dict[int, int]): The new priority per apartment_id.
+
+        Returns:
+            list[int]: The ids of the apartments that were not found, sorted in ascending order.
+        """
+        if not prios:
+            return []
+
+        apartment_ids = list(prios)
+        existing_stmt = select(Apartment.apartment_id).where(Apartment.apartment_id.in_(apartment_ids))
+        stmt = (
+            update(Apartment)
+            .where(Apartment.apartment_id.in_(apartment_ids))
+            .values(prio=case(prios, value=Apartment.apartment_id))
+            .execution_options(synchronize_session=False)
+        )
+
+        with Session(self.engine) as session:
+            existing = set(session.scalars(existing_stmt))
+            if existing:
+                session.execute(stmt)
+            with metrics.DB_COMMIT_DURATION.labels(operation="update_apartment_prios").time():
+                session.commit()
+        metrics.DB_ROWS_WRITTEN.labels(table="apartments", operation="update").inc(len(existing))
+
+        return sorted(set(apartment_ids) - existing)
+
+
+def _map_conditions(map_filter: MapFilter) -> list[Any]:
+    """Turn the criteria of a map filter into the conditions of a query of apartments with coordinates and a price."""
+    conditions: list[Any] = [
+        Apartment.gone.is_(None),
+        Apartment.coordinates.is_not(None),
+        Apartment.coordinates != "",
+        Apartment.price > 0,
+    ]
+    if map_filter.min_post_code is not None:
+        conditions.append(Apartment.post_code >= map_filter.min_post_code)
+    if map_filter.max_post_code is not None:
+        conditions.append(Apartment.post_code <= map_filter.max_post_code)
+    if map_filter.min_rooms is not None:
+        conditions.append(Apartment.rooms >= map_filter.min_rooms)
+    if map_filter.max_price is not None:
+        conditions.append(Apartment.price <= map_filter.max_price)
+    if not map_filter.include_projects:
+        conditions.append(Apartment.product_id != "project")
+    if map_filter.one_per_cluster:
+        conditions.append(or_(Apartment.cluster_id.is_(None), Apartment.cluster_id == Apartment.id))
+    return conditions
+
+
+def _upgrade_schema(connection: "Connection") -> None:
+    """Bring the tables created by an older version up to date, before `create_all` creates the missing tables.
+
+    `create_all` leaves existing tables alone, so the columns and indexes that were added to a model since are added
+    here. Before the unique index of `apartment_id` is created, only the newest row of each apartment_id is kept. The
+    old text column `free_area_type` becomes JSONB on PostgreSQL, and the URLs of the old text column `image_urls` are
+    moved to `apartment_images`. Every step is skipped once it is done, so this runs on every start.
+
+    Args:
+        connection (Connection): A connection in a transaction.
+    """
+    inspector = inspect(connection)
+    existing_tables = set(inspector.get_table_names())
+    dialect = connection.dialect
+    # Another process starting at the same time may have added the column already, where the database can check that.
+    add_column = "ADD COLUMN IF NOT EXISTS" if dialect.name == "postgresql" else "ADD COLUMN"
+    old_image_urls = False
+    for table_ in SQLModel.metadata.sorted_tables:
+        if table_.name not in existing_tables:
+            continue
+        existing_columns = {column["name"]: column for column in inspector.get_columns(table_.name)}
+        for column in table_.columns:
+            if column.name not in existing_columns:
+                logger.info(f"Adding the column {column.name} to {table_.name}")
+                connection.execute(DDL(f"ALTER TABLE {table_.name} {add_column} {_column_ddl(column, dialect)}"))
+                if dialect.name != "postgresql" and column.server_default is not None:
+                    connection.execute(update(table_).values({column.name: column.server_default.arg}))
+        if table_.name == "apartments":
+            _upgrade_apartments(connection, inspector, existing_columns)
+            old_image_urls = "image_urls" in existing_columns
+        _create_missing_indexes(connection, inspector, table_)
+
+    if old_image_urls:
+        logger.info("Moving the image URLs of the apartments to apartment_images")
+        ApartmentImage.__table__.create(connection, checkfirst=True)  # type: ignore[attr-defined]
+        connection.execute(_MOVE_IMAGE_URLS[dialect.name])
+        connection.execute(DDL("ALTER TABLE apartments DROP COLUMN image_urls"))
+
+
+def _upgrade_apartments(
+    connection: "Connection", inspector: "Inspector", existing_columns: dict[str, dict[str, Any]]
+) -> None:
+    """Turn the old text column `free_area_type` into JSONB and drop the duplicates of apartment_ids."""
+    if connection.dialect.name == "postgresql" and not isinstance(
+        existing_columns["free_area_type"]["type"], postgresql.JSONB
+    ):
+        logger.info("Converting the column free_area_type of apartments to JSONB")
+        connection.execute(
+            DDL("ALTER TABLE apartments ALTER COLUMN free_area_type TYPE JSONB USING free_area_type::jsonb")
+        )
+    unique_indexes = {index["name"] for index in inspector.get_indexes("apartments") if index["unique"]}
+    if "ix_apartments_apartment_id" not in unique_indexes:
+        deleted = connection.execute(_DELETE_DUPLICATE_APARTMENTS).rowcount
+        logger.info(f"Deleted {deleted} older duplicates of apartment_ids before adding their unique index")
+
+
+def _create_missing_indexes(connection: "Connection", inspector: "Inspector", table_: "Table") -> None:
+    """Create the indexes of a model that its existing table doesn't have yet."""
+    existing_indexes = {index["name"] for index in inspector.get_indexes(table_.name)}
+    for index in table_.indexes:
+        if index.name not in existing_indexes:
+            logger.info(f"Creating the index {index.name}")
+            index.create(connection)
+
+
+def _column_ddl(column: Column, dialect: "Dialect") -> str:
+    """Render a column for ALTER TABLE ADD COLUMN, with its default, so it can be NOT NULL on a table with rows.
+
+    SQLite can't add a column with a default that is an expression, so there such columns are added without default and
+    as nullable, and the default is set by SQLAlchemy and `_upgrade_schema`.
+    """
+    ddl = f"{dialect.identifier_preparer.format_column(column)} {column.type.compile(dialect=dialect)}"
+    if column.server_default is not None and dialect.name == "postgresql":
+        default = column.server_default.arg.compile(dialect=dialect)
+    elif column.default is not None and column.default.is_scalar:
+        default = literal(column.default.arg).compile(dialect=dialect, compile_kwargs={"literal_binds": True})
+    else:
+        return ddl
+    ddl = f"{ddl} DEFAULT {default}"
+    return ddl if column.nullable else f"{ddl} NOT NULL"
+
+
+def search_text(address: str | None, post_code: int | None, location: str | None) -> str:
+    """Get the text an apartment is found by in a search, its normalized address, post code and location."""
+    return text.normalize(f"{address or ''} {post_code or ''} {location or ''}")
+
+
+def _query_conditions(query: ApartmentQuery) -> list[Any]:  # noqa: C901
+    """Turn the criteria of an apartment query into the conditions of a query of apartments."""
+    conditions: list[Any] = [Apartment.gone.is_(None)]
+    if query.min_price is not None:
+        conditions.append(Apartment.price >= query.min_price)
+    if query.max_price is not None:
+        conditions.append(Apartment.price <= query.max_price)
+    if query.min_area is not None:
+        conditions.append(Apartment.area >= query.min_area)
+    if query.max_area is not None:
+        conditions.append(Apartment.area <= query.max_area)
+    if query.min_rooms is not None:
+        conditions.append(Apartment.rooms >= query.min_rooms)
+    if query.max_rooms is not None:
+        conditions.append(Apartment.rooms <= query.max_rooms)
+    if query.max_price_per_area is not None:
+        conditions.append(Apartment.price_per_area <= query.max_price_per_area)
+    if query.post_code is not None:
+        conditions.append(Apartment.post_code == query.post_code)
+    if query.district is not None:
+        conditions.append(Apartment.district == query.district)
+    if query.property_type is not None:
+        conditions.append(Apartment.property_type == query.property_type)
+    if query.free_area_type is not None:
+        conditions.append(json_array_contains(Apartment.free_area_type, query.free_area_type))
+    if query.one_per_cluster:
+        conditions.append(or_(Apartment.cluster_id.is_(None), Apartment.cluster_id == Apartment.id))
+    return conditions
+
+
+def percentile(values: list[float], fraction: float) -> float | None:
+    """Get a percentile of sorted values, interpolating linearly between the closest ranks.
+
+    This gives the same result as `percentile_cont` in PostgreSQL.
+
+    Args:
+        values (list[float]): Values sorted in ascending order.
+        fraction (float): The percentile as a fraction between 0 and 1, e.g. 0.5 for the median.
+
+    Returns:
+        float | None: The percentile, or None if there are no values.
+    """
+    if not values:
+        return None
+    position = (len(values) - 1) * fraction
+    lower = math.floor(position)
+    upper = math.ceil(position)
+    return round(values[lower] + (values[upper] - values[lower]) * (position - lower), 2)
+
 
 def from_env(name: str) -> str:
     """Get an environment variable.
@@ -214,9 +1912,9 @@ if __name__ == "__main__":
         coordinates="test",
         price=1,
         price_per_area=1,
-        free_area_type="test",
+        free_area_type=["test"],
         free_area=0,
-        image_urls="test",
+        image_urls=["test"],
         advertiser="test",
         prio=1,
     )
@@ -235,9 +1933,9 @@ if __name__ == "__main__":
         coordinates="test",
         price=1,
         price_per_area=1,
-        free_area_type="test",
+        free_area_type=["test"],
         free_area=0,
-        image_urls="test",
+        image_urls=["test"],
         advertiser="test",
         prio=1,
     )
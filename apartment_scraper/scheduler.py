@@ -0,0 +1,239 @@
+import asyncio
+import contextlib
+import random
+import signal
+import time
+import tomllib
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Self
+from zoneinfo import ZoneInfo
+
+from loguru import logger
+
+from apartment_scraper import crawl, districts, duplicates, id_sets, maps, scoring, willhaben
+from apartment_scraper.models import CrawlRun, Model
+from apartment_scraper.willhaben.area_id import Area
+
+
+SOURCES = ("willhaben",)
+
+# Share of the parsed listings that were inserted, updated or gone, above which a job is crawled more often and below
+# which it is crawled less often.
+HIGH_CHURN = 0.05
+LOW_CHURN = 0.01
+# Seconds for which the listings fetched by a job are skipped by the jobs of overlapping areas, see `id_sets.RecentIds`.
+SEEN_MAX_AGE = 300
+
+
+@dataclass
+class Job:
+    """A category of an area that is crawled periodically.
+
+    `interval` is the current interval in seconds. It starts at the configured value and is adapted between
+    `min_interval` and `max_interval` by the churn of the runs. Jobs with a lower `priority` are started first when
+    more jobs are due than the concurrency budget allows.
+    """
+
+    source: str
+    area: str
+    category: str
+    interval: float
+    priority: int = 0
+    min_interval: float | None = None
+    max_interval: float | None = None
+    area_id: Area = field(init=False)
+    url: str = field(init=False)
+    next_run: float = field(default=0.0, init=False)
+    running: bool = field(default=False, init=False)
+
+    def __post_init__(self: Self) -> None:
+        """Validate the job and default the bounds of the interval to a quarter and four times the interval.
+
+        Raises:
+            ValueError: If the source, category or area is unknown.
+        """
+        if self.source not in SOURCES:
+            msg = f"Unknown source {self.source!r}, choose from {SOURCES}"
+            raise ValueError(msg)
+        self.area_id = willhaben.AreaId.resolve(self.area)
+        self.url = willhaben.Request(area_id=self.area_id).category_url(self.category)
+        self.min_interval = self.min_interval or self.interval / 4
+        self.max_interval = self.max_interval or self.interval * 4
+
+    @property
+    def name(self: Self) -> str:
+        """A readable name of the job for the logs."""
+        return f"{self.source}:{self.area}:{self.category}"
+
+    def adapt_interval(self: Self, run: CrawlRun) -> None:
+        """Halve the interval after a run with high churn, and grow it by half after a run with low churn.
+
+        Failed and incomplete runs don't say anything about the churn and keep the interval.
+
+        Args:
+            run (CrawlRun): The last run of the job.
+        """
+        if run.error is not None or run.pages_failed or not run.parsed:
+            return
+        churn = (run.inserted + run.updated + run.gone) / run.parsed
+        if churn > HIGH_CHURN:
+            self.interval = max(self.interval / 2, self.min_interval or 0)
+        elif churn < LOW_CHURN:
+            self.interval = min(self.interval * 1.5, self.max_interval or self.interval)
+
+
+def load_jobs(path: Path) -> list[Job]:
+    """Load the jobs from a TOML file with a `[[jobs]]` table per job.
+
+    Example:
+        ```toml
+        [[jobs]]
+        source = "willhaben"
+        area = "WIEN.LEOPOLDSTADT"
+        category = "kauf_wohnung"
+        interval = 300
+        priority = 0
+        ```
+
+    Args:
+        path (Path): The TOML file.
+
+    Returns:
+        list[Job]: The jobs.
+    """
+    with path.open("rb") as file:
+        config = tomllib.load(file)
+    return [Job(**job) for job in config.get("jobs", [])]
+
+
+class Scheduler:
+    """Runs crawl jobs periodically until it is stopped.
+
+    Each job is rescheduled after its run finishes, with some jitter, so two runs of the same job never overlap and jobs
+    with the same interval drift apart. At most `max_concurrency` crawls run at the same time. When started, each job is
+    scheduled relative to its last run in the crawl run ledger, so restarting the scheduler doesn't crawl everything at
+    once. Listings that a job fetched within the last `seen_max_age` seconds are skipped by the other jobs, so jobs of
+    overlapping areas, e.g. a district and its city, don't fetch and parse the same listings twice.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self: Self,
+        model: Model,
+        jobs: list[Job],
+        max_concurrency: int = 2,
+        jitter: float = 0.1,
+        shutdown_timeout: float = 300,
+        seen_max_age: float = SEEN_MAX_AGE,
+    ) -> None:
+        """Initialize the scheduler.
+
+        Args:
+            model (Model): The database model.
+            jobs (list[Job]): The jobs to run.
+            max_concurrency (int, optional): The max number of crawls running at the same time. Defaults to 2.
+            jitter (float, optional): The max deviation from the interval, as a fraction of it. Defaults to 0.1.
+            shutdown_timeout (float, optional): Seconds to wait for running crawls when stopping, before they are
+                cancelled. Defaults to 300.
+            seen_max_age (float, optional): Seconds for which the listings fetched by a job are skipped by the other
+                jobs. Defaults to SEEN_MAX_AGE.
+        """
+        self.model = model
+        self.jobs = jobs
+        self.max_concurrency = max_concurrency
+        self.jitter = jitter
+        self.shutdown_timeout = shutdown_timeout
+        self._stop = asyncio.Event()
+        self._wakeup = asyncio.Event()
+        self._tasks: set[asyncio.Task[None]] = set()
+        self._stats_lock = asyncio.Lock()
+        self._map_artifacts = maps.MapArtifacts(model)
+        self._recent_ids = id_sets.RecentIds(max_age=seen_max_age)
+
+    def stop(self: Self) -> None:
+        """Stop starting new crawls. `run` returns once the running crawls are finished."""
+        logger.info("Stopping the scheduler")
+        self._stop.set()
+        self._wakeup.set()
+
+    async def run(self: Self) -> None:
+        """Run the jobs until `stop` is called or the process receives SIGINT or SIGTERM."""
+        loop = asyncio.get_running_loop()
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signal_number, self.stop)
+
+        await asyncio.to_thread(self._schedule_from_ledger)
+        while not self._stop.is_set():
+            self._dispatch()
+            self._wakeup.clear()
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self._seconds_until_next_run())
+
+        if self._tasks:
+            logger.info(f"Waiting for {len(self._tasks)} running crawls")
+            _, pending = await asyncio.wait(self._tasks, timeout=self.shutdown_timeout)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            loop.remove_signal_handler(signal_number)
+
+    def _schedule_from_ledger(self: Self) -> None:
+        """Schedule each job one interval after its last run, and adapt the interval to the churn of that run."""
+        now = time.monotonic()
+        for job in self.jobs:
+            runs = self.model.get_crawl_runs(limit=1, url=job.url)
+            if not runs or runs[0].finished is None:
+                job.next_run = now
+                continue
+            job.adapt_interval(runs[0])
+            finished = runs[0].finished.replace(tzinfo=runs[0].finished.tzinfo or ZoneInfo("UTC"))
+            job.next_run = now + max(finished.timestamp() + job.interval - time.time(), 0)
+
+    def _dispatch(self: Self) -> None:
+        """Start the due jobs, by priority, as far as the concurrency budget allows."""
+        now = time.monotonic()
+        due = sorted(
+            (job for job in self.jobs if not job.running and job.next_run <= now),
+            key=lambda job: (job.priority, job.next_run),
+        )
+        for job in due[: self.max_concurrency - self._running_count()]:
+            job.running = True
+            task = asyncio.create_task(self._run_job(job), name=job.name)
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    def _running_count(self: Self) -> int:
+        """The number of running jobs."""
+        return sum(job.running for job in self.jobs)
+
+    def _seconds_until_next_run(self: Self) -> float | None:
+        """Seconds until the next job is due, or None if all jobs are running."""
+        waiting = [job.next_run for job in self.jobs if not job.running]
+        if not waiting or self._running_count() >= self.max_concurrency:
+            return None
+        return max(min(waiting) - time.monotonic(), 0)
+
+    async def _run_job(self: Self, job: Job) -> None:
+        """Crawl a job, adapt and apply its interval, and refresh the derived data if anything changed."""
+        logger.info(f"Starting {job.name}")
+        try:
+            run = await crawl.crawl(
+                self.model, job.area_id, job.category, source=job.source, seen=self._recent_ids.for_scope(job.url)
+            )
+            job.adapt_interval(run)
+            if run.inserted or run.updated or run.gone:
+                async with self._stats_lock:
+                    await asyncio.to_thread(self.model.refresh_market_stats)
+                    await asyncio.to_thread(duplicates.assign_clusters, self.model)
+                    await asyncio.to_thread(districts.assign_districts, self.model)
+                    await asyncio.to_thread(scoring.score_deals, self.model)
+                    await asyncio.to_thread(self._map_artifacts.build)
+        except Exception:
+            logger.exception(f"Crawl of {job.name} failed")
+        finally:
+            job.running = False
+            jitter = random.uniform(1 - self.jitter, 1 + self.jitter)  # noqa: S311
+            job.next_run = time.monotonic() + job.interval * jitter
+            logger.info(f"Next run of {job.name} in {job.next_run - time.monotonic():.0f}s")
+            self._wakeup.set()
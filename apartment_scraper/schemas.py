@@ -20,12 +20,112 @@ class ApartmentSchema(BaseModel):
     coordinates: str | None
     price: float
     price_per_area: float | None
-    free_area_type: str | None
+    free_area_type: list[str] | None
     free_area: int | None
-    image_urls: str | None
     advertiser: str
     prio: int
     updated: datetime.datetime | None
+    modified: datetime.datetime | None
+    cluster_id: int | None
+    district: int | None
+    deal_score: float | None
+    gone: datetime.datetime | None
+
+    class Config:
+        """Schema configuration."""
+        from_attributes = True
+
+
+class ApartmentDetailSchema(ApartmentSchema):
+    """Schema for a single apartment, with its images."""
+    image_urls: list[str]
+
+
+class MarketStatsSchema(BaseModel):
+    """Schema for the MarketStats model."""
+    post_code: int
+    property_type: str
+    listing_count: int
+    average_area: float
+    price_per_area_p10: float | None
+    price_per_area_p25: float | None
+    price_per_area_median: float | None
+    price_per_area_p75: float | None
+    price_per_area_p90: float | None
+    refreshed: datetime.datetime
+
+    class Config:
+        """Schema configuration."""
+        from_attributes = True
+
+
+class PrioUpdateSchema(BaseModel):
+    """Schema for a new priority of an apartment."""
+    apartment_id: int
+    prio: int
+
+
+class PrioUpdateResultSchema(BaseModel):
+    """Schema for the result of a batch priority update."""
+    updated: int
+    not_found: list[int]
+
+
+class ChangeSchema(BaseModel):
+    """Schema for an entry of the change feed."""
+    apartment_id: int
+    deleted: bool
+    data: ApartmentSchema | None
+
+
+class ChangeFeedSchema(BaseModel):
+    """Schema for a page of the change feed."""
+    changes: list[ChangeSchema]
+    cursor: str | None
+    has_more: bool
+
+
+class SavedSearchCreateSchema(BaseModel):
+    """Schema to create a saved search. Missing criteria match every apartment."""
+    name: str
+    post_codes: list[int] | None = None
+    min_rooms: float | None = None
+    max_rooms: float | None = None
+    min_area: int | None = None
+    max_area: int | None = None
+    min_price: float | None = None
+    max_price: float | None = None
+    min_price_per_area: float | None = None
+    max_price_per_area: float | None = None
+    min_free_area: int | None = None
+
+
+class SavedSearchSchema(SavedSearchCreateSchema):
+    """Schema for the SavedSearch model."""
+    id: int  # noqa: A003
+    created: datetime.datetime | None
+
+
+class CrawlRunSchema(BaseModel):
+    """Schema for the CrawlRun model."""
+    id: int  # noqa: A003
+    source: str
+    area: str
+    url: str
+    started: datetime.datetime
+    finished: datetime.datetime | None
+    rows_found: int
+    pages_requested: int
+    pages_failed: int
+    parsed: int
+    inserted: int
+    updated: int
+    gone: int
+    duplicates: int
+    skipped: int
+    bytes_transferred: int
+    p95_page_latency_ms: float | None
+    error: str | None
 
     class Config:
         """Schema configuration."""
@@ -0,0 +1,171 @@
+from time import perf_counter
+from typing import TYPE_CHECKING, Self
+
+import numpy as np
+from loguru import logger
+from sqlmodel import select
+
+from apartment_scraper.models import Apartment
+
+
+if TYPE_CHECKING:
+    from apartment_scraper.models import Model
+
+# Weights of the parts of the deal score, which add up to 1.
+WEIGHTS = {"price": 0.6, "rooms": 0.15, "free_area": 0.15, "floor": 0.1}
+FULL_ROOMS = 5  # rooms from which an apartment gets the full rooms part of the score
+FULL_FREE_AREA = 20  # m² of balcony, terrace or garden from which an apartment gets the full free area part
+FULL_FLOOR = 4  # floor from which an apartment gets the full floor part, the ground floor gets none
+MIN_GROUP_SIZE = 5  # apartments of a district needed to rank against the district, otherwise against all apartments
+ALL = -1  # the group of all apartments
+POST_CODE_OFFSET = 100_000  # added to the post code of apartments without district, to tell the groups apart
+GROUP_SCALE = 1e7  # a group and a price per m² are combined into one sort key, prices per m² must stay below it
+
+
+class Reference:
+    """The prices per m² of all apartments, sorted per group, that the price of an apartment is ranked against.
+
+    An apartment belongs to the group of its district, or of its post code if it has no district yet, and to the group
+    of all apartments. A group and a price per m² are combined into a single key, so the rank of a whole batch of
+    apartments within their groups is found by two binary searches in one sorted array.
+    """
+
+    def __init__(self: Self, groups: np.ndarray, prices_per_area: np.ndarray) -> None:
+        """Prepare the reference.
+
+        Args:
+            groups (np.ndarray): The group of each apartment, see `group_keys`.
+            prices_per_area (np.ndarray): The price per m² of each apartment, NaN if unknown.
+        """
+        valid = prices_per_area > 0
+        groups = np.concatenate([groups[valid], np.full(np.count_nonzero(valid), ALL)])
+        prices_per_area = np.tile(prices_per_area[valid], 2)
+        self.keys = np.sort(groups * GROUP_SCALE + np.minimum(prices_per_area, GROUP_SCALE - 1))
+        self.groups, self.sizes = np.unique(groups, return_counts=True)
+
+    def ranks(self: Self, groups: np.ndarray, prices_per_area: np.ndarray) -> np.ndarray:
+        """Get the share of the apartments of their group that are cheaper per m² than each apartment.
+
+        Apartments of a group with fewer than MIN_GROUP_SIZE apartments are ranked against all apartments. Equally
+        priced apartments get the middle of their ranks.
+
+        Args:
+            groups (np.ndarray): The group of each apartment, see `group_keys`.
+            prices_per_area (np.ndarray): The price per m² of each apartment.
+
+        Returns:
+            np.ndarray: The rank from 0 to 1 of each apartment, NaN without a price per m².
+        """
+        position = np.searchsorted(self.groups, groups).clip(max=max(len(self.groups) - 1, 0))
+        sizes = np.where(self.groups[position] == groups, self.sizes[position], 0) if len(self.groups) else 0
+        groups = np.where(sizes >= MIN_GROUP_SIZE, groups, ALL)
+        keys = groups * GROUP_SCALE + np.minimum(prices_per_area, GROUP_SCALE - 1)
+        starts = np.searchsorted(self.keys, groups * GROUP_SCALE, side="left")
+        ends = np.searchsorted(self.keys, (groups + 1) * GROUP_SCALE, side="left")
+        below = np.searchsorted(self.keys, keys, side="left")
+        up_to = np.searchsorted(self.keys, keys, side="right")
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ranks = ((below + up_to) / 2 - starts) / (ends - starts)
+        return np.where((prices_per_area > 0) & (ends > starts), ranks, np.nan)
+
+
+def group_keys(districts: np.ndarray, post_codes: np.ndarray) -> np.ndarray:
+    """Get the group of each apartment: its district, or its post code if it has no district (NaN)."""
+    return np.where(np.isnan(districts), POST_CODE_OFFSET + np.nan_to_num(post_codes), districts).astype(np.int64)
+
+
+def deal_scores(  # noqa: PLR0913
+    reference: Reference,
+    groups: np.ndarray,
+    prices_per_area: np.ndarray,
+    rooms: np.ndarray,
+    free_areas: np.ndarray,
+    floors: np.ndarray,
+) -> np.ndarray:
+    """Score how good a deal each apartment is, from 0 to 100.
+
+    The score mostly rewards a price per m² that is low compared to the other apartments of the district. The rest
+    rewards more rooms, a balcony, terrace or garden and a higher floor, each up to a limit.
+
+    Args:
+        reference (Reference): The prices per m² to rank against.
+        groups (np.ndarray): The group of each apartment, see `group_keys`.
+        prices_per_area (np.ndarray): The price per m² of each apartment, NaN if unknown.
+        rooms (np.ndarray): The number of rooms of each apartment.
+        free_areas (np.ndarray): The free area in m² of each apartment, NaN if unknown.
+        floors (np.ndarray): The floor of each apartment.
+
+    Returns:
+        np.ndarray: The score of each apartment, rounded to one decimal, NaN without a price per m².
+    """
+    parts = {
+        "price": 1 - reference.ranks(groups, prices_per_area),
+        "rooms": np.clip((np.nan_to_num(rooms) - 1) / (FULL_ROOMS - 1), 0, 1),
+        "free_area": np.clip(np.nan_to_num(free_areas) / FULL_FREE_AREA, 0, 1),
+        "floor": np.clip(np.nan_to_num(floors) / FULL_FLOOR, 0, 1),
+    }
+    return np.round(100 * sum(WEIGHTS[name] * part for name, part in parts.items()), 1)
+
+
+def score_deals(model: "Model", apartment_ids: list[int] | None = None) -> int:
+    """Compute the deal score of apartments and store it in `Apartment.deal_score`.
+
+    All listed apartments are read to rank the prices per m², but only the scores of the given apartments are
+    computed, and only the ones that changed are written. Run it for a batch of ingested apartments, and for all
+    apartments once the prices or the districts changed, as that shifts the ranks of the others. Gone apartments keep
+    their last score.
+
+    Args:
+        model (Model): The database model.
+        apartment_ids (list[int] | None, optional): The apartments to score. Defaults to all apartments.
+
+    Returns:
+        int: The number of apartments whose score changed.
+    """
+    start_time = perf_counter()
+    stmt = select(
+        Apartment.id,
+        Apartment.apartment_id,
+        Apartment.district,
+        Apartment.post_code,
+        Apartment.price_per_area,
+        Apartment.rooms,
+        Apartment.free_area,
+        Apartment.floor,
+        Apartment.deal_score,
+    ).where(Apartment.gone.is_(None))
+    with model.engine.connect() as connection:
+        rows = connection.execute(stmt).all()
+    if not rows:
+        return 0
+    # None becomes NaN in a float array
+    ids, ids_of_apartments, districts, post_codes, prices_per_area, rooms, free_areas, floors, old_scores = (
+        np.array(column, dtype=np.float64) for column in zip(*rows, strict=True)
+    )
+    groups = group_keys(districts, post_codes)
+    reference = Reference(groups, prices_per_area)
+
+    if apartment_ids is None:
+        selected = np.arange(len(rows))
+    else:
+        selected = np.flatnonzero(np.isin(ids_of_apartments, apartment_ids))
+    scores = deal_scores(
+        reference,
+        groups[selected],
+        prices_per_area[selected],
+        rooms[selected],
+        free_areas[selected],
+        floors[selected],
+    )
+    old = old_scores[selected]
+    changed = ~((scores == old) | (np.isnan(scores) & np.isnan(old)))
+    changes = {
+        int(id_): None if np.isnan(score) else float(score)
+        for id_, score in zip(ids[selected][changed], scores[changed], strict=True)
+    }
+    model.update_deal_scores(changes)
+    logger.info(
+        f"Scored {len(selected)} of {len(rows)} apartments in {perf_counter() - start_time:.2f}s, "
+        f"{len(changes)} changed their score"
+    )
+    return len(changes)
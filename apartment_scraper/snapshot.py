@@ -0,0 +1,380 @@
+import threading
+import time
+from collections.abc import Sequence
+from datetime import datetime
+from functools import cached_property
+from typing import TYPE_CHECKING, Any, Self
+from zoneinfo import ZoneInfo
+
+import numpy as np
+from loguru import logger
+
+from apartment_scraper import schemas
+from apartment_scraper.models import ApartmentQuery, MapFilter, MarketStats, RowsResult, percentile
+
+
+if TYPE_CHECKING:
+    from apartment_scraper.models import Model
+
+COLUMNS = list(schemas.ApartmentSchema.__fields__)
+# Columns that are also kept as float64 arrays, with NaN for None, to filter, sort and aggregate on.
+NUMERIC_COLUMNS = (
+    "id", "apartment_id", "area", "rooms", "floor", "post_code", "price", "price_per_area", "free_area", "prio",
+    "cluster_id", "district", "deal_score",
+)
+
+
+class ApartmentSnapshot:
+    """An immutable copy of the apartments table in memory, stored column by column and sorted by id.
+
+    Each column is a NumPy array of the values as read from the database, which are returned as they are. The numeric
+    columns are also kept as float64 arrays, so filters, sorting and statistics are vectorized operations over whole
+    columns. A page is a slice of the positions of the listed apartments and an apartment is found by a binary search
+    in the apartment ids, so no query goes through all rows in Python.
+    """
+
+    def __init__(self: Self, values: dict[str, np.ndarray]) -> None:
+        """Build the snapshot from its columns.
+
+        Args:
+            values (dict[str, np.ndarray]): An object array per column of COLUMNS, in any order of the rows.
+        """
+        order = np.argsort(values["id"].astype(np.int64), kind="stable")
+        self.values = {column: column_values[order] for column, column_values in values.items()}
+        self.numeric = {
+            column: np.where(np.equal(self.values[column], None), np.nan, self.values[column]).astype(np.float64)
+            for column in NUMERIC_COLUMNS
+        }
+        self.ids = self.values["id"].astype(np.int64)
+        apartment_ids = self.values["apartment_id"].astype(np.int64)
+        self.apartment_order = np.argsort(apartment_ids, kind="stable")
+        self.sorted_apartment_ids = apartment_ids[self.apartment_order]
+        # Gone apartments are only returned by their id, like in `Model`.
+        self.listed = np.equal(self.values["gone"], None)
+        self.listed_positions = np.flatnonzero(self.listed)
+        cluster_ids = self.numeric["cluster_id"]
+        self.is_first_of_cluster = np.isnan(cluster_ids) | (cluster_ids == self.numeric["id"])
+        self.first_of_cluster = np.flatnonzero(self.listed & self.is_first_of_cluster)
+        coordinates = self.values["coordinates"]
+        self.has_coordinates = np.not_equal(coordinates, None) & np.not_equal(coordinates, "")
+        self.built = datetime.now(tz=ZoneInfo("UTC"))
+
+    @classmethod
+    def from_rows(cls: type[Self], rows: Sequence[tuple[Any, ...]]) -> Self:
+        """Build a snapshot from rows of the columns in COLUMNS."""
+        matrix = np.empty((len(rows), len(COLUMNS)), dtype=object)
+        for position, row in enumerate(rows):
+            matrix[position] = row
+        return cls({column: matrix[:, index] for index, column in enumerate(COLUMNS)})
+
+    def __len__(self: Self) -> int:
+        """The number of apartments."""
+        return len(self.ids)
+
+    def apply(self: Self, rows: Sequence[tuple[Any, ...]], deleted_ids: Sequence[int]) -> Self:
+        """Get a new snapshot with changed apartments replaced and deleted apartments removed.
+
+        Args:
+            rows (Sequence[tuple[Any, ...]]): The rows of the inserted and updated apartments, of the columns in
+                COLUMNS.
+            deleted_ids (Sequence[int]): The apartment ids of the deleted apartments.
+
+        Returns:
+            ApartmentSnapshot: The new snapshot, this one is left unchanged.
+        """
+        changes = type(self).from_rows(rows)
+        replaced = np.concatenate([changes.sorted_apartment_ids, np.asarray(deleted_ids, dtype=np.int64)])
+        kept = ~np.isin(self.numeric["apartment_id"], replaced)
+        return type(self)(
+            {column: np.concatenate([self.values[column][kept], changes.values[column]]) for column in COLUMNS}
+        )
+
+    def rows(self: Self, positions: np.ndarray, columns: list[str]) -> list[tuple[Any, ...]]:
+        """Get the rows of some columns at positions of the snapshot."""
+        if not len(positions):
+            return []
+        return list(zip(*(self.values[column][positions].tolist() for column in columns), strict=True))
+
+    def get_paged_apartment_rows(
+        self: Self, page: int, pagesize: int, columns: list[str], one_per_cluster: bool = False
+    ) -> RowsResult:
+        """Get a page of apartments as plain rows, like `Model.get_paged_apartment_rows`."""
+        positions = self.first_of_cluster if one_per_cluster else self.listed_positions
+        rows = self.rows(positions[page * pagesize : (page + 1) * pagesize], columns)
+        return RowsResult(columns, rows, len(rows), len(positions))
+
+    def get_apartment_rows(self: Self, apartment_ids: list[int], columns: list[str]) -> list[tuple[Any, ...]]:
+        """Get several apartments as plain rows, like `Model.get_apartment_rows`."""
+        wanted = np.asarray(apartment_ids, dtype=np.int64)
+        found = np.searchsorted(self.sorted_apartment_ids, wanted).clip(max=max(len(self) - 1, 0))
+        exists = self.sorted_apartment_ids[found] == wanted if len(self) else np.zeros(len(wanted), dtype=bool)
+        return self.rows(self.apartment_order[found[exists]], columns)
+
+    def query_apartment_rows(
+        self: Self, query: ApartmentQuery, columns: list[str], limit: int, offset: int = 0
+    ) -> RowsResult:
+        """Get the apartments matching a query as plain rows, like `Model.query_apartment_rows`."""
+        positions = np.flatnonzero(self._query_mask(query))
+        keys = self.numeric[query.sort_by][positions]
+        # lexsort sorts by the last key first and puts NaN last, negating keeps them last for descending order.
+        order = np.lexsort((self.ids[positions], -keys if query.descending else keys))
+        rows = self.rows(positions[order[offset : offset + limit]], columns)
+        return RowsResult(columns, rows, len(rows), len(positions))
+
+    def get_top_apartment_rows(
+        self: Self, k: int, columns: list[str], one_per_cluster: bool = False
+    ) -> list[tuple[Any, ...]]:
+        """Get the apartments with the best deal score as plain rows, like `Model.get_top_apartment_rows`."""
+        positions = self.deal_order
+        if one_per_cluster:
+            positions = positions[self.is_first_of_cluster[positions]]
+        return self.rows(positions[:k], columns)
+
+    @cached_property
+    def deal_order(self: Self) -> np.ndarray:
+        """The positions of the listed apartments with a deal score, best first, ties in descending order of their id.
+
+        Sorted once per snapshot, on the first request of the best deals.
+        """
+        scores = self.numeric["deal_score"]
+        positions = np.flatnonzero(self.listed & ~np.isnan(scores))
+        return positions[np.lexsort((-self.ids[positions], -scores[positions]))]
+
+    @cached_property
+    def free_area_types(self: Self) -> dict[str, np.ndarray]:
+        """A mask of the apartments with a free area of the type, per type. Built once per snapshot, on first use."""
+        masks: dict[str, np.ndarray] = {}
+        for position, types in enumerate(self.values["free_area_type"]):
+            for free_area_type in types or ():
+                masks.setdefault(free_area_type, np.zeros(len(self), dtype=bool))[position] = True
+        return masks
+
+    def get_market_stats(
+        self: Self, post_code: int | None = None, property_type: str | None = None
+    ) -> list[MarketStats]:
+        """Get the market statistics per post code and property type, like `Model.get_market_stats`.
+
+        Args:
+            post_code (int | None, optional): Only return statistics for this post code. Defaults to None.
+            property_type (str | None, optional): Only return statistics for this property type. Defaults to None.
+
+        Returns:
+            list[MarketStats]: The statistics, ordered by post code and property type.
+        """
+        return [
+            stats
+            for stats in self.market_stats
+            if (post_code is None or stats.post_code == post_code)
+            and (property_type is None or stats.property_type == property_type)
+        ]
+
+    @cached_property
+    def market_stats(self: Self) -> list[MarketStats]:
+        """The statistics of all post codes and property types, computed once like `Model.refresh_market_stats`."""
+        listed = self.listed
+        post_codes = self.numeric["post_code"][listed].astype(np.int64)
+        types, type_codes = np.unique(self.values["property_type"][listed].astype(str), return_inverse=True)
+        areas = self.numeric["area"][listed]
+        # A price per area of 0 counts as a listing, but is left out of the percentiles, like a missing one.
+        prices_per_area = self.numeric["price_per_area"][listed]
+        prices_per_area = np.where(prices_per_area != 0, prices_per_area, np.nan)
+
+        # Sorted by group, then by price per area with NaN last, so each group is a slice with its valid prices first.
+        groups = post_codes * len(types) + type_codes
+        order = np.lexsort((prices_per_area, groups))
+        keys, starts, counts = np.unique(groups[order], return_index=True, return_counts=True)
+        stats = []
+        for key, start, count in zip(keys.tolist(), starts.tolist(), counts.tolist(), strict=True):
+            group = order[start : start + count]
+            values = prices_per_area[group]
+            values = values[~np.isnan(values)].tolist()
+            stats.append(
+                MarketStats(
+                    post_code=key // len(types),
+                    property_type=str(types[key % len(types)]),
+                    listing_count=count,
+                    average_area=round(float(areas[group].mean()), 2),
+                    price_per_area_p10=percentile(values, 0.10),
+                    price_per_area_p25=percentile(values, 0.25),
+                    price_per_area_median=percentile(values, 0.50),
+                    price_per_area_p75=percentile(values, 0.75),
+                    price_per_area_p90=percentile(values, 0.90),
+                    refreshed=self.built,
+                )
+            )
+        return stats
+
+    def get_map_points(self: Self, map_filter: MapFilter | None = None) -> list[tuple[int, str, float]]:
+        """Get the apartment_id, coordinates and price of the apartments on a map, like `Model.get_map_points`."""
+        map_filter = map_filter or MapFilter()
+        numeric = self.numeric
+        mask = self.listed & self.has_coordinates & (numeric["price"] > 0)
+        if map_filter.min_post_code is not None:
+            mask &= numeric["post_code"] >= map_filter.min_post_code
+        if map_filter.max_post_code is not None:
+            mask &= numeric["post_code"] <= map_filter.max_post_code
+        if map_filter.min_rooms is not None:
+            mask &= numeric["rooms"] >= map_filter.min_rooms
+        if map_filter.max_price is not None:
+            mask &= numeric["price"] <= map_filter.max_price
+        if not map_filter.include_projects:
+            mask &= self.values["product_id"] != "project"
+        if map_filter.one_per_cluster:
+            mask &= self.is_first_of_cluster
+        return self.rows(np.flatnonzero(mask), ["apartment_id", "coordinates", "price"])
+
+    def _query_mask(self: Self, query: ApartmentQuery) -> np.ndarray:
+        """Get a mask of the apartments matching the criteria of a query, see `models._query_conditions`."""
+        numeric = self.numeric
+        mask = self.listed.copy()
+        bounds = [
+            ("price", query.min_price, query.max_price),
+            ("area", query.min_area, query.max_area),
+            ("rooms", query.min_rooms, query.max_rooms),
+            ("price_per_area", None, query.max_price_per_area),
+        ]
+        # Comparisons with NaN are False, so a missing value never matches a bound, like NULL in SQL.
+        for column, lower, upper in bounds:
+            if lower is not None:
+                mask &= numeric[column] >= lower
+            if upper is not None:
+                mask &= numeric[column] <= upper
+        for column in ("post_code", "district"):
+            if (value := getattr(query, column)) is not None:
+                mask &= numeric[column] == value
+        if query.property_type is not None:
+            mask &= self.values["property_type"] == query.property_type
+        if query.free_area_type is not None:
+            mask &= self.free_area_types.get(query.free_area_type, np.zeros(len(self), dtype=bool))
+        if query.one_per_cluster:
+            mask &= self.is_first_of_cluster
+        return mask
+
+
+class SnapshotStore:
+    """Keeps a snapshot of the apartments table in memory, to answer read queries without the database.
+
+    The snapshot is loaded once and then kept up to date by a background thread. Every `check_interval` seconds, it
+    reads the apartments that were modified, got new derived columns, like the clusters or the deal scores, or were
+    deleted since the last read, through the indexes on their timestamps. Each read starts where all earlier changes
+    were committed, see `Model.get_changed_apartment_rows`, so transactions that commit late are not missed. Changes
+    are applied to a copy of the snapshot, which then replaces it, so readers never wait for a refresh and never see a
+    half applied one. Writes through the API, like a new priority, are therefore visible after up to `check_interval`
+    seconds. Once every `full_reload_interval` seconds the whole table is read again instead.
+
+    The store has the read methods of `Model` that the API uses, so it can be used in its place.
+    """
+
+    def __init__(self: Self, model: "Model", check_interval: float = 2, full_reload_interval: float = 3600) -> None:
+        """Initialize the store. The snapshot is loaded by `start` or on first use.
+
+        Args:
+            model (Model): The database model.
+            check_interval (float, optional): Seconds between reads of the changes. Defaults to 2.
+            full_reload_interval (float, optional): Seconds after which the whole table is read again. Defaults to
+                3600.
+        """
+        self.model = model
+        self.check_interval = check_interval
+        self.full_reload_interval = full_reload_interval
+        self._snapshot: ApartmentSnapshot | None = None
+        self._since: datetime | None = None
+        self._loaded = 0.0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self: Self) -> None:
+        """Load the snapshot and keep it up to date in a background thread."""
+        self.get()
+        self._thread = threading.Thread(target=self._run, name="snapshot-refresh", daemon=True)
+        self._thread.start()
+
+    def stop(self: Self) -> None:
+        """Stop refreshing the snapshot and wait for the thread to finish."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def get(self: Self) -> ApartmentSnapshot:
+        """Get the current snapshot, loading it first if it wasn't yet."""
+        if self._snapshot is None:
+            self.refresh()
+        return self._snapshot  # type: ignore[return-value]
+
+    def refresh(self: Self) -> bool:
+        """Apply the changes since the last refresh, or read the whole table again if it is due.
+
+        Returns:
+            bool: Whether the snapshot was replaced, False if nothing changed.
+        """
+        with self._lock:
+            start_time = time.perf_counter()
+            if (
+                self._snapshot is None
+                or self._since is None
+                or time.monotonic() - self._loaded > self.full_reload_interval
+            ):
+                changes = self.model.get_changed_apartment_rows(COLUMNS, since=None)
+                snapshot = ApartmentSnapshot.from_rows(changes.rows)
+                self._loaded = time.monotonic()
+            else:
+                changes = self.model.get_changed_apartment_rows(COLUMNS, since=self._since)
+                self._since = changes.until
+                if not changes.rows and not changes.deleted:
+                    return False
+                # An apartment that was added again after it was deleted has been modified after its deletion.
+                modified = {row[COLUMNS.index("apartment_id")]: row[COLUMNS.index("modified")] for row in changes.rows}
+                deleted_ids = [
+                    apartment_id
+                    for apartment_id, deleted_at in changes.deleted
+                    if apartment_id not in modified or modified[apartment_id] < deleted_at
+                ]
+                snapshot = self._snapshot.apply(changes.rows, deleted_ids)
+            self._since = changes.until
+            self._snapshot = snapshot
+            logger.info(
+                f"Refreshed the snapshot of {len(snapshot)} apartments with {len(changes.rows)} changed and "
+                f"{len(changes.deleted)} deleted rows in {time.perf_counter() - start_time:.3f}s"
+            )
+            return True
+
+    def _run(self: Self) -> None:
+        """Refresh the snapshot until stopped."""
+        while not self._stop.wait(self.check_interval):
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("Refreshing the snapshot failed")
+
+    def get_paged_apartment_rows(
+        self: Self, page: int, pagesize: int, columns: list[str], one_per_cluster: bool = False
+    ) -> RowsResult:
+        """Get a page of apartments as plain rows, see `ApartmentSnapshot.get_paged_apartment_rows`."""
+        return self.get().get_paged_apartment_rows(page, pagesize, columns, one_per_cluster)
+
+    def get_apartment_rows(self: Self, apartment_ids: list[int], columns: list[str]) -> list[tuple[Any, ...]]:
+        """Get several apartments as plain rows, see `ApartmentSnapshot.get_apartment_rows`."""
+        return self.get().get_apartment_rows(apartment_ids, columns)
+
+    def query_apartment_rows(
+        self: Self, query: ApartmentQuery, columns: list[str], limit: int, offset: int = 0
+    ) -> RowsResult:
+        """Get the apartments matching a query as plain rows, see `ApartmentSnapshot.query_apartment_rows`."""
+        return self.get().query_apartment_rows(query, columns, limit, offset)
+
+    def get_top_apartment_rows(
+        self: Self, k: int, columns: list[str], one_per_cluster: bool = False
+    ) -> list[tuple[Any, ...]]:
+        """Get the apartments with the best deal score as plain rows, see `ApartmentSnapshot.get_top_apartment_rows`."""
+        return self.get().get_top_apartment_rows(k, columns, one_per_cluster)
+
+    def get_market_stats(
+        self: Self, post_code: int | None = None, property_type: str | None = None
+    ) -> list[MarketStats]:
+        """Compute the market statistics, see `ApartmentSnapshot.get_market_stats`."""
+        return self.get().get_market_stats(post_code, property_type)
+
+    def get_map_points(self: Self, map_filter: MapFilter | None = None) -> list[tuple[int, str, float]]:
+        """Get the apartments to show on a map, see `ApartmentSnapshot.get_map_points`."""
+        return self.get().get_map_points(map_filter)
@@ -0,0 +1,28 @@
+import re
+import unicodedata
+
+
+_TRANSLITERATIONS = str.maketrans({"ä": "ae", "ö": "oe", "ü": "ue", "ß": "ss"})
+_STREET_SUFFIX = re.compile(r"(strasse\b|str\b\.?)")
+_NON_ALPHANUMERIC = re.compile(r"[^a-z0-9]+")
+
+
+def normalize(text: str | None) -> str:
+    """Normalize German text for comparisons and search.
+
+    The text is lower cased, umlauts and ß are transliterated like they are typed without a German keyboard, e.g.
+    "Währinger Straße" and "waehringer strasse" become the same, other accents are removed and any punctuation is
+    replaced by a single space. "Straße", "Strasse" and "Str." are shortened to "str".
+
+    Args:
+        text (str | None): The text, e.g. an address.
+
+    Returns:
+        str: The normalized text, empty for None.
+    """
+    if not text:
+        return ""
+    text = text.lower().translate(_TRANSLITERATIONS)
+    text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode()
+    text = _STREET_SUFFIX.sub("str", text)
+    return _NON_ALPHANUMERIC.sub(" ", text).strip()
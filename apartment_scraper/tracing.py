@@ -0,0 +1,242 @@
+import atexit
+import json
+import os
+import secrets
+import threading
+from contextvars import ContextVar
+from pathlib import Path
+from time import time_ns
+from types import TracebackType
+from typing import Any, Self
+
+
+_current_span: ContextVar["Span | None"] = ContextVar("current_span", default=None)
+_exporter: "FileExporter | None" = None
+
+MAX_BUFFERED_SPANS = 2_048  # finished spans kept in memory before they are appended to the file
+
+
+class FileExporter:
+    """Collects finished spans and appends them to a file.
+
+    The spans are buffered and appended once `max_spans` are collected, on `flush`, which the crawls call when they
+    are done, and when the process exits. So a long running scheduler or worker neither holds all its spans in memory
+    nor loses them all when it is killed.
+    """
+
+    def __init__(
+        self: Self, path: Path, service_name: str = "apartment_scraper", max_spans: int = MAX_BUFFERED_SPANS
+    ) -> None:
+        """Initialize the exporter.
+
+        Args:
+            path (Path): The file to append the spans to.
+            service_name (str, optional): Name of the service in the resource of the spans. Defaults to
+                "apartment_scraper".
+            max_spans (int, optional): The number of spans to collect before appending them. Defaults to
+                MAX_BUFFERED_SPANS.
+        """
+        self.path = path
+        self.service_name = service_name
+        self.max_spans = max_spans
+        self.spans: list[dict[str, Any]] = []
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+
+    def export(self: Self, span: dict[str, Any]) -> None:
+        """Add a finished span, and append the collected spans to the file once the buffer is full."""
+        with self.lock:
+            self.spans.append(span)
+            full = len(self.spans) >= self.max_spans
+        if full:
+            self.flush()
+
+    def flush(self: Self) -> None:
+        """Append all collected spans to the file."""
+        with self.lock:
+            spans, self.spans = self.spans, []
+        if not spans:
+            return
+        request = {
+            "resourceSpans": [
+                {
+                    "resource": {"attributes": _attributes({"service.name": self.service_name})},
+                    "scopeSpans": [{"scope": {"name": "apartment_scraper"}, "spans": spans}],
+                }
+            ]
+        }
+        # One line per flush, which must not interleave with the line of a flush in another thread.
+        with self.write_lock, self.path.open("a") as file:
+            file.write(json.dumps(request) + "\n")
+
+
+class Span:
+    """A timed operation with attributes, nested in the span that was current when it started."""
+
+    def __init__(self: Self, name: str, attributes: dict[str, Any]) -> None:
+        """Initialize the span. The span starts when entering it as a context manager.
+
+        Args:
+            name (str): The name of the operation.
+            attributes (dict[str, Any]): Attributes of the span.
+        """
+        self.name = name
+        self.attributes = attributes
+        self.parent = _current_span.get()
+        self.trace_id = self.parent.trace_id if self.parent else secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.start = 0
+
+    def set_attribute(self: Self, key: str, value: Any) -> None:  # noqa: ANN401
+        """Set an attribute, e.g. a count that is only known at the end of the operation."""
+        self.attributes[key] = value
+
+    def __enter__(self: Self) -> Self:
+        """Start the span and make it the current span."""
+        self.start = time_ns()
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(
+        self: Self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        """End the span and hand it to the exporter."""
+        _current_span.reset(self._token)
+        self.end(error=repr(exc) if exc is not None else None)
+
+    def end(self: Self, error: str | None = None) -> None:
+        """End the span, for spans that are not used as a context manager."""
+        if _exporter is None:
+            return
+        span: dict[str, Any] = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,  # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(self.start),
+            "endTimeUnixNano": str(time_ns()),
+            "attributes": _attributes(self.attributes),
+        }
+        if self.parent is not None:
+            span["parentSpanId"] = self.parent.span_id
+        if error is not None:
+            span["status"] = {"code": 2, "message": error}  # STATUS_CODE_ERROR
+        _exporter.export(span)
+
+
+class _NoopSpan:
+    """Stands in for a span while tracing is disabled."""
+
+    def set_attribute(self: Self, key: str, value: Any) -> None:  # noqa: ANN401
+        """Ignore the attribute."""
+
+    def __enter__(self: Self) -> Self:
+        """Do nothing."""
+        return self
+
+    def __exit__(self: Self, *args: object) -> None:
+        """Do nothing."""
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def span(name: str, **attributes: Any) -> Span | _NoopSpan:  # noqa: ANN401
+    """Create a span to use as a context manager.
+
+    When tracing is disabled, a shared no-op span is returned, so instrumented code only pays for a function call.
+
+    Example:
+        ```python
+        with tracing.span("fetch_page", page=3) as page_span:
+            ...
+            page_span.set_attribute("adverts", 200)
+        ```
+
+    Args:
+        name (str): The name of the operation.
+        **attributes (Any): Attributes of the span, e.g. page number or row counts.
+
+    Returns:
+        Span | _NoopSpan: The span, or a no-op span if tracing is disabled.
+    """
+    if _exporter is None:
+        return _NOOP_SPAN
+    return Span(name, attributes)
+
+
+def enable(path: Path) -> None:
+    """Enable tracing and append the spans to a file, in batches and when the process exits.
+
+    Tracing is disabled unless this is called or the environment variable APARTMENT_SCRAPER_TRACE_FILE is set. The
+    spans are written in the OTLP/JSON format, one `ExportTraceServiceRequest` per line, like the file exporter of the
+    OpenTelemetry collector does. The file can be replayed through a collector into Jaeger or Grafana Tempo, to see a
+    crawl as a waterfall timeline.
+
+    Args:
+        path (Path): The file to append the spans to.
+    """
+    global _exporter  # noqa: PLW0603
+    if _exporter is None:
+        atexit.register(flush)
+    _exporter = FileExporter(path)
+
+
+def is_enabled() -> bool:
+    """Check whether tracing is enabled."""
+    return _exporter is not None
+
+
+def flush() -> None:
+    """Write the finished spans to the file."""
+    if _exporter is not None:
+        _exporter.flush()
+
+
+def httpx_extensions() -> dict[str, Any]:
+    """Get the request extensions that trace the connection stages of an httpx request.
+
+    httpcore reports the start and end of each stage, like connecting (including DNS resolution), the TLS handshake
+    and waiting for the response headers. Each stage becomes a child span of the current span.
+
+    Returns:
+        dict[str, Any]: The extensions to pass to the request, empty if tracing is disabled.
+    """
+    if _exporter is None:
+        return {}
+
+    open_spans: dict[str, Span] = {}
+
+    async def trace(event_name: str, info: dict[str, Any]) -> None:
+        stage, _, state = event_name.rpartition(".")
+        if state == "started":
+            stage_span = Span(f"http.{stage}", {})
+            stage_span.start = time_ns()
+            open_spans[stage] = stage_span
+        elif stage_span := open_spans.pop(stage, None):
+            stage_span.end(error="failed" if state == "failed" else None)
+
+    return {"trace": trace}
+
+
+def _attributes(attributes: dict[str, Any]) -> list[dict[str, Any]]:
+    """Convert attributes to the typed key values of OTLP."""
+    converted: list[dict[str, Any]] = []
+    for key, value in attributes.items():
+        if isinstance(value, bool):
+            typed_value: dict[str, Any] = {"boolValue": value}
+        elif isinstance(value, int):
+            typed_value = {"intValue": str(value)}
+        elif isinstance(value, float):
+            typed_value = {"doubleValue": value}
+        else:
+            typed_value = {"stringValue": str(value)}
+        converted.append({"key": key, "value": typed_value})
+    return converted
+
+
+if trace_file := os.environ.get("APARTMENT_SCRAPER_TRACE_FILE"):
+    enable(Path(trace_file))
@@ -1,5 +1,23 @@
-from apartment_scraper.willhaben.area_id import AreaId
-from apartment_scraper.willhaben.request import Request, get_data
+from apartment_scraper.willhaben.area_id import Area, AreaId
+from apartment_scraper.willhaben.request import (
+    CATEGORIES,
+    CrawlStats,
+    NoConnectionError,
+    NoRowsFoundError,
+    Request,
+    get_area_data,
+    get_data,
+)
 
 
-__all__ = ["AreaId", "get_data", "Request"]
+__all__ = [
+    "Area",
+    "AreaId",
+    "CATEGORIES",
+    "CrawlStats",
+    "get_area_data",
+    "get_data",
+    "NoConnectionError",
+    "NoRowsFoundError",
+    "Request",
+]
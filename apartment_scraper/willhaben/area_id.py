@@ -1,7 +1,35 @@
 from enum import Enum
+from typing import Self
 
 
-class _Wien(Enum):
+class Area(Enum):
+    """Base of the area enumerators of the states.
+
+    The `ALL` member of a state is the whole state, the other members are its districts. Areas are either given by their
+    slug in the path of the search url, like the districts of Vienna, or by their numeric area id.
+    """
+
+    @property
+    def qualified_name(self: Self) -> str:
+        """The name of the area including its state, e.g. "WIEN.LEOPOLDSTADT"."""
+        return f"{type(self).__name__.lstrip('_').upper()}.{self.name}"
+
+    @property
+    def url_suffix(self: Self) -> str:
+        """The suffix of a search url selecting the area, either a path or an areaId query."""
+        if isinstance(self.value, int):
+            return f"?areaId={self.value}"
+        return f"/{self.value}"
+
+    @property
+    def children(self: Self) -> list[Self]:
+        """The districts of a state, or an empty list for a district."""
+        if self.name != "ALL":
+            return []
+        return [area for area in type(self) if area.name != "ALL"]
+
+
+class _Wien(Area):
     ALL = "wien"
     INNERESTADT = "wien/wien-1010-innere-stadt"
     LEOPOLDSTADT = "wien/wien-1020-leopoldstadt"
@@ -28,7 +56,7 @@ class _Wien(Enum):
     LIESING = "wien/wien-1230-liesing"
 
 
-class _Niederösterreich(Enum):
+class _Niederösterreich(Area):
     ALL = 3
     AMSTETTEN = 305
     BADEN = 306
@@ -56,14 +84,140 @@ class _Niederösterreich(Enum):
     ZWETTL = 325
 
 
+class _Burgenland(Area):
+    ALL = 1
+    EISENSTADT = 101
+    RUST = 102
+    EISENSTADT_UMGEBUNG = 103
+    GÜSSING = 104
+    JENNERSDORF = 105
+    MATTERSBURG = 106
+    NEUSIEDL_AM_SEE = 107
+    OBERPULLENDORF = 108
+    OBERWART = 109
+
+
+class _Kärnten(Area):
+    ALL = 2
+    KLAGENFURT = 201
+    VILLACH = 202
+    HERMAGOR = 203
+    KLAGENFURT_LAND = 204
+    SANKT_VEIT_AN_DER_GLAN = 205
+    SPITTAL_AN_DER_DRAU = 206
+    VILLACH_LAND = 207
+    VÖLKERMARKT = 208
+    WOLFSBERG = 209
+    FELDKIRCHEN = 210
+
+
+class _Oberösterreich(Area):
+    ALL = 4
+    LINZ = 401
+    STEYR = 402
+    WELS = 403
+    BRAUNAU_AM_INN = 404
+    EFERDING = 405
+    FREISTADT = 406
+    GMUNDEN = 407
+    GRIESKIRCHEN = 408
+    KIRCHDORF_AN_DER_KREMS = 409
+    LINZ_LAND = 410
+    PERG = 411
+    RIED_IM_INNKREIS = 412
+    ROHRBACH = 413
+    SCHÄRDING = 414
+    STEYR_LAND = 415
+    URFAHR_UMGEBUNG = 416
+    VÖCKLABRUCK = 417
+    WELS_LAND = 418
+
+
+class _Salzburg(Area):
+    ALL = 5
+    SALZBURG = 501
+    HALLEIN = 502
+    SALZBURG_UMGEBUNG = 503
+    SANKT_JOHANN_IM_PONGAU = 504
+    TAMSWEG = 505
+    ZELL_AM_SEE = 506
+
+
+class _Steiermark(Area):
+    ALL = 6
+    GRAZ = 601
+    DEUTSCHLANDSBERG = 603
+    GRAZ_UMGEBUNG = 606
+    LEIBNITZ = 610
+    LEOBEN = 611
+    LIEZEN = 612
+    MURAU = 614
+    VOITSBERG = 616
+    WEIZ = 617
+    MURTAL = 620
+    BRUCK_MÜRZZUSCHLAG = 621
+    HARTBERG_FÜRSTENFELD = 622
+    SÜDOSTSTEIERMARK = 623
+
+
+class _Tirol(Area):
+    ALL = 7
+    INNSBRUCK = 701
+    IMST = 702
+    INNSBRUCK_LAND = 703
+    KITZBÜHEL = 704
+    KUFSTEIN = 705
+    LANDECK = 706
+    LIENZ = 707
+    REUTTE = 708
+    SCHWAZ = 709
+
+
+class _Vorarlberg(Area):
+    ALL = 8
+    BLUDENZ = 801
+    BREGENZ = 802
+    DORNBIRN = 803
+    FELDKIRCH = 804
+
+
 class AreaId:
-    """AreaId to wrap the area enumerators of different states."""
+    """AreaId to wrap the area enumerators of different states.
+
+    Every state is an enumerator with the whole state as `ALL` and its districts as the other members, e.g.
+    `AreaId.WIEN.LEOPOLDSTADT` or `AreaId.BURGENLAND.ALL`.
+    """
     WIEN = _Wien
     NIEDERÖSTERREICH = _Niederösterreich
-    BURGENLAND = 1
-    KÄRNTEN = 2
-    OBERÖSTERREICH = 4
-    SALZBURG = 5
-    STEIERMARK = 6
-    TIROL = 7
-    VORARLBERG = 8
+    BURGENLAND = _Burgenland
+    KÄRNTEN = _Kärnten
+    OBERÖSTERREICH = _Oberösterreich
+    SALZBURG = _Salzburg
+    STEIERMARK = _Steiermark
+    TIROL = _Tirol
+    VORARLBERG = _Vorarlberg
+
+    @classmethod
+    def states(cls: type[Self]) -> list[Area]:
+        """The `ALL` member of every state."""
+        return [state.ALL for state in vars(cls).values() if isinstance(state, type) and issubclass(state, Area)]
+
+    @classmethod
+    def resolve(cls: type[Self], name: str) -> Area:
+        """Look up an area by its qualified name, e.g. "WIEN.ALL" or "WIEN.LEOPOLDSTADT".
+
+        Args:
+            name (str): The qualified name of the area.
+
+        Raises:
+            ValueError: If there is no such area.
+
+        Returns:
+            Area: The area.
+        """
+        state_name, _, area_name = name.partition(".")
+        state = getattr(cls, state_name, None)
+        if not (isinstance(state, type) and issubclass(state, Area)) or area_name not in state.__members__:
+            msg = f"Unknown area {name!r}, expected e.g. 'WIEN.ALL'"
+            raise ValueError(msg)
+        return state[area_name]
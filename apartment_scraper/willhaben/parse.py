@@ -1,10 +1,10 @@
-import json
 from enum import Enum
 from typing import Any
 
 from loguru import logger
 
 # from apartment_scraper import Apartment
+from apartment_scraper import metrics
 from apartment_scraper.models import Apartment
 
 
@@ -51,6 +51,7 @@ def parse_price_attribute(response: dict[str, Any]) -> float:
     try:
         price = float(get_attribute_with_name(response, "PRICE")[0])
     except Exception:
+        metrics.PARSE_FAILURES.labels(field="PRICE").inc()
         logger.warning(f"Failed to parse the field 'PRICE' for id={response['id']}")
         return 0
     else:
@@ -70,6 +71,7 @@ def parse_url_attribute(response: dict[str, Any]) -> str:
         if url := get_attribute_with_name(response, "SEO_URL")[0]:
             return f"https://www.willhaben.at/iad/{url}"
     except Exception:
+        metrics.PARSE_FAILURES.labels(field="SEO_URL").inc()
         logger.warning(f"Failed to parse the field 'SEO_URL' for id={response['id']}")
         return ""
     else:
@@ -91,6 +93,7 @@ def parser_advertiser_attribute(response: dict[str, Any]) -> str:
     try:
         advertiser = response["advertiserInfo"]["label"] or ""
     except Exception:
+        metrics.PARSE_FAILURES.labels(field="advertiserInfo").inc()
         logger.warning(f"Failed parse AdvertiserInfo for id={response['id']}")
         return ""
     else:
@@ -112,6 +115,7 @@ def parse_post_code_attribute(response: dict[str, Any]) -> int:
     try:
         postcode = int(get_attribute_with_name(response, "POSTCODE")[0])
     except Exception:
+        metrics.PARSE_FAILURES.labels(field="POSTCODE").inc()
         logger.warning(f"Failed to parse the field 'POSTCODE' for id={response['id']}")
         return 0
     else:
@@ -132,6 +136,7 @@ def parse_id_attribute(response: dict[str, Any]) -> int:
     try:
         apartment_id = int(response["id"])
     except Exception:
+        metrics.PARSE_FAILURES.labels(field="ID").inc()
         logger.warning(f"Failed to parse the field 'ID' for id={response['id']}")
         return 0
     else:
@@ -153,6 +158,7 @@ def parse_area_attribute(response: dict[str, Any]) -> int:
     try:
         area = int(get_attribute_with_name(response, "ESTATE_SIZE/LIVING_AREA")[0])
     except Exception:
+        metrics.PARSE_FAILURES.labels(field="ESTATE_SIZE/LIVING_AREA").inc()
         logger.warning(
             f"Failed to parse the field 'ESTATE_SIZE/LIVING_AREA' for id={response['id']}"
         )
@@ -176,6 +182,7 @@ def parse_room_attribute(response: dict[str, Any]) -> float:
     try:
         area: float = float(get_attribute_with_name(response, "NUMBER_OF_ROOMS")[0])
     except Exception:
+        metrics.PARSE_FAILURES.labels(field="NUMBER_OF_ROOMS").inc()
         logger.warning(
             f"Failed to parse the field 'NUMBER_OF_ROOMS' for id={response['id']}"
         )
@@ -200,6 +207,7 @@ def parse_floor_attribute(response: dict[str, Any]) -> float:
         floor: str = get_attribute_with_name(response, "FLOOR")[0]
         return float(floor)
     except Exception:
+        metrics.PARSE_FAILURES.labels(field="FLOOR").inc()
         logger.warning(f"Failed to parse the field 'FLOOR' for id={response['id']}")
         return 0
 
@@ -220,6 +228,7 @@ def parse_rent_attribute(response: dict[str, Any]) -> float:
         rent: str = get_attribute_with_name(response, "RENT/PER_MONTH_LETTINGS")[0]
         return round(float(rent), 2)
     except Exception:
+        metrics.PARSE_FAILURES.labels(field="RENT").inc()
         logger.warning(f"Failed to parse the field 'RENT' for id={response['id']}")
         return 0
 
@@ -239,6 +248,7 @@ def parse_address_attribute(response: dict[str, Any]) -> str:
     try:
         address: str = get_attribute_with_name(response, "ADDRESS")[0]
     except Exception:
+        metrics.PARSE_FAILURES.labels(field="ADDRESS").inc()
         logger.warning(f"Failed to parse the field 'ADDRESS' for id={response['id']}")
         return ""
     return address
@@ -262,11 +272,12 @@ def parse_free_area_attribute(response: dict[str, Any]) -> int:
         )
         return int(free_area[0])
     except Exception:
+        metrics.PARSE_FAILURES.labels(field="FREE_AREA").inc()
         logger.warning(f"Failed to parse the field 'FREE_AREA' for id={response['id']}")
         return 0
 
 
-def parse_free_area_type_name_attribute(response: dict[str, Any]) -> str:
+def parse_free_area_type_name_attribute(response: dict[str, Any]) -> list[str]:
     """Parses the 'FREE_AREA_TYPE_NAME' attribute from a response dictionary and returns it as a list of strings.
 
     Args:
@@ -283,12 +294,13 @@ def parse_free_area_type_name_attribute(response: dict[str, Any]) -> str:
             response, "FREE_AREA_TYPE_NAME"
         )
     except Exception:
+        metrics.PARSE_FAILURES.labels(field="FREE_AREA_TYPE_NAME").inc()
         logger.warning(
             "Failed to parse the field 'FREE_AREA_TYPE_NAME' for "
             f"id={response['id']}"
         )
-        return json.dumps([])
-    return json.dumps(free_area_type)
+        return []
+    return free_area_type
 
 
 def parse_status_attribute(response: dict[str, Any]) -> bool:
@@ -304,7 +316,7 @@ def parse_status_attribute(response: dict[str, Any]) -> bool:
     return active == "active"
 
 
-def parse_image_urls_attribute(response: dict[str, Any]) -> str:
+def parse_image_urls_attribute(response: dict[str, Any]) -> list[str]:
     """Parses the 'ALL_IMAGE_URLS' attribute from a response dictionary and returns a list of formatted URL strings.
 
     Args:
@@ -320,14 +332,15 @@ def parse_image_urls_attribute(response: dict[str, Any]) -> str:
     try:
         urls: str = get_attribute_with_name(response, "ALL_IMAGE_URLS")[0]
         if urls:
-            return json.dumps([f"https://cache.willhaben.at/mmo/{url}" for url in urls.split(";")])
+            return [f"https://cache.willhaben.at/mmo/{url}" for url in urls.split(";")]
         else:
-            return json.dumps([])
+            return []
     except Exception:
+        metrics.PARSE_FAILURES.labels(field="ALL_IMAGE_URLS").inc()
         logger.warning(
             f"Failed to parse the field 'ALL_IMAGE_URLS' for id={response['id']}"
         )
-        return json.dumps([])
+        return []
 
 
 def parse_coordinates_attribute(response: dict[str, Any]) -> str:
@@ -345,6 +358,7 @@ def parse_coordinates_attribute(response: dict[str, Any]) -> str:
     try:
         coordinates: str = get_attribute_with_name(response, "COORDINATES")[0]
     except Exception:
+        metrics.PARSE_FAILURES.labels(field="COORDINATES").inc()
         logger.warning(
             f"Failed to parse the field 'COORDINATES' for id={response['id']}"
         )
@@ -369,6 +383,7 @@ def parse_product_id_attribute(response: dict[str, Any]) -> str:
         return ProductId(int(product_id)).name.lower()
     except ValueError:
         if local_product_id := locals().get("product_id", None):
+            metrics.PARSE_FAILURES.labels(field="PRODUCT_ID").inc()
             logger.warning(
                 f"Failed to convert product_id={local_product_id} to ProductId enum"
             )
@@ -376,6 +391,7 @@ def parse_product_id_attribute(response: dict[str, Any]) -> str:
         else:
             return ""
     except Exception:
+        metrics.PARSE_FAILURES.labels(field="PRODUCT_ID").inc()
         logger.warning(
             f"Failed to parse the field 'PRODUCT_ID' for id={response['id']}"
         )
@@ -397,6 +413,7 @@ def parse_location_attribute(response: dict[str, Any]) -> str:
     try:
         location: str = get_attribute_with_name(response, "LOCATION")[0]
     except Exception:
+        metrics.PARSE_FAILURES.labels(field="LOCATION").inc()
         logger.warning(f"Failed to parse the field 'LOCATION' for id={response['id']}")
         return ""
     else:
@@ -418,6 +435,7 @@ def parse_property_type_attribute(response: dict[str, Any]) -> str:
     try:
         property_type: str = get_attribute_with_name(response, "PROPERTY_TYPE")[0]
     except Exception:
+        metrics.PARSE_FAILURES.labels(field="PROPERTY_TYPE").inc()
         logger.warning(
             f"Failed to parse the field 'PROPERTY_TYPE' for id={response['id']}"
         )
@@ -443,6 +461,7 @@ def calc_rent_per_area(response: dict[str, Any]) -> float:
         area = parse_area_attribute(response)
         rent_per_area = round(float(rent) / float(area), 2)
     except Exception:
+        metrics.PARSE_FAILURES.labels(field="RENT_PER_AREA").inc()
         logger.warning(f"Failed to calculate rent/area for id={response['id']}")
         return 0
     else:
@@ -466,6 +485,7 @@ def calc_price_per_area(response: dict[str, Any]) -> float:
         area = parse_area_attribute(response)
         price_per_area = round(float(rent) / float(area), 2)
     except Exception:
+        metrics.PARSE_FAILURES.labels(field="PRICE_PER_AREA").inc()
         logger.warning(f"Failed to calculate price/area for id={response['id']}")
         return 0
     else:
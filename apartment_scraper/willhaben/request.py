@@ -1,17 +1,30 @@
 import asyncio
-import itertools
-from dataclasses import dataclass
-from enum import Enum
+from collections.abc import Iterable
+from dataclasses import dataclass, field
 from time import perf_counter
 from typing import Any, Self
 
 import httpx
 from loguru import logger
 
-from apartment_scraper.models import Apartment
+from apartment_scraper import metrics, tracing
+from apartment_scraper.id_sets import SeenIds, SortedIds
+from apartment_scraper.models import Apartment, percentile
+from apartment_scraper.willhaben.area_id import Area
 from apartment_scraper.willhaben.parse import parse_apartment
 
 
+BASE_URL = "https://www.willhaben.at/webapi/iad/search/atz/seo/immobilien"
+CATEGORIES = ("miet_wohnung", "kauf_wohnung", "miet_haus", "kauf_haus")
+# Above this number of rows, an area is crawled through its districts, as the search API limits how deep the pagination
+# goes.
+FAN_OUT_ROWS = 5_000
+HEADER = {
+    "accept": "application/json",
+    "x-wh-client": ("api@willhaben.at;responsive_web;server;1.0.0;desktop"),
+}
+
+
 class NoConnectionError(Exception):
     """No connection to the server could be established."""
     pass
@@ -20,6 +33,26 @@ class NoRowsFoundError(Exception):
     """No rows found for the current endpoint. This means that there is no data to be parsed."""
 
 
+@dataclass
+class CrawlStats:
+    """Statistics of a crawl, collected by `get_data` and `get_area_data` for the crawl run ledger."""
+
+    rows_found: int = 0
+    pages_requested: int = 0
+    pages_failed: int = 0
+    parsed: int = 0
+    bytes_transferred: int = 0
+    duplicates: int = 0
+    page_latencies: list[float] = field(default_factory=list)
+    # Adverts that were skipped because an earlier crawl of the same run already returned them.
+    skipped_ids: list[int] = field(default_factory=list)
+
+    @property
+    def p95_page_latency_ms(self: Self) -> float | None:
+        """The 95th percentile of the latency of the page requests in milliseconds."""
+        return percentile(sorted(latency * 1000 for latency in self.page_latencies), 0.95)
+
+
 @dataclass
 class Request:
     """A class to generate urls for willhaben.at.
@@ -27,59 +60,203 @@ class Request:
     As the URL depends on the area_id choosen, the actual urls are generated depending on on the input.
     """
 
-    area_id: Enum
+    area_id: Area
 
     @property
     def miet_wohnung_url(self: Self) -> str:
         """The generated url for rental apartments in the specified area."""
-        return f"https://www.willhaben.at/webapi/iad/search/atz/seo/immobilien/mietwohnungen/{self.area_id.value}"
+        return f"{BASE_URL}/mietwohnungen{self.area_id.url_suffix}"
 
     @property
     def kauf_wohnung_url(self: Self) -> str:
         """The generated url for apartments to buy in the specified area."""
-        return f"https://www.willhaben.at/webapi/iad/search/atz/seo/immobilien/eigentumswohnung/{self.area_id.value}"
+        return f"{BASE_URL}/eigentumswohnung{self.area_id.url_suffix}"
 
     @property
     def miet_haus_url(self: Self) -> str:
         """The generated url for rental houses in the specified area."""
-        return f"https://www.willhaben.at/webapi/iad/search/atz/seo/immobilien/haus-mieten/{self.area_id.value}"
+        return f"{BASE_URL}/haus-mieten{self.area_id.url_suffix}"
 
     @property
     def kauf_haus_url(self: Self) -> str:
         """The generated url for rental houses in the specified area."""
-        return f"https://www.willhaben.at/webapi/iad/search/atz/seo/immobilien/haus-kaufen/{self.area_id.value}"
+        return f"{BASE_URL}/haus-kaufen{self.area_id.url_suffix}"
+
+    def category_url(self: Self, category: str) -> str:
+        """Get the url of a category by its name, one of `CATEGORIES`.
 
+        Raises:
+            ValueError: If the category is unknown.
+        """
+        if category not in CATEGORIES:
+            msg = f"Unknown category {category!r}, choose from {CATEGORIES}"
+            raise ValueError(msg)
+        url: str = getattr(self, f"{category}_url")
+        return url
 
-async def get_apartments(
+
+async def get_apartments(  # noqa: PLR0913
     client: httpx.AsyncClient,
     url: str,
     params: dict[str, Any],
     header: dict[str, Any],
+    stats: CrawlStats | None = None,
+    seen: SeenIds | None = None,
+    fetched: SeenIds | None = None,
 ) -> list[Apartment]:
     """Async function to get apartments from willhaben.at.
 
-    _extended_summary_
+    A page that can't be fetched or decoded is logged and counted as failed in `stats`, instead of failing the whole
+    crawl. Adverts that are in `seen` are skipped before they are parsed, and recorded in `stats.skipped_ids`. Adverts
+    that are in `fetched` are counted in `stats.duplicates`, but still parsed, as this later copy may be the more recent
+    one, see `keep_latest`.
 
     Args:
         client (httpx.AsyncClient): An async httpx client
         url (str): A url to get the data from
         params (dict[str, Any]): Any parameters to pass to the request
         header (dict[str, Any]): Any headers to pass to the request
+        stats (CrawlStats | None, optional): Statistics of the crawl to update. Defaults to None.
+        seen (SeenIds | None, optional): The apartment_ids of earlier crawls of the same run. Defaults to None.
+        fetched (SeenIds | None, optional): The apartment_ids of the adverts on the pages of the same crawl that were
+            fetched before, e.g. a `SortedIds`, as an advert can show up on two pages while the result set shifts. The
+            adverts of this page are added. Defaults to None.
 
     Returns:
-        list[Apartment]: A list of Apartment objects
+        list[Apartment]: A list of Apartment objects, empty if the page failed.
     """
+    stats = stats if stats is not None else CrawlStats()
+    stats.pages_requested += 1
     logger.info(f"Page: {params['page']}")
-    response = await client.get(url=url, params=params, headers=header)
+    with tracing.span("fetch_page", page=params["page"], rows=params["rows"]) as page_span:
+        start_time = perf_counter()
+        try:
+            with metrics.CRAWL_PAGE_DURATION.labels(source="willhaben").time():
+                response = await client.get(
+                    url=url, params=params, headers=header, extensions=tracing.httpx_extensions()
+                )
+        except httpx.HTTPError as e:
+            logger.error(f"Page {params['page']} failed: {e!r}")
+            stats.pages_failed += 1
+            return []
+        stats.page_latencies.append(perf_counter() - start_time)
+        stats.bytes_transferred += response.num_bytes_downloaded
+        metrics.CRAWL_PAGE_RESPONSES.labels(source="willhaben", status=response.status_code).inc()
+        page_span.set_attribute("http.status_code", response.status_code)
+        page_span.set_attribute("http.response_bytes", len(response.content))
+
+        try:
+            response.raise_for_status()
+            with tracing.span("decode_json"):
+                raw_data: dict[str, Any] = response.json()
+            apartment_data: list[dict[str, Any]] = raw_data["advertSummaryList"][
+                "advertSummary"
+            ]
+        except (httpx.HTTPStatusError, ValueError, KeyError) as e:
+            logger.error(f"Page {params['page']} failed: {e!r}")
+            stats.pages_failed += 1
+            return []
+        if seen is not None or fetched is not None:
+            apartment_data = _skip_known_adverts(apartment_data, stats, seen, fetched)
+        with tracing.span("parse_page", adverts=len(apartment_data)), metrics.PARSE_DURATION.labels(
+            source="willhaben"
+        ).time():
+            apartments = [parse_apartment(data) for data in apartment_data]
+        metrics.PARSED_ADVERTS.labels(source="willhaben").inc(len(apartments))
+    stats.parsed += len(apartments)
+    return apartments
+
+
+def _skip_known_adverts(
+    apartment_data: list[dict[str, Any]], stats: CrawlStats, seen: SeenIds | None, fetched: SeenIds | None
+) -> list[dict[str, Any]]:
+    """Drop the raw adverts that were seen by an earlier crawl before parsing them, and count the ones fetched twice."""
+    new_data = []
+    for data in apartment_data:
+        advert_id = _advert_id(data)
+        if advert_id is not None and seen is not None and advert_id in seen:
+            stats.skipped_ids.append(advert_id)
+            continue
+        if advert_id is not None and fetched is not None:
+            if advert_id in fetched:
+                stats.duplicates += 1
+            else:
+                fetched.add(advert_id)
+        new_data.append(data)
+    if len(new_data) < len(apartment_data):
+        logger.info(f"Skipped {len(apartment_data) - len(new_data)} known adverts")
+    return new_data
+
+
+def _advert_id(data: dict[str, Any]) -> int | None:
+    """Get the id of a raw advert without parsing the advert, or None if it is invalid."""
+    try:
+        return int(data["id"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def keep_latest(pages: Iterable[list[Apartment]]) -> list[Apartment]:
+    """Merge the pages of a crawl, keeping only the latest copy of an apartment that shows up on more than one page.
+
+    An advert moves to another page while the pages are fetched when the result set shifts, e.g. because the advert was
+    edited and bumped. So the copy fetched later is the more recent one.
+
+    Args:
+        pages (Iterable[list[Apartment]]): The parsed pages, in the order they were fetched.
+
+    Returns:
+        list[Apartment]: The apartments, each once, in the order they were first fetched.
+    """
+    latest = {apartment.apartment_id: apartment for page in pages for apartment in page}
+    return list(latest.values())
+
+
+async def get_rows_found(client: httpx.AsyncClient, url: str, stats: CrawlStats | None = None) -> int:
+    """Get the number of rows found for an endpoint, requesting a single row to minimize the transferred data.
+
+    Args:
+        client (httpx.AsyncClient): An async httpx client.
+        url (str): A url to an endpoint.
+        stats (CrawlStats | None, optional): Statistics of the crawl to update. Defaults to None.
+
+    Raises:
+        NoConnectionError: If the request fails, returns an error status or a body that isn't a search result.
+
+    Returns:
+        int: The number of rows found, 0 if there are none.
+    """
+    stats = stats if stats is not None else CrawlStats()
+    with tracing.span("count_rows", url=url) as count_span:
+        try:
+            response = await client.get(
+                url,
+                params={"rows": 1, "page": 1},
+                headers=HEADER,
+                timeout=60,
+                extensions=tracing.httpx_extensions(),
+            )
+        except httpx.HTTPError as e:
+            logger.error(e)
+            raise NoConnectionError from e
 
-    raw_data: dict[str, Any] = response.json()
-    apartment_data: list[dict[str, Any]] = raw_data["advertSummaryList"][
-        "advertSummary"
-    ]
-    return [parse_apartment(data) for data in apartment_data]
+        stats.bytes_transferred += response.num_bytes_downloaded
+        count_span.set_attribute("http.status_code", response.status_code)
+        try:
+            response.raise_for_status()
+            response_json: dict[str, Any] = response.json()
+            rows_found: int = int(response_json.get("rowsFound") or 0)
+        except (httpx.HTTPStatusError, ValueError, TypeError, AttributeError) as e:
+            logger.error(f"Counting the rows of {url} failed: {e!r}")
+            raise NoConnectionError from e
+        count_span.set_attribute("rows_found", rows_found)
+    logger.info(f"Rows found: {rows_found}")
+    return rows_found
 
 
-async def get_data(url: str, rows_per_request: int = 200) -> list[Apartment]:
+async def get_data(
+    url: str, rows_per_request: int = 200, stats: CrawlStats | None = None, seen: SeenIds | None = None
+) -> list[Apartment]:
     """Get apartments from willhaben.at.
 
     The function will first get the number of rows found for the specified endpoint. It is using 1 row and 1 page to
@@ -87,64 +264,153 @@ async def get_data(url: str, rows_per_request: int = 200) -> list[Apartment]:
     data. It is adding 1 if the result is not even, as for example 710 needs 8 pages, not 7.
 
     After that it will create a list of tasks to get the data from the specified endpoint, one for each page. The tasks
-    will be executed with asyncio.gather all data.
+    are executed concurrently and their pages are collected as they complete.
 
-    Each task  will return a list of Apartment objects, which means that the result of asyncio.gather will be a list of
-    lists of Apartment objects. To flatten the list of lists, itertools.chain is used.
+    As the result set keeps shifting while the pages are fetched, an advert can show up on two pages. The copy of the
+    page that completed last is kept, see `keep_latest`, and the others are counted in `stats.duplicates`. The
+    apartment_ids of the result are added to `seen`, so later crawls of the same run can skip
+    them.
 
     Args:
         url (str): A url to an endpoint where to get the data from.
         rows_per_request (int, optional): The number of rows per request. Defaults to 200.
+        stats (CrawlStats | None, optional): Collects the statistics of the crawl, e.g. for the crawl run ledger.
+            Defaults to None.
+        seen (SeenIds | None, optional): The apartment_ids of earlier crawls of the same run, which are skipped.
+            Defaults to None.
 
     Raises:
-        ValueError: If not rows are found for the current endpoint.
+        NoRowsFoundError: If not rows are found for the current endpoint.
 
     Returns:
         list[Apartment]: A list of Apartment objects.
     """
-    header = {
-        "accept": "application/json",
-        "x-wh-client": ("api@willhaben.at;responsive_web;server;1.0.0;desktop"),
-    }
+    stats = stats if stats is not None else CrawlStats()
 
     async with httpx.AsyncClient(http2=True) as client:
-        try:
-            response = await client.get(
-                url,
-                params={"rows": 1, "page": 1},
-                headers=header,
-                timeout=60,
-            )
-        except httpx.HTTPError as e:
-            logger.error(e)
-            raise NoConnectionError from e
+        rows_found = await get_rows_found(client, url, stats)
+        stats.rows_found = rows_found
+        if not rows_found:
+            raise NoRowsFoundError()
+        crawl = _Crawl(client, rows_per_request, FAN_OUT_ROWS, stats, seen)
+        await crawl.get_pages(url, rows_found)
+    return crawl.result()
+
+
+async def get_area_data(  # noqa: PLR0913
+    area: Area,
+    category: str,
+    rows_per_request: int = 200,
+    fan_out_rows: int = FAN_OUT_ROWS,
+    stats: CrawlStats | None = None,
+    seen: SeenIds | None = None,
+) -> list[Apartment]:
+    """Get the apartments of a category in an area, splitting the search into districts if it's too large.
 
-        response_json: dict[str, Any] = response.json()
-        rows_found = response_json.get("rowsFound")
-        logger.info(f"Rows found: {rows_found}")
+    The search API limits how deep the pagination goes, so an area with more than `fan_out_rows` rows is crawled
+    through its districts instead, in parallel. Listings are deduplicated like in `get_data`, also when they show up in
+    more than one district.
+
+    Args:
+        area (Area): The area, e.g. `AreaId.WIEN.ALL`.
+        category (str): The category, one of `CATEGORIES`.
+        rows_per_request (int, optional): The number of rows per request. Defaults to 200.
+        fan_out_rows (int, optional): The number of rows above which an area is split into its districts. Defaults
+            to FAN_OUT_ROWS.
+        stats (CrawlStats | None, optional): Collects the statistics of the crawl. Defaults to None.
+        seen (SeenIds | None, optional): The apartment_ids of earlier crawls of the same run, which are skipped.
+            Defaults to None.
+
+    Raises:
+        NoRowsFoundError: If no rows are found for the area.
+
+    Returns:
+        list[Apartment]: A list of Apartment objects.
+    """
+    stats = stats if stats is not None else CrawlStats()
+    url = Request(area_id=area).category_url(category)
+
+    async with httpx.AsyncClient(http2=True) as client:
+        rows_found = await get_rows_found(client, url, stats)
+        stats.rows_found = rows_found
         if not rows_found:
             raise NoRowsFoundError()
+        crawl = _Crawl(client, rows_per_request, fan_out_rows, stats, seen)
+        await crawl.get_area_pages(area, category, rows_found)
+    return crawl.result()
 
-        required_pages = rows_found // rows_per_request
-        if rows_found % rows_per_request != 0:
+
+@dataclass
+class _Crawl:
+    """The settings and state shared by the requests of a crawl."""
+
+    client: httpx.AsyncClient
+    rows_per_request: int
+    fan_out_rows: int
+    stats: CrawlStats
+    seen: SeenIds | None
+    fetched: SortedIds = field(default_factory=SortedIds)
+    # The parsed pages in the order they completed.
+    pages: list[list[Apartment]] = field(default_factory=list)
+
+    def result(self: Self) -> list[Apartment]:
+        """Get the latest copy of each fetched apartment, and add their apartment_ids to the ids seen by the run."""
+        apartments = keep_latest(self.pages)
+        if self.seen is not None:
+            for apartment in apartments:
+                self.seen.add(apartment.apartment_id)
+        return apartments
+
+    async def get_area_pages(self: Self, area: Area, category: str, rows_found: int) -> None:
+        """Get the pages of an area whose rows are already counted, or of its districts if there are too many rows."""
+        url = Request(area_id=area).category_url(category)
+        if rows_found <= self.fan_out_rows or not area.children:
+            if rows_found > self.fan_out_rows:
+                logger.warning(f"{area.qualified_name} has {rows_found} rows, but no districts to split it into")
+            await self.get_pages(url, rows_found)
+            return
+
+        logger.info(f"Splitting {area.qualified_name} with {rows_found} rows into {len(area.children)} districts")
+        with tracing.span("fan_out", area=area.qualified_name, districts=len(area.children)):
+            await asyncio.gather(*(self.get_district_pages(district, category) for district in area.children))
+
+    async def get_district_pages(self: Self, district: Area, category: str) -> None:
+        """Count the rows of a district and get its pages. A district that can't be counted counts as a failed page."""
+        url = Request(area_id=district).category_url(category)
+        try:
+            rows_found = await get_rows_found(self.client, url, self.stats)
+        except NoConnectionError:
+            self.stats.pages_failed += 1
+            return
+        if rows_found:
+            await self.get_area_pages(district, category, rows_found)
+
+    async def get_pages(self: Self, url: str, rows_found: int) -> None:
+        """Get all pages of an endpoint whose rows are already counted, concurrently, and add them to `pages`."""
+        required_pages = rows_found // self.rows_per_request
+        if rows_found % self.rows_per_request != 0:
             required_pages += 1
 
-        tasks: list[asyncio.Task[Any]] = []
         start_time = perf_counter()
-        tasks.extend(
-            asyncio.create_task(
+        with tracing.span("fetch_pages", url=url, pages=required_pages) as pages_span:
+            tasks = [
                 get_apartments(
-                    client=client,
+                    client=self.client,
                     url=url,
                     params={
-                        "rows": rows_per_request,
+                        "rows": self.rows_per_request,
                         "page": page,
                     },
-                    header=header,
+                    header=HEADER,
+                    stats=self.stats,
+                    seen=self.seen,
+                    fetched=self.fetched,
                 )
-            )
-            for page in range(1, required_pages + 1)
-        )
-        data: list[list[Apartment]] = await asyncio.gather(*tasks)
+                for page in range(1, required_pages + 1)
+            ]
+            apartments = 0
+            for page in asyncio.as_completed(tasks):
+                self.pages.append(await page)
+                apartments += len(self.pages[-1])
+            pages_span.set_attribute("apartments", apartments)
         logger.info(f"Time with tasks: {perf_counter() - start_time}")
-        return list(itertools.chain(*data))
@@ -0,0 +1,234 @@
+import asyncio
+import contextlib
+import os
+import random
+import secrets
+import signal
+import socket
+from datetime import datetime
+from typing import Self
+from zoneinfo import ZoneInfo
+
+import httpx
+from loguru import logger
+
+from apartment_scraper import matching, scoring, tracing, willhaben
+from apartment_scraper.id_sets import SortedIds
+from apartment_scraper.models import CrawlRun, CrawlTask, Model
+from apartment_scraper.willhaben.area_id import Area
+from apartment_scraper.willhaben.request import FAN_OUT_ROWS, HEADER, get_apartments, get_rows_found, keep_latest
+
+
+PAGES_PER_TASK = 5
+
+
+async def enqueue_crawl(  # noqa: PLR0913
+    model: Model,
+    area: Area,
+    category: str,
+    source: str = "willhaben",
+    priority: int = 0,
+    rows_per_page: int = 200,
+    pages_per_task: int = PAGES_PER_TASK,
+) -> int:
+    """Split the crawl of a category of an area into tasks of a few pages each and add them to the crawl work queue.
+
+    Like `willhaben.get_area_data`, an area with too many rows is split into its districts. Nothing is added for a url
+    while its tasks are still pending or running, so a crawl that is planned periodically doesn't pile up when the
+    workers fall behind. The tasks of a url share a run in the crawl run ledger, which the worker finishing the last of
+    them closes, see `Model.close_crawl_run`.
+
+    Args:
+        model (Model): The database model.
+        area (Area): The area, e.g. `willhaben.AreaId.WIEN.ALL`.
+        category (str): The category, one of `willhaben.CATEGORIES`.
+        source (str, optional): The site that is crawled. Defaults to "willhaben".
+        priority (int, optional): Tasks with a lower priority are claimed first. Defaults to 0.
+        rows_per_page (int, optional): The number of rows per request. Defaults to 200.
+        pages_per_task (int, optional): The number of pages per task. Defaults to PAGES_PER_TASK.
+
+    Returns:
+        int: The number of added tasks.
+    """
+    url = willhaben.Request(area_id=area).category_url(category)
+    if open_tasks := await asyncio.to_thread(model.count_open_crawl_tasks, url):
+        logger.info(f"Not enqueuing {url}, {open_tasks} tasks are still open")
+        return 0
+
+    async with httpx.AsyncClient(http2=True) as client:
+        rows_found = await get_rows_found(client, url)
+    if rows_found > FAN_OUT_ROWS and area.children:
+        counts = [
+            await enqueue_crawl(model, district, category, source, priority, rows_per_page, pages_per_task)
+            for district in area.children
+        ]
+        return sum(counts)
+
+    pages = -(-rows_found // rows_per_page)
+    tasks = [
+        CrawlTask(
+            source=source,
+            area=area.qualified_name,
+            url=url,
+            first_page=first_page,
+            last_page=min(first_page + pages_per_task - 1, pages),
+            rows_per_page=rows_per_page,
+            priority=priority,
+        )
+        for first_page in range(1, pages + 1, pages_per_task)
+    ]
+    started = datetime.now(tz=ZoneInfo("UTC"))
+    run = CrawlRun(source=source, area=area.qualified_name, url=url, started=started, rows_found=rows_found)
+    count = await asyncio.to_thread(model.enqueue_crawl_tasks, tasks, run)
+    logger.info(f"Enqueued {count} tasks for {pages} pages of {url}")
+    return count
+
+
+class Worker:
+    """A stateless worker that claims tasks from the crawl work queue and crawls their pages.
+
+    Any number of workers, on any number of nodes, can share the queue in the database. While a worker crawls a task it
+    extends the lease of the task periodically. If the worker dies, the lease expires and another worker claims the task
+    again. If the worker loses the lease, it abandons the task. Storing the apartments is idempotent, so a task that is
+    crawled twice does no harm. The worker that finishes the last task of a crawl closes its run in the crawl run
+    ledger, which marks the apartments the crawl didn't find anymore as gone.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self: Self,
+        model: Model,
+        concurrency: int = 1,
+        lease_seconds: float = 120,
+        poll_interval: float = 5,
+        max_attempts: int = 3,
+    ) -> None:
+        """Initialize the worker.
+
+        Args:
+            model (Model): The database model.
+            concurrency (int, optional): The number of tasks crawled at the same time. Defaults to 1.
+            lease_seconds (float, optional): The lease of a claimed task. It is extended every third of it. Defaults
+                to 120.
+            poll_interval (float, optional): Seconds to wait before polling again when the queue is empty. Defaults
+                to 5.
+            max_attempts (int, optional): The max number of attempts per task. Defaults to 3.
+        """
+        self.model = model
+        self.concurrency = concurrency
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{secrets.token_hex(3)}"
+        self._stop = asyncio.Event()
+
+    def stop(self: Self) -> None:
+        """Stop claiming tasks. `run` returns once the running tasks are finished."""
+        logger.info(f"Stopping worker {self.worker_id}")
+        self._stop.set()
+
+    async def run(self: Self) -> None:
+        """Work on the queue until `stop` is called or the process receives SIGINT or SIGTERM."""
+        loop = asyncio.get_running_loop()
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signal_number, self.stop)
+        logger.info(f"Worker {self.worker_id} started")
+
+        async with httpx.AsyncClient(http2=True) as client:
+            await asyncio.gather(*(self._work(client) for _ in range(self.concurrency)))
+
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            loop.remove_signal_handler(signal_number)
+
+    async def _work(self: Self, client: httpx.AsyncClient) -> None:
+        """Claim and crawl tasks one after another, until stopped."""
+        while not self._stop.is_set():
+            task = await asyncio.to_thread(
+                self.model.claim_crawl_task, self.worker_id, self.lease_seconds, self.max_attempts
+            )
+            if task is None:
+                poll_interval = self.poll_interval * random.uniform(0.5, 1.5)  # noqa: S311
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._stop.wait(), timeout=poll_interval)
+                continue
+            await self._run_task(client, task)
+
+    async def _run_task(self: Self, client: httpx.AsyncClient, task: CrawlTask) -> None:
+        """Crawl the pages of a task while extending its lease, store the apartments and finish the task."""
+        logger.info(f"Crawling pages {task.first_page}-{task.last_page} of {task.url} (task {task.id})")
+        crawl = asyncio.create_task(self._crawl(client, task))
+        while True:
+            done, _ = await asyncio.wait({crawl}, timeout=self.lease_seconds / 3)
+            if done:
+                break
+            if not await asyncio.to_thread(
+                self.model.extend_crawl_task_lease, task.id, self.worker_id, self.lease_seconds
+            ):
+                logger.warning(f"Lost the lease of task {task.id}, abandoning it")
+                crawl.cancel()
+                with contextlib.suppress(asyncio.CancelledError):
+                    await crawl
+                return
+
+        error = None
+        try:
+            crawl.result()
+        except willhaben.NoConnectionError as e:
+            logger.warning(f"Crawl task {task.id} failed: {e}")
+            error = repr(e)
+        except Exception as e:
+            logger.exception(f"Crawl task {task.id} failed")
+            error = repr(e)
+        if not await asyncio.to_thread(
+            self.model.finish_crawl_task, task, self.worker_id, error=error, max_attempts=self.max_attempts
+        ):
+            logger.warning(f"Lost the lease of task {task.id} before it finished")
+        elif task.run_id is not None and (run := await asyncio.to_thread(self.model.close_crawl_run, task.run_id)):
+            logger.info(
+                f"Crawled {run.url}: {run.parsed} parsed, {run.inserted} inserted, {run.updated} updated, "
+                f"{run.gone} gone, {run.pages_failed}/{run.pages_requested} pages failed"
+            )
+        await asyncio.to_thread(tracing.flush)
+
+    async def _crawl(self: Self, client: httpx.AsyncClient, task: CrawlTask) -> None:
+        """Fetch the pages of a task and store the apartments.
+
+        Raises:
+            willhaben.NoConnectionError: If any page failed, so the task is retried.
+        """
+        stats = willhaben.CrawlStats()
+        fetched = SortedIds()
+        with tracing.span("crawl_task", url=task.url, first_page=task.first_page, last_page=task.last_page):
+            requests = [
+                get_apartments(
+                    client=client,
+                    url=task.url,
+                    params={"rows": task.rows_per_page, "page": page},
+                    header=HEADER,
+                    stats=stats,
+                    fetched=fetched,
+                )
+                for page in range(task.first_page, task.last_page + 1)
+            ]
+            pages = [await page for page in asyncio.as_completed(requests)]
+            if stats.pages_failed:
+                msg = f"{stats.pages_failed} of {stats.pages_requested} pages failed"
+                raise willhaben.NoConnectionError(msg)
+
+            # An advert that moved between pages while they were fetched is kept from the page that completed last.
+            apartments = keep_latest(pages)
+            for apartment in apartments:
+                apartment.scope = task.url
+            result = await asyncio.to_thread(self.model.upsert_apartments, apartments)
+            await asyncio.to_thread(
+                scoring.score_deals, self.model, [apartment.apartment_id for apartment in apartments]
+            )
+            inserted = set(result.inserted_ids)
+            await asyncio.to_thread(
+                matching.notify_matches,
+                self.model,
+                [apartment for apartment in apartments if apartment.apartment_id in inserted],
+            )
+        task.parsed = stats.parsed
+        task.inserted = len(result.inserted_ids)
+        task.updated = result.updated_count
+        task.apartment_ids = [apartment.apartment_id for apartment in apartments]
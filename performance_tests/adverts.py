@@ -0,0 +1,104 @@
+"""Deterministic synthetic adverts in the shape of the willhaben search API.
+
+Each advert has the fields `parse_apartment` reads, in `attributes.attribute` as a list of name/values pairs, between the
+other attributes willhaben sends along, so the linear attribute lookups of the parser see a realistic list. The same
+index and seed always give the same advert.
+
+Usage:
+    from performance_tests.adverts import make_adverts
+
+    adverts = make_adverts(10_000)
+"""
+import random
+from typing import Any
+
+
+FIRST_ID = 600_000_000  # id of the advert with index 0
+POST_CODES = list(range(1010, 1240, 10))
+STREETS = ["Praterstraße", "Taborstraße", "Landstraßer Hauptstraße", "Währinger Straße", "Mariahilfer Straße"]
+FREE_AREA_TYPES = ["Balkon", "Terrasse", "Garten", "Loggia", "Dachterrasse"]
+PRODUCT_IDS = ["223", "270", "227"]  # eigentum, project and rental, see ProductId
+
+
+def make_advert(index: int, rng: random.Random) -> dict[str, Any]:
+    """Create a random advert.
+
+    Args:
+        index (int): The index of the advert, which makes its id unique.
+        rng (random.Random): The random generator.
+
+    Returns:
+        dict[str, Any]: The advert, like an entry of `advertSummaryList.advertSummary`.
+    """
+    advert_id = FIRST_ID + index
+    area = rng.randint(30, 150)
+    post_code = rng.choice(POST_CODES)
+    attributes = {
+        "HEADING": [f"Schöne {rng.randint(1, 5)}-Zimmer Wohnung mit Freifläche"],
+        "BODY_DYN": ["Helle Wohnung in ruhiger Lage, nahe öffentlicher Verkehrsmittel. " * rng.randint(1, 4)],
+        "STATE": ["Wien"],
+        "DISTRICT": [f"Wien, {(post_code - 1000) // 10:02d}. Bezirk"],
+        "LOCATION": [f"Wien, {(post_code - 1000) // 10:02d}. Bezirk"],
+        "POSTCODE": [str(post_code)],
+        "ADDRESS": [f"{rng.choice(STREETS)} {rng.randint(1, 200)}"],
+        "COORDINATES": [f"{48.2 + rng.uniform(-0.1, 0.1):.6f},{16.37 + rng.uniform(-0.15, 0.15):.6f}"],
+        "PROPERTY_TYPE": [rng.choice(["Wohnung", "Dachgeschoßwohnung", "Maisonette"])],
+        "PRODUCT_ID": [rng.choices(PRODUCT_IDS, weights=[8, 1, 1])[0]],
+        "ESTATE_SIZE/LIVING_AREA": [str(area)],
+        "NUMBER_OF_ROOMS": [str(rng.randint(1, 6))],
+        "FLOOR": [str(rng.randint(0, 8))],
+        "PRICE": [str(rng.randint(150, 900) * 1_000)],
+        "PRICE_FOR_DISPLAY": ["€ 0"],
+        "FREE_AREA/FREE_AREA_AREA_TOTAL": [str(rng.randint(0, 40))],
+        "FREE_AREA_TYPE_NAME": rng.sample(FREE_AREA_TYPES, k=rng.randint(0, 2)),
+        "ALL_IMAGE_URLS": [";".join(f"{index % 100}/{advert_id}_{image}.jpg" for image in range(rng.randint(5, 30)))],
+        "MMO": [f"{index % 100}/{advert_id}_0.jpg"],
+        "SEO_URL": [f"immobilien/d/eigentumswohnung/wien/wien-{post_code}/wohnung-{advert_id}/"],
+        "ISPRIVATE": [str(rng.randint(0, 1))],
+        "PUBLISHED": [str(1_695_000_000_000 + index * 1_000)],
+        "PUBLISHED_String": ["2023-09-18T10:00:00Z"],
+        "UNIT_TITLE": [""],
+        "IS_BUMPED": ["0"],
+    }
+    return {
+        "id": str(advert_id),
+        "verticalId": 2,
+        "adTypeId": 2,
+        "productId": 223,
+        "description": attributes["HEADING"][0],
+        "attributes": {"attribute": [{"name": name, "values": values} for name, values in attributes.items()]},
+        "advertStatus": {"id": "active", "description": "Aktiv", "statusId": 50},
+        "advertiserInfo": {"label": rng.choice(["Immobilien GmbH", "Privat", "Makler & Partner"])},
+    }
+
+
+def make_adverts(count: int, seed: int = 42, offset: int = 0) -> list[dict[str, Any]]:
+    """Create `count` adverts, the same ones for the same arguments.
+
+    Args:
+        count (int): The number of adverts.
+        seed (int, optional): The seed of the random generator. Defaults to 42.
+        offset (int, optional): The index of the first advert, to create adverts with other ids. Defaults to 0.
+
+    Returns:
+        list[dict[str, Any]]: The adverts.
+    """
+    rng = random.Random(seed)
+    return [make_advert(offset + index, rng) for index in range(count)]
+
+
+def make_search_response(adverts: list[dict[str, Any]], rows_found: int | None = None) -> dict[str, Any]:
+    """Wrap adverts in a response of the search API, as returned for one page.
+
+    Args:
+        adverts (list[dict[str, Any]]): The adverts of the page.
+        rows_found (int | None, optional): The total number of adverts of the search. Defaults to len(adverts).
+
+    Returns:
+        dict[str, Any]: The response.
+    """
+    return {
+        "rowsFound": len(adverts) if rows_found is None else rows_found,
+        "rowsReturned": len(adverts),
+        "advertSummaryList": {"advertSummary": adverts},
+    }
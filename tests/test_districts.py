@@ -0,0 +1,84 @@
+import itertools
+import math
+
+import numpy as np
+
+from apartment_scraper.districts import CHUNK_SIZE, DistrictIndex
+
+
+def star(lon: float, lat: float, radius: float, points: int = 7) -> list[list[float]]:
+    """A closed, concave ring around a center, with alternating long and short spikes."""
+    ring = []
+    for index in range(2 * points):
+        angle = math.pi * index / points
+        length = radius if index % 2 == 0 else radius / 2
+        ring.append([lon + length * math.cos(angle), lat + length * math.sin(angle)])
+    return [*ring, ring[0]]
+
+
+def square(lon: float, lat: float, size: float) -> list[list[float]]:
+    """A closed square ring with its lower left corner at the given point."""
+    return [[lon, lat], [lon + size, lat], [lon + size, lat + size], [lon, lat + size], [lon, lat]]
+
+
+GEOJSON = {
+    "type": "FeatureCollection",
+    "features": [
+        {
+            "properties": {"iso": 90101, "name": "Star with a hole"},
+            "geometry": {"type": "Polygon", "coordinates": [star(16.36, 48.2, 0.03), square(16.355, 48.195, 0.01)]},
+        },
+        {
+            "properties": {"iso": 90102, "name": "Two stars"},
+            "geometry": {
+                "type": "MultiPolygon",
+                "coordinates": [[star(16.42, 48.22, 0.025, 5)], [star(16.45, 48.17, 0.02, 9)]],
+            },
+        },
+        {
+            "properties": {"iso": 90103, "name": "Overlapping square"},
+            "geometry": {"type": "Polygon", "coordinates": [square(16.38, 48.18, 0.04)]},
+        },
+    ],
+}
+
+
+def ring_contains(ring: list[list[float]], lon: float, lat: float) -> bool:
+    """Test whether a point is inside a ring, by walking its edges one by one."""
+    inside = False
+    for (x0, y0), (x1, y1) in itertools.pairwise(ring):
+        if (y0 > lat) != (y1 > lat) and lon < x0 + (lat - y0) * (x1 - x0) / (y1 - y0):
+            inside = not inside
+    return inside
+
+
+def reference_assign(lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    """Find the first district of each point whose rings contain it an odd number of times."""
+    result = np.zeros(len(lats), dtype=np.int32)
+    for position, (lat, lon) in enumerate(zip(lats, lons, strict=True)):
+        for feature in GEOJSON["features"]:
+            geometry = feature["geometry"]
+            polygons = [geometry["coordinates"]] if geometry["type"] == "Polygon" else geometry["coordinates"]
+            if sum(ring_contains(ring, lon, lat) for polygon in polygons for ring in polygon) % 2:
+                result[position] = feature["properties"]["iso"]
+                break
+    return result
+
+
+def test_assign_matches_reference() -> None:
+    """Vectorized ray casting assigns the same district as testing each point against each ring in turn."""
+    rng = np.random.default_rng(1)
+    count = 2 * CHUNK_SIZE + 100
+    lats = rng.uniform(48.14, 48.25, count)
+    lons = rng.uniform(16.32, 16.48, count)
+
+    result = DistrictIndex(GEOJSON).assign(lats, lons)
+
+    assert set(np.unique(result)) == {0, 90101, 90102, 90103}
+    np.testing.assert_array_equal(result, reference_assign(lats, lons))
+
+
+def test_hole_is_outside() -> None:
+    """A point in the hole of a district doesn't belong to it."""
+    result = DistrictIndex(GEOJSON).assign(np.array([48.2, 48.2]), np.array([16.36, 16.3501]))
+    assert result.tolist() == [0, 90101]
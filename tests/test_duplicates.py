@@ -0,0 +1,133 @@
+import itertools
+import math
+import random
+
+import pytest
+
+from apartment_scraper import text
+from apartment_scraper.duplicates import AREA_BUCKET, CELL_DEGREES, MATCH_SCORE, Listing, find_clusters, score
+
+
+def listing(id_: int = 1, **fields: object) -> Listing:
+    """A listing in the 2nd district, with the given fields changed."""
+    defaults = Listing(
+        id=id_,
+        post_code=1020,
+        area=70,
+        lat=48.2167,
+        lon=16.3958,
+        price=350_000,
+        rooms=3,
+        floor=2,
+        address=frozenset(text.normalize("Praterstraße 12").split()),
+        cluster_id=None,
+    )
+    return defaults._replace(**fields)
+
+
+def test_same_apartment_matches() -> None:
+    """Two listings with the same fields are the same apartment."""
+    assert score(listing(1), listing(2)) == pytest.approx(1)
+
+
+@pytest.mark.parametrize(("first", "second"), [(2, 5), (1, 3), (4, 10)])
+def test_floor_mismatch_never_matches(first: float, second: float) -> None:
+    """Listings on different known floors are different apartments, however similar the rest is."""
+    assert score(listing(1, floor=first), listing(2, floor=second)) == 0
+
+
+def test_ground_floor_does_not_veto() -> None:
+    """The ground floor is also the fallback for a missing floor, so it only lowers the score."""
+    assert MATCH_SCORE <= score(listing(1, floor=0), listing(2, floor=5)) < 1
+
+
+def test_area_mismatch_never_matches() -> None:
+    """Listings whose areas differ by more than the area bucket are different apartments."""
+    assert score(listing(1, area=70), listing(2, area=80)) == 0
+
+
+def test_floor_mismatch_is_not_clustered() -> None:
+    """Two listings of the same block on different floors end up in no cluster."""
+    assert find_clusters([listing(1, floor=2), listing(2, floor=5)]) == {}
+
+
+def test_duplicates_are_clustered_by_smallest_id() -> None:
+    """Listings of the same apartment share the smallest id of their members as cluster."""
+    listings = [listing(3), listing(1, price=355_000), listing(2, floor=5)]
+    assert find_clusters(listings) == {1: 1, 3: 1}
+
+
+def random_listings(rng: random.Random, count: int) -> list[Listing]:
+    """Apartments with one to three listings each, of slightly different prices, areas, floors and coordinates."""
+    listings: list[Listing] = []
+    streets = ["Praterstraße", "Taborstraße", "Lassallestraße"]
+    while len(listings) < count:
+        apartment = listing(
+            post_code=rng.choice([1020, 1030]),
+            area=rng.randint(40, 60),
+            lat=48.2 + rng.randint(0, 5) * CELL_DEGREES / 2,
+            lon=16.4 + rng.randint(0, 5) * CELL_DEGREES / 2,
+            price=rng.randint(30, 40) * 10_000,
+            rooms=rng.randint(2, 3),
+            floor=rng.randint(0, 3),
+            address=frozenset(text.normalize(f"{rng.choice(streets)} {rng.randint(1, 3)}").split()),
+        )
+        for _ in range(rng.randint(1, 3)):
+            jitter = rng.uniform(-CELL_DEGREES, CELL_DEGREES)
+            coordinates = (apartment.lat + jitter, apartment.lon - jitter)
+            if rng.random() < 0.1:  # noqa: PLR2004
+                coordinates = (None, None)
+            listings.append(
+                apartment._replace(
+                    id=len(listings) + 1,
+                    area=apartment.area + rng.randint(-1, 1),
+                    price=apartment.price * rng.uniform(0.97, 1.03),
+                    floor=rng.choice([apartment.floor, 0]),
+                    lat=coordinates[0],
+                    lon=coordinates[1],
+                )
+            )
+    rng.shuffle(listings)
+    return listings
+
+
+def comparable(first: Listing, second: Listing) -> bool:
+    """Whether the blocking compares two listings: same post code, neighbouring area buckets and coordinate cells."""
+    if first.post_code != second.post_code or abs(first.area // AREA_BUCKET - second.area // AREA_BUCKET) > 1:
+        return False
+    if first.lat is None or second.lat is None:
+        return first.lat is None and second.lat is None
+    return all(
+        abs(math.floor(a / CELL_DEGREES) - math.floor(b / CELL_DEGREES)) <= 1
+        for a, b in ((first.lat, second.lat), (first.lon, second.lon))
+    )
+
+
+def reference_clusters(listings: list[Listing]) -> dict[int, int]:
+    """Score all pairs of listings and join the matching ones into connected components."""
+    neighbours: dict[int, set[int]] = {}
+    for first, second in itertools.combinations(listings, 2):
+        if comparable(first, second) and score(first, second) >= MATCH_SCORE:
+            neighbours.setdefault(first.id, set()).add(second.id)
+            neighbours.setdefault(second.id, set()).add(first.id)
+
+    clusters = {}
+    for start in neighbours:
+        if start in clusters:
+            continue
+        component, stack = {start}, [start]
+        while stack:
+            for other in neighbours[stack.pop()] - component:
+                component.add(other)
+                stack.append(other)
+        clusters.update(dict.fromkeys(component, min(component)))
+    return clusters
+
+
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_blocking_matches_all_pairs(seed: int) -> None:
+    """Blocking finds the same clusters as scoring every pair of listings."""
+    listings = random_listings(random.Random(seed), 600)
+    expected = reference_clusters(listings)
+    assert len(expected) > 100  # noqa: PLR2004
+    assert find_clusters(listings) == expected
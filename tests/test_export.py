@@ -0,0 +1,29 @@
+from pathlib import Path
+
+import pyarrow.parquet as pq
+
+from apartment_scraper import export
+from apartment_scraper.models import Model
+from apartment_scraper.willhaben.parse import parse_apartment
+from performance_tests.adverts import make_adverts
+
+
+def test_gone_apartments_are_left_out(tmp_path: Path) -> None:
+    """Only listed apartments are exported, unless the gone ones are asked for too."""
+    model = Model(f"sqlite:///{tmp_path / 'apartments.db'}")
+    apartments = [parse_apartment(advert) for advert in make_adverts(10)]
+    for apartment in apartments:
+        apartment.scope = "scope"
+    model.upsert_apartments(apartments)
+    listed = {apartment.apartment_id for apartment in apartments[:6]}
+    model.mark_gone_apartments("scope", listed)
+
+    assert export.write_parquet(model, tmp_path / "listed.parquet") == len(listed)
+    table = pq.read_table(tmp_path / "listed.parquet")
+    assert set(table.column("apartment_id").to_pylist()) == listed
+    assert table.column("gone").null_count == len(listed)
+
+    assert export.write_parquet(model, tmp_path / "all.parquet", include_gone=True) == len(apartments)
+    table = pq.read_table(tmp_path / "all.parquet")
+    assert table.column("gone").null_count == len(listed)
+    assert "updated_date" in table.column_names
@@ -0,0 +1,20 @@
+import random
+
+from apartment_scraper.id_sets import SortedIds
+
+
+def test_sorted_ids_match_set() -> None:
+    """The sorted ids answer like a plain set, across the merges of their buffer."""
+    rng = random.Random(1)
+    ids = SortedIds()
+    reference: set[int] = set()
+    for _ in range(5 * SortedIds.BUFFER_SIZE):
+        apartment_id = rng.randrange(600_000_000, 600_010_000)
+        assert (apartment_id in ids) == (apartment_id in reference)
+        ids.add(apartment_id)
+        reference.add(apartment_id)
+
+    assert len(ids) == len(reference)
+    assert all(apartment_id in ids for apartment_id in reference)
+    assert 599_999_999 not in ids  # noqa: PLR2004
+    assert "600000000" not in ids
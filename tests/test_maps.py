@@ -0,0 +1,16 @@
+from pathlib import Path
+
+from apartment_scraper.maps import MapArtifacts
+from apartment_scraper.models import Model
+
+
+def test_databases_have_their_own_maps(tmp_path: Path) -> None:
+    """Two empty databases have the same dataset version, but never share their cached maps."""
+    first = MapArtifacts(Model(f"sqlite:///{tmp_path / 'first.db'}"), directory=tmp_path / "maps")
+    second = MapArtifacts(Model(f"sqlite:///{tmp_path / 'second.db'}"), directory=tmp_path / "maps")
+    assert first.version() == second.version()
+
+    first.build()
+
+    assert first.path(first.version()).exists()
+    assert not second.path(second.version()).exists()
@@ -0,0 +1,78 @@
+import json
+import operator
+import random
+
+import pytest
+
+from apartment_scraper.matching import RANGE_FIELDS, SearchIndex
+from apartment_scraper.models import Apartment, SavedSearch
+from apartment_scraper.willhaben.parse import parse_apartment
+from performance_tests.adverts import make_adverts
+
+
+def random_search(id_: int, rng: random.Random) -> SavedSearch:
+    """A saved search with a random subset of the criteria set."""
+
+    def maybe(value: float) -> float | None:
+        return value if rng.random() < 0.4 else None  # noqa: PLR2004
+
+    post_codes = rng.sample(range(1010, 1240, 10), rng.randint(1, 4))
+    return SavedSearch(
+        id=id_,
+        name=f"search {id_}",
+        post_codes=json.dumps(post_codes) if rng.random() < 0.5 else None,  # noqa: PLR2004
+        min_rooms=maybe(rng.randint(1, 4)),
+        max_rooms=maybe(rng.randint(2, 5)),
+        min_area=maybe(rng.randint(30, 90)),
+        max_area=maybe(rng.randint(60, 150)),
+        min_price=maybe(rng.randint(100, 500) * 1000),
+        max_price=maybe(rng.randint(200, 900) * 1000),
+        min_price_per_area=maybe(rng.randint(3000, 6000)),
+        max_price_per_area=maybe(rng.randint(4000, 9000)),
+        min_free_area=maybe(rng.randint(0, 20)),
+    )
+
+
+def reference_match(searches: list[SavedSearch], apartment: Apartment) -> list[int]:
+    """Evaluate every saved search against an apartment, criterion by criterion."""
+    matches = []
+    for search in searches:
+        post_codes = json.loads(search.post_codes or "null")
+        matched = not post_codes or apartment.post_code in post_codes
+        for field, (lower, upper) in RANGE_FIELDS.items():
+            value = getattr(apartment, field)
+            for attribute, satisfied in ((lower, operator.ge), (upper, operator.le)):
+                bound = getattr(search, attribute) if attribute else None
+                if bound is not None:
+                    matched &= value is not None and satisfied(value, bound)
+        if matched:
+            matches.append(search.id)
+    return matches
+
+
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_index_matches_reference(seed: int) -> None:
+    """The bitmask index finds exactly the searches that evaluating each search finds."""
+    rng = random.Random(seed)
+    searches = [random_search(id_, rng) for id_ in range(1, 301)]
+    apartments = [parse_apartment(advert) for advert in make_adverts(300, seed=seed)]
+    apartments[0].free_area = None
+    apartments[1].price_per_area = None
+
+    index = SearchIndex(searches)
+    for apartment in apartments:
+        assert sorted(index.match(apartment)) == reference_match(searches, apartment)
+
+
+def test_bounds_are_inclusive() -> None:
+    """An apartment exactly on a bound matches the search."""
+    apartment = parse_apartment(make_adverts(1)[0])
+    search = SavedSearch(
+        id=1, name="exact", min_rooms=apartment.rooms, max_rooms=apartment.rooms, max_area=apartment.area
+    )
+    assert SearchIndex([search]).match(apartment) == [1]
+
+
+def test_no_searches_match_nothing() -> None:
+    """An empty index matches no apartment."""
+    assert SearchIndex([]).match_many([parse_apartment(advert) for advert in make_adverts(5)]) == []
@@ -0,0 +1,94 @@
+import json
+import sqlite3
+from pathlib import Path
+
+import pytest
+
+from apartment_scraper.models import CrawlRun, Model
+from apartment_scraper.willhaben.parse import parse_apartment
+from performance_tests.adverts import make_adverts
+
+
+# The apartments table as created before the change feed, clusters, districts, search, deal scores and image table.
+OLD_APARTMENTS_TABLE = """
+CREATE TABLE apartments (
+    id INTEGER NOT NULL PRIMARY KEY, apartment_id INTEGER NOT NULL, status BOOLEAN NOT NULL,
+    product_id VARCHAR NOT NULL, property_type VARCHAR NOT NULL, area INTEGER NOT NULL, url VARCHAR NOT NULL,
+    rooms FLOAT NOT NULL, floor FLOAT NOT NULL, address VARCHAR NOT NULL, post_code INTEGER NOT NULL,
+    location VARCHAR NOT NULL, coordinates VARCHAR, price FLOAT NOT NULL, price_per_area FLOAT,
+    free_area_type VARCHAR, free_area INTEGER, image_urls VARCHAR, advertiser VARCHAR NOT NULL,
+    prio INTEGER NOT NULL, updated DATETIME
+)
+"""
+# The crawl run ledger as created before skipped listings were counted.
+OLD_CRAWL_RUNS_TABLE = """
+CREATE TABLE crawl_runs (
+    id INTEGER NOT NULL PRIMARY KEY, source VARCHAR NOT NULL, area VARCHAR NOT NULL, url VARCHAR NOT NULL,
+    started DATETIME NOT NULL, finished DATETIME, rows_found INTEGER NOT NULL, pages_requested INTEGER NOT NULL,
+    pages_failed INTEGER NOT NULL, parsed INTEGER NOT NULL, inserted INTEGER NOT NULL, updated INTEGER NOT NULL,
+    gone INTEGER NOT NULL, duplicates INTEGER NOT NULL, bytes_transferred INTEGER NOT NULL,
+    p95_page_latency_ms FLOAT, error VARCHAR
+)
+"""
+
+
+@pytest.fixture()
+def model(tmp_path: Path) -> Model:
+    """An empty SQLite database."""
+    return Model(f"sqlite:///{tmp_path / 'apartments.db'}")
+
+
+def test_add_apartment_stores_images(model: Model) -> None:
+    """A single added apartment keeps its image URLs, like the ones added in a batch."""
+    apartment = parse_apartment(make_adverts(1)[0])
+    apartment_id, urls = apartment.apartment_id, apartment.image_urls
+    assert urls
+
+    model.add_apartment(apartment)
+
+    assert model.get_image_urls([apartment_id]) == {apartment_id: urls}
+
+
+def test_pages_are_full_after_filtering(model: Model) -> None:
+    """Gone apartments don't leave gaps in the pages, every page but the last is full."""
+    apartments = [parse_apartment(advert) for advert in make_adverts(30)]
+    for apartment in apartments:
+        apartment.scope = "scope"
+    model.upsert_apartments(apartments)
+    model.mark_gone_apartments("scope", {apartment.apartment_id for apartment in apartments[::3]})
+
+    pages = [model.get_paged_apartment_rows(page, 4, ["apartment_id"]) for page in range(4)]
+
+    assert [page.element_count for page in pages] == [4, 4, 2, 0]
+    assert [row for page in pages for row in page.rows] == [(apartment.apartment_id,) for apartment in apartments[::3]]
+
+
+def test_old_tables_are_upgraded(tmp_path: Path) -> None:
+    """Tables of an older version get the new columns and indexes, keep the newest copy and move the image URLs."""
+    path = tmp_path / "apartments.db"
+    with sqlite3.connect(path) as connection:
+        connection.execute(OLD_APARTMENTS_TABLE)
+        connection.execute(OLD_CRAWL_RUNS_TABLE)
+        for id_, price, urls in ((1, 100_000, ["old.jpg"]), (2, 200_000, ["a.jpg", "b.jpg"])):
+            connection.execute(
+                "INSERT INTO apartments VALUES (?, 600000000, 1, 'p', 'Wohnung', 50, 'url', 2, 1, 'Gasse 1', 1020,"
+                " 'Wien', NULL, ?, NULL, ?, 0, ?, 'advertiser', 0, '2023-10-01 10:00:00.000000')",
+                (id_, price, json.dumps(["Balkon"]), json.dumps(urls)),
+            )
+    connection.close()
+
+    model = Model(f"sqlite:///{path}")
+    Model(f"sqlite:///{path}")  # a second start finds nothing to upgrade
+
+    rows = model.get_apartment_rows([600_000_000], ["apartment_id", "price", "free_area_type", "gone", "modified"])
+    assert len(rows) == 1
+    apartment_id, price, free_area_type, gone, modified = rows[0]
+    assert (apartment_id, price, free_area_type, gone) == (600_000_000, 200_000, ["Balkon"], None)
+    assert modified is not None
+    assert model.get_image_urls([600_000_000]) == {600_000_000: ["a.jpg", "b.jpg"]}
+
+    apartment = parse_apartment(make_adverts(1, offset=1)[0])
+    model.upsert_apartments([apartment])
+    assert [change.apartment_id for change in model.get_changes(None, 10)] == [600_000_000, apartment.apartment_id]
+    model.add_crawl_run(CrawlRun(source="willhaben", area="WIEN", url="url", started=apartment.updated, skipped=3))
+    assert model.get_crawl_runs(1)[0].skipped == 3  # noqa: PLR2004
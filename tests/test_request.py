@@ -0,0 +1,50 @@
+import asyncio
+
+import httpx
+import pytest
+
+from apartment_scraper.willhaben.parse import parse_apartment
+from apartment_scraper.willhaben.request import CrawlStats, NoConnectionError, get_rows_found, keep_latest
+from performance_tests.adverts import make_adverts
+
+
+def count_rows(response: httpx.Response) -> int:
+    """Count the rows of an endpoint that answers with the given response."""
+
+    async def run() -> int:
+        transport = httpx.MockTransport(lambda _: response)
+        async with httpx.AsyncClient(transport=transport) as client:
+            return await get_rows_found(client, "https://www.willhaben.at/search", CrawlStats())
+
+    return asyncio.run(run())
+
+
+def test_rows_found() -> None:
+    """The number of rows is read from the search result."""
+    assert count_rows(httpx.Response(200, json={"rowsFound": 1234})) == 1234  # noqa: PLR2004
+    assert count_rows(httpx.Response(200, json={"rowsFound": None})) == 0
+
+
+@pytest.mark.parametrize(
+    "response",
+    [
+        httpx.Response(503, json={"rowsFound": 1234}),
+        httpx.Response(200, text="<html>Too many requests</html>"),
+        httpx.Response(200, json=["not", "a", "search", "result"]),
+    ],
+)
+def test_bad_response_is_no_connection(response: httpx.Response) -> None:
+    """Error statuses and bodies that aren't search results raise the documented NoConnectionError."""
+    with pytest.raises(NoConnectionError):
+        count_rows(response)
+
+
+def test_latest_copy_is_kept() -> None:
+    """An apartment that shows up on two pages is kept once, with the copy of the page fetched last."""
+    first_page, second_page = ([parse_apartment(advert) for advert in make_adverts(3)] for _ in range(2))
+    second_page[1].price += 1000
+
+    apartments = keep_latest([first_page, second_page[1:2]])
+
+    assert [apartment.apartment_id for apartment in apartments] == [apartment.apartment_id for apartment in first_page]
+    assert apartments[1] is second_page[1]
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from apartment_scraper.scoring import ALL, MIN_GROUP_SIZE, POST_CODE_OFFSET, Reference, group_keys
+
+
+def reference_ranks(groups: np.ndarray, prices_per_area: np.ndarray) -> np.ndarray:
+    """Rank each apartment by counting the cheaper and equally priced apartments of its group one by one."""
+    valid = prices_per_area > 0
+    ranks = np.full(len(groups), np.nan)
+    for position, (group, price) in enumerate(zip(groups, prices_per_area, strict=True)):
+        if not price > 0:
+            continue
+        members = valid & (groups == group)
+        if np.count_nonzero(members) < MIN_GROUP_SIZE:
+            members = valid
+        others = prices_per_area[members]
+        ranks[position] = (np.count_nonzero(others < price) + np.count_nonzero(others == price) / 2) / len(others)
+    return ranks
+
+
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_ranks_match_reference(seed: int) -> None:
+    """The ranks from the sorted keys are the ranks from counting the cheaper apartments of each group."""
+    rng = np.random.default_rng(seed)
+    count = 2000
+    districts = rng.choice([90101, 90102, 90103, 90123, np.nan], count, p=[0.4, 0.3, 0.1, 0.001, 0.199])
+    post_codes = rng.choice([1010, 1020, 3400], count)
+    prices_per_area = np.round(rng.uniform(3000, 9000, count), -2)  # rounded, so that there are ties
+    prices_per_area[rng.random(count) < 0.05] = np.nan  # noqa: PLR2004
+    groups = group_keys(districts, post_codes)
+
+    ranks = Reference(groups, prices_per_area).ranks(groups, prices_per_area)
+
+    np.testing.assert_allclose(ranks, reference_ranks(groups, prices_per_area))
+
+
+def test_group_keys() -> None:
+    """Apartments without district are grouped by post code, apart from the districts."""
+    keys = group_keys(np.array([90102, np.nan]), np.array([1020, 1020]))
+    assert keys.tolist() == [90102, POST_CODE_OFFSET + 1020]
+    assert ALL not in keys
+
+
+def test_small_groups_rank_against_all() -> None:
+    """The only apartment of its district is ranked against all apartments."""
+    groups = np.array([1] * MIN_GROUP_SIZE + [2])
+    prices_per_area = np.array([1000.0, 2000, 3000, 4000, 5000, 10])
+    ranks = Reference(groups, prices_per_area).ranks(groups, prices_per_area)
+    assert ranks[-1] == pytest.approx(0.5 / len(groups))
@@ -0,0 +1,118 @@
+import random
+from collections.abc import Iterator
+from pathlib import Path
+
+import pytest
+from loguru import logger
+
+from apartment_scraper import duplicates, schemas, scoring
+from apartment_scraper.models import SORT_COLUMNS, ApartmentQuery, MapFilter, MarketStats, Model
+from apartment_scraper.snapshot import SnapshotStore
+from apartment_scraper.willhaben.parse import parse_apartment
+from performance_tests.adverts import make_adverts
+
+
+COLUMNS = list(schemas.ApartmentSchema.__fields__)
+FIRST_ID = 600_000_000  # apartment_id of the first generated advert
+SCOPE = "https://www.willhaben.at/iad/immobilien/eigentumswohnung/wien"
+
+
+@pytest.fixture()
+def model(tmp_path: Path) -> Iterator[Model]:
+    """A SQLite database with generated apartments, duplicates, deal scores, gone listings and market statistics."""
+    logger.disable("apartment_scraper")
+    model = Model(f"sqlite:///{tmp_path / 'apartments.db'}")
+    apartments = [parse_apartment(advert) for advert in make_adverts(2000)]
+    for apartment in apartments:
+        apartment.scope = SCOPE
+    model.upsert_apartments(apartments)
+    model.mark_gone_apartments(SCOPE, {apartment.apartment_id for apartment in apartments[100:]})
+    duplicates.assign_clusters(model)
+    scoring.score_deals(model)
+    model.refresh_market_stats()
+    yield model
+    logger.enable("apartment_scraper")
+
+
+def assert_same_results(model: Model, store: SnapshotStore) -> None:
+    """Run the same reads against the database and the snapshot and compare the results."""
+    snapshot = store.get()
+    for page in (0, 3, 19, 25):
+        for one_per_cluster in (False, True):
+            assert snapshot.get_paged_apartment_rows(page, 100, COLUMNS, one_per_cluster) == (
+                model.get_paged_apartment_rows(page, 100, COLUMNS, one_per_cluster)
+            )
+
+    ids = [FIRST_ID + index for index in (0, 5, 150, 1999, 3000)]
+    assert sorted(snapshot.get_apartment_rows(ids, COLUMNS)) == sorted(model.get_apartment_rows(ids, COLUMNS))
+    assert snapshot.get_top_apartment_rows(50, COLUMNS) == model.get_top_apartment_rows(50, COLUMNS)
+
+    rng = random.Random(1)
+    for _ in range(60):
+        query = ApartmentQuery(
+            min_price=rng.choice([None, 300_000]),
+            max_rooms=rng.choice([None, 3]),
+            post_code=rng.choice([None, 1020]),
+            max_price_per_area=rng.choice([None, 6000]),
+            one_per_cluster=rng.random() < 0.5,  # noqa: PLR2004
+            sort_by=rng.choice(SORT_COLUMNS),
+            descending=rng.random() < 0.5,  # noqa: PLR2004
+        )
+        offset = rng.choice([0, 100])
+        assert snapshot.query_apartment_rows(query, COLUMNS, 50, offset) == (
+            model.query_apartment_rows(query, COLUMNS, 50, offset)
+        ), query
+
+    for map_filter in (MapFilter(), MapFilter(min_rooms=3, max_price=400_000, include_projects=True)):
+        assert sorted(snapshot.get_map_points(map_filter)) == sorted(model.get_map_points(map_filter))
+
+    def by_key(market_stats: list[MarketStats]) -> dict[tuple[int, str], dict]:
+        return {(stats.post_code, stats.property_type): stats.dict(exclude={"refreshed"}) for stats in market_stats}
+
+    assert by_key(snapshot.get_market_stats()) == by_key(model.get_market_stats())
+
+
+def test_snapshot_matches_database(model: Model) -> None:
+    """The in-memory snapshot answers every read like the SQL queries of the model."""
+    assert_same_results(model, SnapshotStore(model))
+
+
+def test_refreshed_snapshot_matches_database(model: Model) -> None:
+    """After an incremental refresh, the snapshot still answers like the database."""
+    store = SnapshotStore(model)
+    store.get()
+    assert not store.refresh()
+
+    for index in range(50):
+        model.update_apartment_prio(FIRST_ID + index, 7)
+    relisted = make_adverts(100, seed=9, offset=50)  # half of them were gone
+    model.upsert_apartments([parse_apartment(advert) for advert in relisted + make_adverts(100, seed=9, offset=1950)])
+    model.delete_apartments([FIRST_ID + index for index in range(200, 260)])
+    duplicates.assign_clusters(model)
+    scoring.score_deals(model)
+    model.refresh_market_stats()
+
+    assert store.refresh()
+    assert_same_results(model, store)
+
+
+def test_derived_columns_are_refreshed_incrementally(model: Model, monkeypatch: pytest.MonkeyPatch) -> None:
+    """New deal scores alone reach the snapshot through the changes, without reading the whole table again."""
+    store = SnapshotStore(model)
+    store.get()
+    reads: list[object] = []
+    read_changes = model.get_changed_apartment_rows
+
+    def spy(columns: list[str], since: object) -> object:
+        reads.append(since)
+        return read_changes(columns, since)
+
+    monkeypatch.setattr(model, "get_changed_apartment_rows", spy)
+    ids = [id_ for (id_,) in model.get_apartment_rows([FIRST_ID + index for index in range(10)], ["id"])]
+    model.update_deal_scores({id_: 99.5 for id_ in ids})
+
+    assert store.refresh()
+    assert reads
+    assert None not in reads
+    assert_same_results(model, store)
+    assert not store.refresh()
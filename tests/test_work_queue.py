@@ -0,0 +1,148 @@
+import os
+import time
+import uuid
+from collections.abc import Iterator
+from datetime import datetime
+from pathlib import Path
+from zoneinfo import ZoneInfo
+
+import pytest
+from sqlmodel import Session, delete, select
+
+from apartment_scraper.models import CrawlRun, CrawlTask, CrawlTaskStatus, Model
+from apartment_scraper.willhaben.parse import parse_apartment
+from performance_tests.adverts import make_adverts
+
+
+PRIORITY = -1_000_000  # claimed before any other task of the database the tests run against
+WORKER = "test-worker"
+
+
+@pytest.fixture()
+def url() -> str:
+    """A category url of its own, so the tests don't touch other tasks of the database."""
+    return f"https://www.willhaben.at/test/{uuid.uuid4()}"
+
+
+@pytest.fixture()
+def pg_model(url: str) -> Iterator[Model]:
+    """The scratch PostgreSQL database of DATABASE_URL, as SKIP LOCKED and the leases need concurrent transactions."""
+    database_url = os.environ.get("DATABASE_URL", "")
+    if not database_url.startswith("postgresql"):
+        pytest.skip("DATABASE_URL is not set to a PostgreSQL database")
+    model = Model(database_url)
+    yield model
+    with Session(model.engine) as session:
+        session.execute(delete(CrawlTask).where(CrawlTask.url == url))
+        session.execute(delete(CrawlRun).where(CrawlRun.url == url))
+        session.commit()
+
+
+def enqueue(model: Model, url: str, pages: int, rows_found: int = 0) -> CrawlRun:
+    """Enqueue a crawl of one task per page, with its run."""
+    tasks = [
+        CrawlTask(source="willhaben", area="test", url=url, first_page=page, last_page=page, priority=PRIORITY)
+        for page in range(1, pages + 1)
+    ]
+    started = datetime.now(tz=ZoneInfo("UTC"))
+    run = CrawlRun(source="willhaben", area="test", url=url, started=started, rows_found=rows_found)
+    model.enqueue_crawl_tasks(tasks, run)
+    return run
+
+
+def claim(model: Model, url: str, worker_id: str = WORKER, lease_seconds: float = 60) -> CrawlTask | None:
+    """Claim the next task, None if it isn't one of the test."""
+    task = model.claim_crawl_task(worker_id, lease_seconds, max_attempts=3)
+    return task if task is not None and task.url == url else None
+
+
+def test_last_task_closes_the_run(tmp_path: Path, url: str) -> None:
+    """The run of an enqueued crawl is closed by its last finished task, which marks the unseen apartments as gone."""
+    model = Model(f"sqlite:///{tmp_path / 'apartments.db'}")
+    apartments = [parse_apartment(advert) for advert in make_adverts(6)]
+    for apartment in apartments:
+        apartment.scope = url
+    model.upsert_apartments(apartments)
+    run = enqueue(model, url, pages=2, rows_found=4)
+
+    for page, page_apartments in enumerate((apartments[:2], apartments[2:4])):
+        task = claim(model, url)
+        assert task is not None
+        task.parsed = len(page_apartments)
+        task.apartment_ids = [apartment.apartment_id for apartment in page_apartments]
+        assert model.finish_crawl_task(task, WORKER)
+        closed = model.close_crawl_run(run.id)
+        assert (closed is None) == (page == 0)
+
+    assert closed is not None
+    assert (closed.pages_requested, closed.parsed, closed.gone, closed.error) == (2, 4, 2, None)
+    assert closed.finished is not None
+    assert model.close_crawl_run(run.id) is None
+    ids = [apartment.apartment_id for apartment in apartments]
+    rows = model.get_apartment_rows(ids, ["apartment_id", "gone"])
+    assert {apartment_id for apartment_id, gone in rows if gone} == set(ids[4:])
+
+
+def test_claim_skips_locked_tasks(pg_model: Model, url: str) -> None:
+    """A task locked by another transaction is skipped instead of waited for."""
+    enqueue(pg_model, url, pages=2)
+    with Session(pg_model.engine) as session:
+        locked = session.scalars(
+            select(CrawlTask.id).where(CrawlTask.url == url, CrawlTask.first_page == 1).with_for_update()
+        ).first()
+        assert locked is not None
+
+        task = claim(pg_model, url)
+
+        assert task is not None
+        assert task.first_page == 2  # noqa: PLR2004
+        assert claim(pg_model, url) is None
+
+
+def test_expired_lease_is_reclaimed(pg_model: Model, url: str) -> None:
+    """Once the lease of a dead worker expired, another worker claims the task and the first one lost it."""
+    enqueue(pg_model, url, pages=1)
+    task = claim(pg_model, url, worker_id="dead", lease_seconds=0.2)
+    assert task is not None
+    assert claim(pg_model, url) is None
+
+    time.sleep(0.3)
+    reclaimed = claim(pg_model, url)
+
+    assert reclaimed is not None
+    assert (reclaimed.id, reclaimed.attempts) == (task.id, 2)
+    assert not pg_model.extend_crawl_task_lease(task.id, "dead", 60)
+    assert not pg_model.finish_crawl_task(task, "dead")
+    assert pg_model.extend_crawl_task_lease(reclaimed.id, WORKER, 60)
+    assert pg_model.finish_crawl_task(reclaimed, WORKER)
+
+
+def test_failed_task_is_retried_after_backoff(pg_model: Model, url: str) -> None:
+    """A failed task is available again after the retry delay times its attempts, and fails for good at the last."""
+    run = enqueue(pg_model, url, pages=1)
+    task = claim(pg_model, url)
+    assert task is not None
+
+    assert pg_model.finish_crawl_task(task, WORKER, error="timeout", retry_delay=60)
+    with Session(pg_model.engine) as session:
+        pending = session.get(CrawlTask, task.id)
+        assert pending is not None
+        assert pending.status == CrawlTaskStatus.PENDING
+        assert (pending.available - datetime.now(tz=ZoneInfo("UTC"))).total_seconds() == pytest.approx(60, abs=5)
+    assert claim(pg_model, url) is None
+
+    assert pg_model.finish_crawl_task(task, WORKER, error="timeout", retry_delay=0) is False  # no longer running
+    with Session(pg_model.engine) as session:
+        session.get(CrawlTask, task.id).available = datetime.now(tz=ZoneInfo("UTC"))  # type: ignore[union-attr]
+        session.commit()
+    for attempt in (2, 3):
+        task = claim(pg_model, url)
+        assert task is not None
+        assert task.attempts == attempt
+        assert pg_model.finish_crawl_task(task, WORKER, error="timeout", retry_delay=0)
+
+    assert claim(pg_model, url) is None
+    closed = pg_model.close_crawl_run(run.id)
+    assert closed is not None
+    assert closed.error is not None
+    assert closed.gone == 0